@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+'''fetch_fixtures.py - saves arxiv listing pages as benchmark fixtures.
+
+This downloads the astro-ph /new and /pastweek listing pages from arxiv and
+saves them as benchmarks/fixtures/astro-ph-new.html and astro-ph-pastweek.html,
+then runs the parse_listing.py check that both listing parsers produce the same
+articles from them.
+
+Usage (from the base astroph-coffee directory):
+
+$ python benchmarks/fetch_fixtures.py [--max-entries N] [NEW PASTWEEK]
+
+If two files are given, they're used instead of downloading the pages. Use
+this for pages saved from a browser, which have the markup MathJax leaves
+behind after it renders the math. If --max-entries is given, only the first N
+entries of each section (new submissions, cross-lists, replacements, or each
+day on /pastweek) are kept. The pages are trimmed as text, so the markup of the
+entries that are kept is exactly as arxiv sent it.
+
+'''
+
+import os
+import os.path
+import re
+import sys
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHDIR), 'src'))
+
+import arxivutils
+import parse_listing
+
+LISTING_URLS = ['https://arxiv.org/list/astro-ph/new',
+                'https://arxiv.org/list/astro-ph/pastweek?show=1000']
+
+# these find the listing sections and the entries in them
+DL_REGEX = re.compile(r'(<dl\b[^>]*>)(.*?)(</dl>)', re.S | re.I)
+DT_REGEX = re.compile(r'<dt\b', re.I)
+
+
+
+def trim_listing(htmldoc, max_entries):
+    '''
+    This keeps only the first max_entries entries in each <dl> section of the
+    listing page htmldoc.
+
+    '''
+
+    def trim_section(match):
+
+        section = match.group(2)
+        starts = [x.start() for x in DT_REGEX.finditer(section)]
+
+        if len(starts) > max_entries:
+            section = '%s\n' % section[:starts[max_entries]]
+
+        return '%s%s%s' % (match.group(1), section, match.group(3))
+
+    return DL_REGEX.sub(trim_section, htmldoc)
+
+
+
+def fetch_listing(url):
+    '''
+    This downloads the listing page at url and returns it as bytes.
+
+    '''
+
+    session = arxivutils.get_http_session()
+    response = session.get(url, timeout=arxivutils.REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    return response.content
+
+
+
+def main(saved_pages, max_entries):
+    '''
+    This saves the fixtures and checks them with parse_listing.py.
+
+    '''
+
+    for ind, fixture in enumerate(parse_listing.FIXTURES):
+
+        if saved_pages:
+            print('reading %s' % saved_pages[ind])
+            with open(saved_pages[ind],'rb') as infd:
+                htmldoc = infd.read()
+        else:
+            print('downloading %s' % LISTING_URLS[ind])
+            htmldoc = fetch_listing(LISTING_URLS[ind])
+
+        if max_entries:
+            htmldoc = trim_listing(htmldoc, max_entries)
+
+        with open(fixture,'wb') as outfd:
+            outfd.write(htmldoc)
+
+        print('wrote %s (%s entries)' % (fixture,
+                                         len(DT_REGEX.findall(htmldoc))))
+
+    return parse_listing.main(parse_listing.FIXTURES, 1)
+
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    max_entries = None
+
+    if args and args[0] == '--max-entries':
+        max_entries = int(args[1])
+        args = args[2:]
+
+    if args and len(args) != 2:
+        print('give both the /new and /pastweek pages, or neither')
+        sys.exit(2)
+
+    if not main(args, max_entries):
+        sys.exit(1)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+'''parse_listing.py - benchmarks arxivutils listing parsing.
+
+This parses the saved arxiv listing pages in benchmarks/fixtures with the
+lxml-based parser in arxivutils and with the BeautifulSoup-based parser that it
+replaced (kept below for reference), and reports the parse time and the peak
+memory used. It also checks that both parsers produce the same articles, so it
+doubles as a regression check for the parser.
+
+Usage (from the base astroph-coffee directory):
+
+$ python benchmarks/parse_listing.py [--repeat N] [fixture.html ...]
+
+Each (fixture, parser) combination runs in its own Python process so the peak
+memory numbers don't contaminate each other. The reference parser needs
+BeautifulSoup (pip install beautifulsoup4).
+
+The fixtures can be replaced with the current arxiv pages (or pages saved from
+a browser) using fetch_fixtures.py, which runs this check on them afterwards.
+
+'''
+
+import os
+import os.path
+import sys
+import json
+import time
+import resource
+import subprocess
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHDIR), 'src'))
+
+import arxivutils
+from tornado.escape import squeeze
+
+FIXTURES = [os.path.join(BENCHDIR, 'fixtures', 'astro-ph-new.html'),
+            os.path.join(BENCHDIR, 'fixtures', 'astro-ph-pastweek.html')]
+PARSERS = ['lxml', 'bs4']
+
+
+
+def bs4_parse_listing_entry(link, data, fix_comment_links=True):
+    '''
+    This is the BeautifulSoup version of arxivutils.parse_listing_entry, i.e.
+    how we used to parse each listing entry.
+
+    '''
+
+    if data.p:
+        abstract = squeeze(data.p.text.replace('\n',' ').strip())
+    else:
+        abstract = ''
+
+    title = squeeze(
+        data.find_all(
+            'div',class_='list-title'
+        )[0].text.strip('\n').replace('Title:','',1)
+    )
+
+    authors = (
+        data.find_all(
+            'div',class_='list-authors'
+        )[0].text.strip('\n').replace('Authors:','',1)
+    )
+    authors = [squeeze(x.lstrip('\n').rstrip('\n'))
+               for x in authors.split(', ')]
+
+    entry_links = link.find_all('a')[1:3]
+    entry_link, arxiv_id = entry_links[0]['href'], entry_links[0].text
+    entry_pdf = entry_links[1]['href']
+
+    try:
+        comment_contents = data.find(
+            'div',class_='list-comments'
+        ).contents[2:]
+        comments = squeeze(' '.join(
+            [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
+            ).strip())
+
+        # handle internal arxiv links correctly
+        if fix_comment_links and '<a href="/abs' in comments:
+            comments = comments.replace(
+                '/abs','https://arxiv.org/abs'
+                )
+
+    except AttributeError:
+        comments = ''
+
+    return {'authors':authors,
+            'title':title,
+            'abstract':abstract,
+            'comments':comments,
+            'arxiv':arxiv_id,
+            'link':entry_link,
+            'pdf':entry_pdf}
+
+
+
+def bs4_parse_listing(htmldoc):
+    '''
+    This parses a listing page into a list of article dicts using BeautifulSoup.
+
+    '''
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(htmldoc, 'html.parser')
+    listings = soup.find_all('dl')
+    articles = []
+
+    for ind, listing in enumerate(listings):
+
+        links = listing.find_all('dt')
+        data = listing.find_all('div', class_='meta')
+
+        # on /new pages, the second <dl> holds the cross-lists
+        crosslist = len(listings) == 3 and ind == 1
+
+        for link, meta in zip(links, data):
+
+            article = bs4_parse_listing_entry(
+                link, meta,
+                fix_comment_links=(not crosslist)
+            )
+
+            if crosslist:
+                cltext = link.text
+                try:
+                    cltext = cltext[cltext.index('cross-list'):
+                                    cltext.index('[pdf') - 2]
+                    article['title'] = u'[%s] %s' % (cltext, article['title'])
+                except ValueError:
+                    article['title'] = u'[cross-list] %s' % article['title']
+
+            articles.append(article)
+
+    return articles
+
+
+
+def lxml_parse_listing(htmldoc):
+    '''
+    This parses a listing page into a list of article dicts using arxivutils.
+
+    /new pages (with papers, cross-lists, and replacements) go through the
+    same functions as arxivutils.arxiv_update. Other pages (e.g. /pastweek,
+    which has one <dl> per day) get each <dl> parsed entry by entry.
+
+    '''
+
+    tree = arxivutils.parse_listing_html(htmldoc)
+    docparts = list(tree.iter('dl'))
+
+    if len(docparts) == 3:
+
+        (paperlinks, paperdata,
+         crosslinks, crossdata,
+         replacelinks, replacedata) = arxivutils.get_arxiv_lists(tree)
+
+        paperdict, crossdict = arxivutils.get_arxiv_articles(paperlinks,
+                                                             paperdata,
+                                                             crosslinks,
+                                                             crossdata)
+        replacedict = arxivutils.get_arxiv_replacements(replacelinks,
+                                                        replacedata)
+        articles = (
+            [paperdict[x] for x in sorted(paperdict)] +
+            [crossdict[x] for x in sorted(crossdict)] +
+            [replacedict[x] for x in sorted(replacedict)]
+        )
+
+    else:
+
+        articles = []
+
+        for listing in docparts:
+            links, data = arxivutils.get_listing_entries(listing)
+            articles.extend([arxivutils.parse_listing_entry(x, y)
+                             for x, y in zip(links, data)])
+
+    return articles
+
+
+
+def parse_listing(htmldoc, parser):
+    '''
+    This parses a listing page into a list of article dicts with parser.
+
+    '''
+
+    if parser == 'bs4':
+        return bs4_parse_listing(htmldoc)
+    else:
+        return lxml_parse_listing(htmldoc)
+
+
+
+def run_child(fixture, parser, repeat):
+    '''
+    This runs the benchmark for one fixture and parser and prints the results
+    as JSON.
+
+    '''
+
+    with open(fixture,'rb') as infd:
+        htmldoc = infd.read().decode('utf-8')
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+
+    for x in range(repeat):
+        start = time.time()
+        articles = parse_listing(htmldoc, parser)
+        timings.append(time.time() - start)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({'fixture':os.path.basename(fixture),
+                      'parser':parser,
+                      'narticles':len(articles),
+                      'best':min(timings),
+                      'mean':sum(timings)/len(timings),
+                      'peak_kb':rss_after - rss_before,
+                      'articles':articles}))
+
+
+
+def main(fixtures, repeat):
+    '''
+    This runs all the (fixture, parser) combinations and prints a report.
+
+    '''
+
+    print('%-26s %-12s %9s %10s %10s %12s' % ('fixture', 'parser', 'articles',
+                                             'best (s)', 'mean (s)',
+                                             'peak (KB)'))
+    allok = True
+
+    for fixture in fixtures:
+
+        outputs = []
+
+        for parser in PARSERS:
+
+            proc = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__),
+                 '--child', fixture, parser, str(repeat)],
+                stdout=subprocess.PIPE
+            )
+            stdout, stderr = proc.communicate()
+            results = json.loads(stdout.strip().split('\n')[-1])
+
+            print('%-26s %-12s %9s %10.4f %10.4f %12s' % (results['fixture'],
+                                                           results['parser'],
+                                                           results['narticles'],
+                                                           results['best'],
+                                                           results['mean'],
+                                                           results['peak_kb']))
+            outputs.append(results['articles'])
+
+        if any(x != outputs[0] for x in outputs[1:]):
+            print('%s: parsers do not produce identical articles!' %
+                  os.path.basename(fixture))
+            allok = False
+
+    if allok:
+        print('all parsers produced identical articles')
+
+    return allok
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit(0)
+
+    args = sys.argv[1:]
+    repeat = 5
+
+    if args and args[0] == '--repeat':
+        repeat = int(args[1])
+        args = args[2:]
+
+    fixtures = args if args else FIXTURES
+
+    if not main(fixtures, repeat):
+        sys.exit(1)
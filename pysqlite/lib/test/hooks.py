@@ -169,6 +169,62 @@ class ProgressTests(unittest.TestCase):
         con.execute("select 1 union select 2 union select 3").fetchall()
         self.assertEqual(len(action), 0, "progress handler was not cleared")
 
+class ProfileTests(unittest.TestCase):
+    def CheckProfileCallbackUsed(self):
+        """
+        Test that the profile callback gets the expanded SQL and the run time
+        of each statement.
+        """
+        con = sqlite.connect(":memory:")
+        profiled = []
+        def profile(sql, nanoseconds):
+            profiled.append((sql, nanoseconds))
+        con.set_profile_callback(profile)
+        con.execute("create table foo(a, b)")
+        con.execute("insert into foo(a, b) values (?, ?)", (1, u"x"))
+        con.execute("select a from foo where b = ?", (u"x",)).fetchall()
+        statements = [sql for sql, nanoseconds in profiled]
+        self.assertTrue("create table foo(a, b)" in statements)
+        if sqlite.sqlite_version_info >= (3, 14, 0):
+            self.assertTrue("select a from foo where b = 'x'" in statements)
+        for sql, nanoseconds in profiled:
+            self.assertTrue(isinstance(sql, unicode))
+            self.assertTrue(isinstance(nanoseconds, (int, long)))
+            self.assertTrue(nanoseconds >= 0)
+
+    def CheckClearCallback(self):
+        """
+        Test that setting the profile callback to None clears the previously
+        set callback.
+        """
+        con = sqlite.connect(":memory:")
+        profiled = []
+        def profile(sql, nanoseconds):
+            profiled.append(sql)
+        con.set_profile_callback(profile)
+        con.set_profile_callback(None)
+        con.execute("select 1 union select 2 union select 3").fetchall()
+        self.assertEqual(len(profiled), 0, "profile callback was not cleared")
+
+    def CheckCallbackNotCallable(self):
+        con = sqlite.connect(":memory:")
+        try:
+            con.set_profile_callback(42)
+            self.fail("should have raised a TypeError")
+        except TypeError, e:
+            self.assertEqual(e.args[0], "parameter must be callable")
+
+    def CheckCallbackError(self):
+        """
+        Test that errors raised by the profile callback don't stop the
+        statement.
+        """
+        con = sqlite.connect(":memory:")
+        def profile(sql, nanoseconds):
+            raise ValueError
+        con.set_profile_callback(profile)
+        self.assertEqual(con.execute("select 5").fetchall(), [(5,)])
+
 class LimitTests(unittest.TestCase):
     def CheckGetLimit(self):
         """
@@ -192,8 +248,9 @@ class LimitTests(unittest.TestCase):
 def suite():
     collation_suite = unittest.makeSuite(CollationTests, "Check")
     progress_suite = unittest.makeSuite(ProgressTests, "Check")
+    profile_suite = unittest.makeSuite(ProfileTests, "Check")
     limit_suite = unittest.makeSuite(LimitTests, "Check")
-    return unittest.TestSuite((collation_suite, progress_suite, limit_suite))
+    return unittest.TestSuite((collation_suite, progress_suite, profile_suite, limit_suite))
 
 def test():
     runner = unittest.TextTestRunner()
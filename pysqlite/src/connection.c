@@ -936,6 +936,93 @@ static int _progress_handler(void* user_arg)
     return rc;
 }
 
+#if SQLITE_VERSION_NUMBER >= 3014000
+static int _profile_callback(unsigned int event, void* user_arg, void* prepared_statement, void* statement_nanoseconds)
+{
+    sqlite3_stmt* statement = (sqlite3_stmt*)prepared_statement;
+    sqlite3_int64 nanoseconds = *(sqlite3_int64*)statement_nanoseconds;
+    char* expanded_sql;
+    const char* sql;
+    PyObject* py_sql;
+    PyObject* ret;
+#ifdef WITH_THREAD
+    PyGILState_STATE gilstate;
+#endif
+
+    if (event != SQLITE_TRACE_PROFILE) {
+        return 0;
+    }
+
+#ifdef WITH_THREAD
+    gilstate = PyGILState_Ensure();
+#endif
+
+    /* the SQL with its parameters filled in, or the SQL as it was prepared if
+     * that isn't available */
+    expanded_sql = sqlite3_expanded_sql(statement);
+    sql = expanded_sql ? expanded_sql : sqlite3_sql(statement);
+
+    py_sql = PyUnicode_DecodeUTF8(sql, strlen(sql), "replace");
+    sqlite3_free(expanded_sql);
+
+    if (py_sql) {
+        ret = PyObject_CallFunction((PyObject*)user_arg, "OL", py_sql, (PY_LONG_LONG)nanoseconds);
+        Py_DECREF(py_sql);
+    } else {
+        ret = NULL;
+    }
+
+    if (!ret) {
+        if (_enable_callback_tracebacks) {
+            PyErr_Print();
+        } else {
+            PyErr_Clear();
+        }
+    } else {
+        Py_DECREF(ret);
+    }
+
+#ifdef WITH_THREAD
+    PyGILState_Release(gilstate);
+#endif
+    return 0;
+}
+#else
+static void _profile_callback(void* user_arg, const char* sql, sqlite3_uint64 nanoseconds)
+{
+    PyObject* py_sql;
+    PyObject* ret;
+#ifdef WITH_THREAD
+    PyGILState_STATE gilstate;
+
+    gilstate = PyGILState_Ensure();
+#endif
+
+    py_sql = PyUnicode_DecodeUTF8(sql, strlen(sql), "replace");
+
+    if (py_sql) {
+        ret = PyObject_CallFunction((PyObject*)user_arg, "OL", py_sql, (PY_LONG_LONG)nanoseconds);
+        Py_DECREF(py_sql);
+    } else {
+        ret = NULL;
+    }
+
+    if (!ret) {
+        if (_enable_callback_tracebacks) {
+            PyErr_Print();
+        } else {
+            PyErr_Clear();
+        }
+    } else {
+        Py_DECREF(ret);
+    }
+
+#ifdef WITH_THREAD
+    PyGILState_Release(gilstate);
+#endif
+}
+#endif
+
 static PyObject* pysqlite_connection_get_limit(pysqlite_Connection* self, PyObject* args, PyObject* kwargs)
 {
     int limit_id;
@@ -1037,6 +1124,48 @@ static PyObject* pysqlite_connection_set_progress_handler(pysqlite_Connection* s
     return Py_None;
 }
 
+static PyObject* pysqlite_connection_set_profile_callback(pysqlite_Connection* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* profile_callback;
+
+    static char *kwlist[] = { "profile_callback", NULL };
+
+    if (!pysqlite_check_thread(self) || !pysqlite_check_connection(self)) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O:set_profile_callback",
+                                      kwlist, &profile_callback)) {
+        return NULL;
+    }
+
+    if (profile_callback == Py_None) {
+        /* None clears the profile callback previously set */
+#if SQLITE_VERSION_NUMBER >= 3014000
+        sqlite3_trace_v2(self->db, 0, 0, (void*)0);
+#else
+        sqlite3_profile(self->db, 0, (void*)0);
+#endif
+    } else {
+        if (!PyCallable_Check(profile_callback)) {
+            PyErr_SetString(PyExc_TypeError, "parameter must be callable");
+            return NULL;
+        }
+
+        if (PyDict_SetItem(self->function_pinboard, profile_callback, Py_None) == -1)
+            return NULL;
+
+#if SQLITE_VERSION_NUMBER >= 3014000
+        sqlite3_trace_v2(self->db, SQLITE_TRACE_PROFILE, _profile_callback, profile_callback);
+#else
+        sqlite3_profile(self->db, _profile_callback, profile_callback);
+#endif
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 #ifdef HAVE_LOAD_EXTENSION
 static PyObject* pysqlite_enable_load_extension(pysqlite_Connection* self, PyObject* args)
 {
@@ -1627,6 +1756,8 @@ static PyMethodDef connection_methods[] = {
     #endif
     {"set_progress_handler", (PyCFunction)pysqlite_connection_set_progress_handler, METH_VARARGS|METH_KEYWORDS,
         PyDoc_STR("Sets progress handler callback. Non-standard.")},
+    {"set_profile_callback", (PyCFunction)pysqlite_connection_set_profile_callback, METH_VARARGS|METH_KEYWORDS,
+        PyDoc_STR("Sets profile callback, called with the SQL and run time in nanoseconds of each statement. Non-standard.")},
     {"execute", (PyCFunction)pysqlite_connection_execute, METH_VARARGS,
         PyDoc_STR("Executes a SQL statement. Non-standard.")},
     {"executemany", (PyCFunction)pysqlite_connection_executemany, METH_VARARGS,
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+# This makes the gzipped (and brotli-compressed, if the brotli package is
+# installed) copies of the CSS, JS, and font files in the static directory
+# that the server sends to browsers that accept them. Run this after every
+# install or update of the run directory; make install and make update do this
+# automatically. Files that haven't changed since the last run are skipped.
+#
+# Example:
+# shell/compress_static.sh /path/to/astroph-coffee/run
+
+
+if [ $# -lt 1 ]
+then
+    echo "Usage: $0 <astroph-coffee run directory>"
+    exit 2
+fi
+
+
+BINDIR=`readlink -e $1`
+
+cd $BINDIR
+source $BINDIR/bin/activate
+
+python - <<PYEOF
+import coffeestatic
+coffeestatic.precompress_static('static')
+PYEOF
+
+deactivate
+
+cd -
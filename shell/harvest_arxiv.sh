@@ -0,0 +1,41 @@
+#!/bin/bash
+
+# This backfills the database with historical astro-ph articles from arxiv's
+# OAI-PMH interface. The harvest checkpoints its progress in the cache
+# directory, so if it's interrupted, just run it again with the same dates.
+#
+# Example (harvest everything added or changed in 2017):
+# shell/harvest_arxiv.sh /path/to/astroph-coffee 2017-01-01 2017-12-31 > \
+# /path/to/astroph-coffee/run/logs/arxiv-harvest.log 2>&1
+
+
+if [ $# -lt 3 ]
+then
+    echo "Usage: $0 <astroph-coffee basepath> <from YYYY-MM-DD> <until YYYY-MM-DD>"
+    exit 2
+fi
+
+
+BASEPATH=$1
+FROMDATE=$2
+UNTILDATE=$3
+
+echo "arxiv harvest started at:" `date`
+echo "astro-coffee server directory: $BASEPATH"
+
+cd $BASEPATH/run
+source $BASEPATH/run/bin/activate
+
+python - <<EOF
+from datetime import datetime
+import arxivharvest
+arxivharvest.harvest(
+    from_date=datetime.strptime('$FROMDATE', '%Y-%m-%d').date(),
+    until_date=datetime.strptime('$UNTILDATE', '%Y-%m-%d').date()
+)
+EOF
+
+deactivate
+
+echo "arxiv harvest ended at: " `date`
+cd -
@@ -8,7 +8,7 @@ source $BINDIR/bin/activate
 pip install pip -U
 pip install tornado -U
 pip install requests -U
-pip install BeautifulSoup4 -U
+pip install lxml -U
 pip install selenium -U
 pip install pytz -U
 pip install itsdangerous -U
@@ -19,9 +19,20 @@ pip install py2-ipaddress -U
 pip install python-levenshtein>=0.12
 pip install fuzzywuzzy -U
 
+# for brotli compression of pages and static files (optional, gzip is used
+# if this isn't installed)
+pip install brotli -U
+
 # for sorting and stuff
 pip install numpy -U
 
+# for pre-rendering the math in titles and abstracts (optional, MathJax in the
+# browser typesets these if node.js or this isn't installed)
+if command -v npm > /dev/null 2>&1
+then
+    npm install --prefix $BINDIR mathjax-node-page
+fi
+
 cd pysqlite
 
 echo "Building sqlite3 command shell..."
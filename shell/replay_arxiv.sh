@@ -0,0 +1,47 @@
+#!/bin/bash
+
+# This puts the arxiv listings saved in the listing archive (in the cache
+# directory) back into the database, without going to arxiv. Use this to
+# rebuild the database after a schema change or to re-tag local authors. The
+# start and end dates are optional; leave them out to replay everything.
+#
+# Example (replay and re-tag everything from March 2018):
+# shell/replay_arxiv.sh /path/to/astroph-coffee 2018-03-01 2018-03-31 > \
+# /path/to/astroph-coffee/run/logs/arxiv-replay.log 2>&1
+
+
+if [ $# -lt 1 ]
+then
+    echo "Usage: $0 <astroph-coffee basepath> [start YYYY-MM-DD] [end YYYY-MM-DD]"
+    exit 2
+fi
+
+
+BASEPATH=$1
+STARTDATE=$2
+ENDDATE=$3
+
+echo "arxiv replay started at:" `date`
+echo "astro-coffee server directory: $BASEPATH"
+
+cd $BASEPATH/run
+source $BASEPATH/run/bin/activate
+
+python - <<EOF
+from datetime import datetime
+import arxivingest
+
+def getdate(datestr):
+    if datestr:
+        return datetime.strptime(datestr, '%Y-%m-%d').date()
+    return None
+
+arxivingest.replay_listings(start_date=getdate('$STARTDATE'),
+                            end_date=getdate('$ENDDATE'),
+                            retag=True)
+EOF
+
+deactivate
+
+echo "arxiv replay ended at: " `date`
+cd -
@@ -22,8 +22,11 @@ echo "astro-coffee server directory: $BASEPATH"
 cd $BASEPATH/run
 source $BASEPATH/run/bin/activate
 
-# fakery = False means one can run this on a headless server
-python -c 'import arxivutils, arxivdb; x = arxivutils.arxiv_update(fakery=False); arxivdb.insert_articles(x)'
+# this runs on a headless server. the listing is only parsed and inserted if it
+# changed since the last successful update; the fetch state for this is kept in
+# the cache directory (see conf/astroph.conf). a JSON report with the time taken
+# by each stage of the ingest is written to the logs directory
+python -c 'import arxivingest; arxivingest.ingest_arxiv_listing()'
 
 deactivate
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+'''archivecache.py - Oct 2026
+
+This keeps the rendered paper listings for past archive days in the cache
+directory, so the archive pages for these don't need to query the DB or
+render the listing template again on every view.
+
+Each past day gets one HTML file under the cache directory:
+
+cache/archive/YYYY/YYYYMMDD.html
+
+which mirrors the /astroph-coffee/archive/YYYYMMDD URL. The file holds the
+part of the archive page that's the same for everyone; the per-user parts
+(the top bar, the flash messages, the user's own reservations) are put around
+it by the ArchiveHandler.
+
+Each file starts with the change count of its day's listing when it was
+rendered (see arxivdb.get_listing_changes). A cached listing is only used if
+this is still the current change count, so votes, reservations, edits, and
+updates to the articles listed on a day all cause it to be rendered again on
+the next view.
+
+'''
+
+import os
+import os.path
+import hashlib
+import shutil
+import ConfigParser
+from datetime import datetime
+
+from pytz import utc
+
+import metrics
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the listings are cached here
+if CONF.has_option('paths','cache'):
+    CACHEDIR = CONF.get('paths','cache')
+else:
+    CACHEDIR = 'cache'
+
+# the subdirectory of the cache directory for the archive listings
+ARCHIVE_CACHE_DIR = 'archive'
+
+
+
+def archive_listing_path(listingdate, cachedir=None):
+    '''
+    This returns the path to the cached listing for listingdate (a
+    datetime.date or a YYYY-MM-DD string).
+
+    '''
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    if isinstance(listingdate, basestring):
+        listingdate = datetime.strptime(listingdate, '%Y-%m-%d')
+
+    return os.path.join(cachedir,
+                        ARCHIVE_CACHE_DIR,
+                        listingdate.strftime('%Y'),
+                        listingdate.strftime('%Y%m%d.html'))
+
+
+
+def load_archive_listing(listingdate, changes, cachedir=None):
+    '''
+    This loads the cached listing for listingdate, if it was rendered when the
+    listing's change count was changes.
+
+    Returns a dict with the HTML of the listing, its ETag (the SHA1 of the
+    HTML), and the time it was rendered as a UTC datetime, or None if the
+    listing isn't in the cache or is out of date.
+
+    '''
+
+    listing_path = archive_listing_path(listingdate, cachedir=cachedir)
+
+    try:
+
+        with open(listing_path,'rb') as infd:
+            listing_changes = infd.readline().strip()
+            html = infd.read()
+            modified = os.fstat(infd.fileno()).st_mtime
+
+    except (IOError, OSError):
+        metrics.count_cache('archive_listing', False)
+        return None
+
+    if listing_changes != '%s' % changes:
+        metrics.count_cache('archive_listing', False)
+        return None
+
+    metrics.count_cache('archive_listing', True)
+    return {'html':html.decode('utf-8'),
+            'etag':hashlib.sha1(html).hexdigest(),
+            'last_modified':datetime.fromtimestamp(modified, tz=utc)}
+
+
+
+def save_archive_listing(listingdate, html, changes, cachedir=None):
+    '''
+    This saves the rendered listing for listingdate to the cache, along with
+    the change count of the listing it was rendered from.
+
+    Returns the same dict as load_archive_listing.
+
+    '''
+
+    listing_path = archive_listing_path(listingdate, cachedir=cachedir)
+
+    if not os.path.exists(os.path.dirname(listing_path)):
+        try:
+            os.makedirs(os.path.dirname(listing_path))
+        except OSError:
+            # someone else made it first
+            pass
+
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+
+    # write to a temp file and move it into place, so a listing that's being
+    # written is never served
+    temp_path = '%s.%s.tmp' % (listing_path, os.getpid())
+
+    with open(temp_path,'wb') as outfd:
+        outfd.write('%s\n' % changes)
+        outfd.write(html)
+    os.rename(temp_path, listing_path)
+
+    return load_archive_listing(listingdate, changes, cachedir=cachedir)
+
+
+
+def invalidate_archive_listings(listingdates=None, cachedir=None):
+    '''
+    This removes the cached listings for listingdates (a list of
+    datetime.dates or YYYY-MM-DD strings) from the cache. If listingdates is
+    None, all cached listings are removed (e.g. after the listing templates
+    change).
+
+    Returns the number of listings removed (or None if all were removed).
+
+    '''
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    if listingdates is None:
+        shutil.rmtree(os.path.join(cachedir, ARCHIVE_CACHE_DIR),
+                      ignore_errors=True)
+        return None
+
+    nremoved = 0
+
+    for listingdate in set(listingdates):
+
+        try:
+            os.remove(archive_listing_path(listingdate, cachedir=cachedir))
+            nremoved = nremoved + 1
+        except OSError:
+            pass
+
+    return nremoved
+
@@ -22,12 +22,16 @@ import ConfigParser
 from datetime import datetime, date, timedelta
 from pytz import utc
 import re
+import hashlib
 
 from tornado.escape import squeeze
 
 # for matching local author names
 from fuzzywuzzy import process
 
+# to profile the queries
+import sqlprofile
+
 # to get rid of parens in author names
 # these are applied in order
 
@@ -40,6 +44,10 @@ affil_regex1 = re.compile(r'\([0-9, &and]+\)')
 # this gets rid of patterns like (blah)
 affil_regex2 = re.compile(r'\([^)]*\)')
 
+# this matches the [cross-list from ...] annotation at the start of cross-list
+# titles
+crosslist_regex = re.compile(r'^\[[^\]]*\] ')
+
 
 CONF = ConfigParser.ConfigParser()
 CONF.read('conf/astroph.conf')
@@ -62,7 +70,8 @@ def opendb():
     '''
 
     db = sqlite3.connect(
-        DBPATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES
+        DBPATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+        factory=sqlprofile.ProfilingConnection
         )
 
     cur = db.cursor()
@@ -219,19 +228,151 @@ def strip_affils(authorstr, subchar=','):
 
 
 
+def match_local_authors(arxivid,
+                        authors,
+                        local_authors,
+                        local_author_fnames,
+                        local_emails,
+                        firstname_match_threshold=99,
+                        fullname_match_threshold=99,
+                        verbose=False):
+    '''
+    This matches the authors of a single paper to the local authors.
+
+    authors is the comma-separated author string of the paper with arxiv ID
+    arxivid. local_authors, local_author_fnames, and local_emails are from
+    get_local_authors_from_db.
+
+    Returns a tuple of the author list with the affiliations stripped (this is
+    what should be saved to the DB for papers with local authors so the author
+    indices line up), the indices of the matched local authors in this list,
+    and their special affiliations.
+
+    '''
+
+    # get rid of the affiliations for matching to local authors
+    paper_authors = strip_affils(authors)
+
+    # we'll save this initial cleaned version back to the database for local
+    # matched papers so all the author indices line up correctly
+    cleaned_paper_authors = paper_authors[::]
+
+    if verbose:
+        print('%s authors: %s' % (arxivid, repr(cleaned_paper_authors)))
+
+    # normalize these names so we can compare them more robustly to the local
+    # authors
+    paper_authors = [x.lower().strip() for x in paper_authors]
+    paper_authors = [x.strip() for x in paper_authors if len(x) > 1]
+    paper_authors = [x.replace('.',' ') for x in paper_authors]
+    paper_authors = [squeeze(x) for x in paper_authors]
+
+    paper_author_fnames = [x.split() for x in paper_authors]
+    paper_author_fnames = [''.join([x[0][0],x[-1]]) for x
+                           in paper_author_fnames]
+    paper_authors = [x.replace(' ','') for x in paper_authors]
+
+    if verbose:
+        print("%s normalized authors: %s" % (arxivid,
+                                             repr(paper_authors)))
+
+
+    local_matched_author_inds = []
+    local_matched_author_affils = []
+
+    # match to the flastname first, then if that works, try another match with
+    # fullname. if both work, then we accept this as a local author match
+    for paper_author, paper_fname, paper_author_ind in zip(
+            paper_authors,
+            paper_author_fnames,
+            range(len(paper_authors))
+    ):
+
+        matched_author_fname = process.extractOne(
+            paper_fname,
+            local_author_fnames,
+            score_cutoff=firstname_match_threshold
+        )
+
+        matched_author_full = process.extractOne(
+            paper_author,
+            local_authors,
+            score_cutoff=fullname_match_threshold
+        )
+
+
+        if matched_author_fname and matched_author_full:
+
+            print(
+                '%s: %s, matched paper author: %s '
+                'to local author: %s. '
+                'first name score: %s, full name score: %s' % (
+                    arxivid,
+                    paper_authors,
+                    paper_author,
+                    matched_author_full[0],
+                    matched_author_fname[1],
+                    matched_author_full[1],
+                )
+            )
+
+            # update the paper author index column so we can highlight them in
+            # the frontend
+            local_matched_author_inds.append(paper_author_ind)
+
+            # also update the affilation tag for this author
+            local_authind = local_authors.index(matched_author_full[0])
+
+            # get the corresponding email
+            local_matched_email = local_emails[local_authind]
+
+            # split to get the affil tag
+            local_matched_affil = local_matched_email.split('@')[-1]
+
+            if local_matched_affil in AFFIL_DICT:
+
+                local_matched_author_affils.append(
+                    AFFIL_DICT[local_matched_affil]
+                )
+
+            # now that we have all the special affils, compress them into only
+            # the unique ones
+            local_matched_author_affils = list(set(
+                local_matched_author_affils
+            ))
+
+    return (cleaned_paper_authors,
+            local_matched_author_inds,
+            local_matched_author_affils)
+
+
+
 def tag_local_authors(arxiv_date,
                       database=None,
                       firstname_match_threshold=99,
                       fullname_match_threshold=99,
                       update_db=False,
-                      verbose=False):
+                      verbose=False,
+                      arxiv_ids=None,
+                      table='arxiv'):
 
     '''
     This finds all local authors for all papers on the date arxiv_date and tags
     the rows for them in the DB.
 
+    If arxiv_ids is a list of arxiv IDs, only those papers on arxiv_date are
+    looked at. update_replacements uses this to avoid re-tagging (and
+    re-writing the FTS index for) papers that didn't change.
+
+    table is the table to tag: 'arxiv' or 'arxiv_staging' (used by
+    insert_articles to tag papers before they're published).
+
     '''
 
+    if table not in ('arxiv', 'arxiv_staging'):
+        print('unknown table to tag: %s' % table)
+        return False
+
     # open the database if needed and get a cursor
     if not database:
         database, cursor = opendb()
@@ -248,8 +389,15 @@ def tag_local_authors(arxiv_date,
     if len(local_authors) > 0:
 
         # get all the authors for this date
-        query = 'select arxiv_id, authors from arxiv where utcdate = date(?)'
+        query = ('select arxiv_id, authors from %s where utcdate = date(?)' %
+                 table)
         query_params = (arxiv_date,)
+
+        if arxiv_ids:
+            placeholders = ', '.join('?' for x in arxiv_ids)
+            query = '%s and arxiv_id in (%s)' % (query, placeholders)
+            query_params = tuple([arxiv_date] + list(arxiv_ids))
+
         cursor.execute(query, query_params)
         rows = cursor.fetchall()
 
@@ -259,108 +407,18 @@ def tag_local_authors(arxiv_date,
 
             for row in rows:
 
-                paper_authors = row[1]
-
-                # get rid of the affiliations for matching to local authors
-                paper_authors = strip_affils(paper_authors)
-
-                # we'll save this initial cleaned version back to the database
-                # for local matched papers so all the author indices line up
-                # correctly
-                cleaned_paper_authors = paper_authors[::]
-
-                if verbose:
-                    print('%s authors: %s' % (row[0],
-                                              repr(cleaned_paper_authors)))
-
-                # normalize these names so we can compare them more robustly to
-                # the local authors
-                paper_authors = [x.lower().strip() for x in paper_authors]
-                paper_authors = [x.strip() for x in paper_authors if len(x) > 1]
-                paper_authors = [x.replace('.',' ') for x in paper_authors]
-                paper_authors = [squeeze(x) for x in paper_authors]
-
-                paper_author_fnames = [x.split() for x in paper_authors]
-                paper_author_fnames = [''.join([x[0][0],x[-1]]) for x
-                                      in paper_author_fnames]
-                paper_authors = [x.replace(' ','') for x in paper_authors]
-
-                if verbose:
-                    print("%s normalized authors: %s" % (row[0],
-                                                         repr(paper_authors)))
-
-
-                local_matched_author_inds = []
-                local_matched_author_affils = []
-
-                # match to the flastname first, then if that works, try another
-                # match with fullname. if both work, then we accept this as a
-                # local author match
-                for paper_author, paper_fname, paper_author_ind in zip(
-                        paper_authors,
-                        paper_author_fnames,
-                        range(len(paper_authors))
-                ):
-
-                    matched_author_fname = process.extractOne(
-                        paper_fname,
-                        local_author_fnames,
-                        score_cutoff=firstname_match_threshold
-                    )
-
-                    matched_author_full = process.extractOne(
-                        paper_author,
-                        local_authors,
-                        score_cutoff=fullname_match_threshold
-                    )
-
-
-                    if matched_author_fname and matched_author_full:
-
-                        print(
-                            '%s: %s, matched paper author: %s '
-                            'to local author: %s. '
-                            'first name score: %s, full name score: %s' % (
-                                row[0],
-                                paper_authors,
-                                paper_author,
-                                matched_author_full[0],
-                                matched_author_fname[1],
-                                matched_author_full[1],
-                            )
-                        )
-
-                        # update the paper author index column so we can
-                        # highlight them in the frontend
-                        local_matched_author_inds.append(paper_author_ind)
-
-                        # also update the affilation tag for this author
-                        local_authind = local_authors.index(
-                            matched_author_full[0]
-                        )
-
-                        # get the corresponding email
-                        local_matched_email = local_emails[local_authind]
-
-                        # split to get the affil tag
-                        local_matched_affil = (
-                            local_matched_email.split('@')[-1]
-                        )
-
-                        if local_matched_affil in AFFIL_DICT:
-
-                            local_matched_author_affils.append(
-                                AFFIL_DICT[local_matched_affil]
-                            )
-
-                        # now that we have all the special affils, compress
-                        # them into only the unique ones
-                        local_matched_author_affils = list(set(
-                            local_matched_author_affils
-                        ))
-                #
-                # done with all authors for this paper
-                #
+                (cleaned_paper_authors,
+                 local_matched_author_inds,
+                 local_matched_author_affils) = match_local_authors(
+                     row[0],
+                     row[1],
+                     local_authors,
+                     local_author_fnames,
+                     local_emails,
+                     firstname_match_threshold=firstname_match_threshold,
+                     fullname_match_threshold=fullname_match_threshold,
+                     verbose=verbose
+                 )
 
                 # now update the info for this paper
                 if len(local_matched_author_inds) > 0 and update_db:
@@ -378,13 +436,13 @@ def tag_local_authors(arxiv_date,
                     )
 
                     cursor.execute(
-                        'update arxiv set '
+                        'update %s set '
                         'authors = ?, '
                         'local_authors = ?, '
                         'local_author_indices = ?, '
                         'local_author_specaffils = ? '
                         'where '
-                        'arxiv_id = ?',
+                        'arxiv_id = ?' % table,
                         (','.join(cleaned_paper_authors),
                          True,
                          local_author_indices,
@@ -422,6 +480,383 @@ def tag_local_authors(arxiv_date,
 
 ## INSERTING ARTICLES
 
+def article_content_hash(title, authors, comments, abstract):
+    '''
+    This returns a SHA1 hash of the metadata for an article as scraped from
+    arXiv. insert_articles stores this in the content_hash column so it can tell
+    if an article already in the DB has actually changed.
+
+    '''
+
+    hashbase = u'\x1f'.join([title, authors, comments, abstract])
+    return hashlib.sha1(hashbase.encode('utf-8')).hexdigest()
+
+
+
+def create_staging_table(cursor):
+    '''This creates the arxiv_staging table used by insert_articles if it
+    doesn't exist yet, and empties it if it does.
+
+    The staging table is a TEMP table, so it's private to the connection that
+    made it and writing to it doesn't take the write lock on the main database.
+    The target_rowid column holds the rowid of the matching row in the arxiv
+    table (or NULL if the article is new).
+
+    '''
+
+    cursor.execute(
+        'create temp table if not exists arxiv_staging ('
+        'utctime datetime, '
+        'utcdate date, '
+        'day_serial integer, '
+        'title text, '
+        'article_type text, '
+        'arxiv_id text, '
+        'authors text, '
+        'comments text, '
+        'abstract text, '
+        'link text, '
+        'pdf text, '
+        'local_authors boolean default false, '
+        'local_author_indices text, '
+        'local_author_specaffils text, '
+        'content_hash text, '
+        'target_rowid integer'
+        ')'
+    )
+    cursor.execute('delete from arxiv_staging')
+
+
+
+def stage_article(cursor,
+                  arxiv_dt,
+                  day_serial,
+                  article_type,
+                  arxivid,
+                  title,
+                  authors,
+                  comments,
+                  abstract,
+                  link,
+                  pdf,
+                  content_hash=None,
+                  local_authors=False,
+                  local_author_indices=None,
+                  local_author_specaffils=None,
+                  target_rowid=None):
+    '''This adds a single article to the arxiv_staging table along with the
+    content_hash of its metadata.
+
+    The local author columns and target_rowid can be filled in here if the
+    caller has already worked them out (see arxivingest); otherwise, use
+    diff_staged_articles and tag_local_authors on the staging table. If the
+    content_hash is None, it's calculated here.
+
+    This doesn't commit; the caller is responsible for that.
+
+    '''
+
+    if content_hash is None:
+        content_hash = article_content_hash(title, authors, comments, abstract)
+
+    query = ("insert into arxiv_staging (utctime, utcdate, "
+             "day_serial, title, article_type,"
+             "arxiv_id, authors, comments, abstract, link, pdf, "
+             "local_authors, local_author_indices, local_author_specaffils, "
+             "content_hash, target_rowid) values "
+             "(?,?, ?,?,?, ?,?,?,?,?,?, ?,?,?, ?,?)")
+    params = (arxiv_dt,
+              arxiv_dt.date(),
+              day_serial,
+              title,
+              article_type,
+              arxivid,
+              authors,
+              comments,
+              abstract,
+              link,
+              pdf,
+              local_authors,
+              local_author_indices,
+              local_author_specaffils,
+              content_hash,
+              target_rowid)
+    cursor.execute(query, params)
+
+
+
+def find_published_article(cursor, utcdate, article_type, arxivid):
+    '''This looks for an article in the arxiv table the same way
+    diff_staged_articles does, i.e. by (utcdate, article_type, arxiv_id).
+
+    Returns a tuple of (rowid, content_hash, day_serial) or None if the article
+    isn't in the table.
+
+    '''
+
+    cursor.execute('select rowid, content_hash, day_serial from arxiv where '
+                   'arxiv_id = ? and utcdate = ? and article_type = ?',
+                   (arxivid, utcdate, article_type))
+    return cursor.fetchone()
+
+
+
+def diff_staged_articles(cursor):
+    '''This compares the articles in arxiv_staging to the arxiv table.
+
+    Articles are matched on (utcdate, article_type, arxiv_id). Staged articles
+    with the same content_hash and day_serial as the stored ones are removed
+    from arxiv_staging since there's nothing to do for them. Everything left
+    over is either new (target_rowid is NULL) or changed.
+
+    This only reads from the arxiv table. Returns a tuple of the number of new,
+    changed, and unchanged articles.
+
+    '''
+
+    cursor.execute('select count(*) from arxiv_staging')
+    nstaged = cursor.fetchone()[0]
+
+    cursor.execute(
+        'update arxiv_staging set target_rowid = ('
+        'select a.rowid from arxiv a where '
+        'a.arxiv_id = arxiv_staging.arxiv_id and '
+        'a.utcdate = arxiv_staging.utcdate and '
+        'a.article_type = arxiv_staging.article_type'
+        ')'
+    )
+    cursor.execute(
+        'delete from arxiv_staging where target_rowid is not null and '
+        'exists (select 1 from arxiv a where '
+        'a.rowid = arxiv_staging.target_rowid and '
+        'a.content_hash = arxiv_staging.content_hash and '
+        'a.day_serial = arxiv_staging.day_serial)'
+    )
+
+    cursor.execute('select count(*) from arxiv_staging '
+                   'where target_rowid is null')
+    nnew = cursor.fetchone()[0]
+    cursor.execute('select count(*) from arxiv_staging '
+                   'where target_rowid is not null')
+    nchanged = cursor.fetchone()[0]
+
+    return nnew, nchanged, nstaged - nnew - nchanged
+
+
+
+def publish_staged_articles(database, cursor):
+    '''This moves the articles in arxiv_staging into the arxiv table in a single
+    short transaction, so readers see either none or all of them.
+
+    New articles are inserted with no votes or reservations. Changed articles
+    only get their metadata and local author columns updated; nvotes, voters,
+    presenters, reserved, and reservers are left alone. arxiv_staging is emptied
+    in the same transaction.
+
+    Returns the list of arxiv IDs that were published.
+
+    '''
+
+    cursor.execute('select day_serial, title, authors, comments, abstract, '
+                   'link, pdf, local_authors, local_author_indices, '
+                   'local_author_specaffils, content_hash, target_rowid, '
+                   'arxiv_id from arxiv_staging '
+                   'where target_rowid is not null')
+    updated_rows = cursor.fetchall()
+
+    cursor.execute('select arxiv_id from arxiv_staging '
+                   'where target_rowid is null')
+    published = [x[0] for x in cursor.fetchall()]
+
+    try:
+
+        cursor.execute(
+            "insert into arxiv (utctime, utcdate, "
+            "day_serial, title, article_type,"
+            "arxiv_id, authors, comments, abstract, link, pdf, "
+            "nvotes, voters, presenters, local_authors, reserved, "
+            "local_author_indices, local_author_specaffils, content_hash) "
+            "select utctime, utcdate, "
+            "day_serial, title, article_type, "
+            "arxiv_id, authors, comments, abstract, link, pdf, "
+            "0, '', '', local_authors, 0, "
+            "local_author_indices, local_author_specaffils, content_hash "
+            "from arxiv_staging where target_rowid is null"
+        )
+
+        for row in updated_rows:
+
+            cursor.execute(
+                "update arxiv set day_serial = ?, title = ?, authors = ?, "
+                "comments = ?, abstract = ?, link = ?, pdf = ?, "
+                "local_authors = ?, local_author_indices = ?, "
+                "local_author_specaffils = ?, content_hash = ? "
+                "where rowid = ?",
+                row[:-1]
+            )
+            published.append(row[-1])
+
+        cursor.execute('delete from arxiv_staging')
+        database.commit()
+
+    except Exception as e:
+
+        database.rollback()
+        raise
+
+    return published
+
+
+
+def update_replacements(replacements,
+                        database=None,
+                        tag_locals=True,
+                        fullname_match_threshold=99,
+                        firstname_match_threshold=99,
+                        verbose=False):
+    '''This applies the replacement listings in an arxivdict created by
+    arxivutils.arxiv_update to the articles already in the DB.
+
+    Replacements are matched to existing rows by arxiv_id (using the arxiv_idx
+    index). A row is only updated if the content_hash of its new title,
+    authors, comments, and abstract differs from the stored one, in which case
+    its version is incremented. Replacement listings don't include abstracts,
+    so the stored abstract is kept if the replacement doesn't have one.
+    Replacements for articles we never inserted are ignored.
+
+    The local author tags of an updated article are only reset and re-tagged
+    if its author list changed, so tags set by hand (see
+    force_localauthor_tag) survive replacements that only change the title,
+    comments, or abstract.
+
+    Returns the list of arxiv IDs that were updated.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    # these are the arxivids with changed author lists grouped by utcdate for
+    # re-tagging
+    updated_rows = {}
+    updated_arxivids = []
+
+    try:
+
+        for key in replacements:
+
+            replaced = replacements[key]
+
+            cursor.execute('select rowid, utcdate, article_type, title, '
+                           'authors, comments, abstract, content_hash '
+                           'from arxiv where arxiv_id = ?',
+                           (replaced['arxiv'],))
+            rows = cursor.fetchall()
+
+            for row in rows:
+
+                (rowid, utcdate, article_type, title,
+                 authors, comments, abstract, content_hash) = row
+
+                # rows inserted before content hashes existed
+                if not content_hash:
+                    content_hash = article_content_hash(title,
+                                                        authors,
+                                                        comments,
+                                                        abstract)
+
+                u_title = unicode(replaced['title'])
+                u_authors = unicode(','.join(replaced['authors']))
+                u_authors = u_authors.replace('Authors:','',1).strip()
+                u_comments = unicode(replaced['comments'])
+                u_abstract = unicode(replaced['abstract']) or abstract
+
+                # keep the cross-list annotation of the original listing
+                if article_type == 'crosslists':
+                    annotation = crosslist_regex.match(title)
+                    if annotation:
+                        u_title = u'%s%s' % (annotation.group(0), u_title)
+
+                new_hash = article_content_hash(u_title,
+                                                u_authors,
+                                                u_comments,
+                                                u_abstract)
+
+                if new_hash == content_hash:
+                    continue
+
+                if verbose:
+                    print('updating replaced article %s: %s' %
+                          (replaced['arxiv'], u_title))
+
+                if u_authors == authors:
+
+                    cursor.execute(
+                        "update arxiv set title = ?, comments = ?, "
+                        "abstract = ?, content_hash = ?, "
+                        "version = coalesce(version, 1) + 1 "
+                        "where rowid = ?",
+                        (u_title, u_comments, u_abstract, new_hash, rowid)
+                    )
+
+                else:
+
+                    cursor.execute(
+                        "update arxiv set title = ?, authors = ?, "
+                        "comments = ?, abstract = ?, content_hash = ?, "
+                        "version = coalesce(version, 1) + 1, "
+                        "local_authors = 0, local_author_indices = '', "
+                        "local_author_specaffils = '' "
+                        "where rowid = ?",
+                        (u_title, u_authors, u_comments, u_abstract,
+                         new_hash, rowid)
+                    )
+
+                    if utcdate not in updated_rows:
+                        updated_rows[utcdate] = []
+                    updated_rows[utcdate].append(replaced['arxiv'])
+
+                updated_arxivids.append(replaced['arxiv'])
+
+        database.commit()
+
+        print('replacements: %s listed, %s articles updated' %
+              (len(replacements), len(updated_arxivids)))
+
+    except Exception as e:
+
+        print('could not update replaced articles in the DB, error was %s' % e)
+        database.rollback()
+        updated_rows, updated_arxivids = {}, []
+
+    # re-tag the local authors for the replaced articles whose author lists
+    # changed
+    if tag_locals:
+        for utcdate in updated_rows:
+            tag_local_authors(
+                utcdate,
+                database=database,
+                firstname_match_threshold=firstname_match_threshold,
+                fullname_match_threshold=fullname_match_threshold,
+                update_db=True,
+                verbose=verbose,
+                arxiv_ids=updated_rows[utcdate]
+            )
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return updated_arxivids
+
+
+
 def insert_articles(arxiv,
                     database=None,
                     tag_locals=True,
@@ -432,8 +867,38 @@ def insert_articles(arxiv,
     This inserts all articles in an arxivdict created by
     arxivutils.grab_arxiv_update into the astroph-coffee server database.
 
+    The day's articles are first written to the arxiv_staging table (see
+    create_staging_table), compared against the arxiv table by content hash,
+    and tagged for local authors there. Then they're published to the arxiv
+    table in one short transaction (see publish_staged_articles). This means
+    the listing pages never see a half-inserted day, and the write lock on the
+    database is only held for the publish step.
+
+    This is safe to run more than once for the same listing: articles that are
+    already in the DB with the same content are skipped, and articles whose
+    metadata changed are updated in place without touching their votes and
+    reservations. Only the new and changed articles are tagged for local
+    authors.
+
+    If the arxivdict has a 'replacements' key, these are applied to the
+    existing articles using update_replacements.
+
+    Returns a dict with the number of articles inserted, updated, and left
+    unchanged, the number of existing articles changed by replacements, and
+    'failed' = True if the day's articles couldn't be published.
+
+    If arxiv is None (i.e. arxivutils.arxiv_update found that the listing
+    didn't change since the last update), this does nothing.
+
     '''
 
+    outcomes = {'inserted':0, 'updated':0, 'unchanged':0, 'replaced':0,
+                'failed':False}
+
+    if not arxiv:
+        print('no new arxiv listing to insert')
+        return outcomes
+
     # open the database if needed and get a cursor
     if not database:
         database, cursor = opendb()
@@ -451,18 +916,14 @@ def insert_articles(arxiv,
     papers = arxiv['papers']
     crosslists = arxiv['crosslists']
 
-    query = ("insert or replace into arxiv (utctime, utcdate, "
-             "day_serial, title, article_type,"
-             "arxiv_id, authors, comments, abstract, link, pdf, "
-             "nvotes, voters, presenters, local_authors, reserved) values "
-             "(?,?, ?,?,?, ?,?,?,?,?,?, ?,?,?,?, 0)")
-
     try:
 
+        create_staging_table(cursor)
+
         for key in papers:
 
             if verbose:
-                print('inserting astronomy article %s: %s' %
+                print('staging astronomy article %s: %s' %
                       (key, papers[key]['title']))
 
             u_title = unicode(papers[key]['title'])
@@ -474,62 +935,83 @@ def insert_articles(arxiv,
             u_authors = u_authors.replace('Authors:','',1)
             u_authors = u_authors.strip()
 
-            params = (arxiv_dt,
-                      arxiv_dt.date(),
-                      key,
-                      u_title,
-                      'astronomy',
-                      papers[key]['arxiv'],
-                      u_authors,
-                      u_comments,
-                      u_abstract,
-                      'http://arxiv.org%s' % papers[key]['link'],
-                      'http://arxiv.org%s' % papers[key]['pdf'],
-                      0,
-                      '',
-                      '',
-                      False)
-            cursor.execute(query, params)
+            stage_article(cursor,
+                          arxiv_dt,
+                          key,
+                          'astronomy',
+                          papers[key]['arxiv'],
+                          u_title,
+                          u_authors,
+                          u_comments,
+                          u_abstract,
+                          'http://arxiv.org%s' % papers[key]['link'],
+                          'http://arxiv.org%s' % papers[key]['pdf'])
 
         for key in crosslists:
 
             if verbose:
-                print('inserting cross-list article %s: %s' %
+                print('staging cross-list article %s: %s' %
                       (key, crosslists[key]['title']))
 
-            params = (arxiv_dt,
-                      arxiv_dt.date(),
-                      key,
-                      unicode(crosslists[key]['title']),
-                      'crosslists',
-                      crosslists[key]['arxiv'],
-                      unicode(','.join(crosslists[key]['authors'])),
-                      unicode(crosslists[key]['comments']),
-                      unicode(crosslists[key]['abstract']),
-                      'http://arxiv.org%s' % crosslists[key]['link'],
-                      'http://arxiv.org%s' % crosslists[key]['pdf'],
-                      0,
-                      '',
-                      '',
-                      False)
-            cursor.execute(query, params)
-
+            stage_article(
+                cursor,
+                arxiv_dt,
+                key,
+                'crosslists',
+                crosslists[key]['arxiv'],
+                unicode(crosslists[key]['title']),
+                unicode(','.join(crosslists[key]['authors'])),
+                unicode(crosslists[key]['comments']),
+                unicode(crosslists[key]['abstract']),
+                'http://arxiv.org%s' % crosslists[key]['link'],
+                'http://arxiv.org%s' % crosslists[key]['pdf']
+            )
+
+        (outcomes['inserted'],
+         outcomes['updated'],
+         outcomes['unchanged']) = diff_staged_articles(cursor)
+
+        # this only touches the TEMP staging table
         database.commit()
 
+        # tag the local authors in the staged articles. these are only the new
+        # and changed ones
+        if tag_locals and (outcomes['inserted'] or outcomes['updated']):
+            tag_local_authors(
+                arxiv_dt.date(),
+                database=database,
+                firstname_match_threshold=firstname_match_threshold,
+                fullname_match_threshold=fullname_match_threshold,
+                update_db=True,
+                verbose=verbose,
+                table='arxiv_staging'
+            )
+
+        # finally, move everything to the arxiv table in one go
+        publish_staged_articles(database, cursor)
+
+        print('articles inserted: %s, updated: %s, unchanged: %s' %
+              (outcomes['inserted'], outcomes['updated'],
+               outcomes['unchanged']))
+
     except Exception as e:
 
         print('could not insert articles into the DB, error was %s' % e)
         database.rollback()
-
-    # once we're done with the inserting articles bit, tag all local authors if
-    # directed to do so
-    if tag_locals:
-        tag_local_authors(arxiv_dt.date(),
-                          database=database,
-                          firstname_match_threshold=firstname_match_threshold,
-                          fullname_match_threshold=fullname_match_threshold,
-                          update_db=True,
-                          verbose=verbose)
+        outcomes['inserted'], outcomes['updated'] = 0, 0
+        outcomes['failed'] = True
+
+    # then apply any replacements to articles from previous days
+    if arxiv.get('replacements'):
+        replaced = update_replacements(
+            arxiv['replacements'],
+            database=database,
+            tag_locals=tag_locals,
+            firstname_match_threshold=firstname_match_threshold,
+            fullname_match_threshold=fullname_match_threshold,
+            verbose=verbose
+        )
+        outcomes['replaced'] = len(replaced)
 
 
     # at the end, close the cursor and DB connection
@@ -537,6 +1019,134 @@ def insert_articles(arxiv,
         cursor.close()
         database.close()
 
+    return outcomes
+
+
+
+def insert_harvested_articles(articles,
+                              database=None,
+                              tag_locals=True,
+                              fullname_match_threshold=99,
+                              firstname_match_threshold=99,
+                              verbose=False):
+    '''
+    This inserts a batch of articles from the historical harvester
+    (arxivharvest.harvest) into the astroph-coffee server database.
+
+    articles is a list of dicts like those in an arxivdict from
+    arxivutils.arxiv_update, with two extra keys: 'utcdate', the date the
+    article is listed under, and 'article_type', which is either 'astronomy'
+    or 'crosslists'. The batch may span several dates.
+
+    This goes through the same staging table as insert_articles, and the whole
+    batch is published in one transaction. Articles whose arxiv ID is already
+    in the DB (e.g. from the nightly update or an earlier harvest) are
+    skipped, so it's safe to insert the same batch again. The day_serial of
+    each new article continues on from the last one for its date.
+
+    Returns a dict with the number of articles inserted and skipped.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    outcomes = {'inserted':0, 'skipped':0}
+
+    try:
+
+        create_staging_table(cursor)
+
+        day_serials = {}
+
+        for article in articles:
+
+            cursor.execute('select 1 from arxiv where arxiv_id = ? limit 1',
+                           (article['arxiv'],))
+            if cursor.fetchone():
+                outcomes['skipped'] += 1
+                continue
+
+            utcdate = article['utcdate']
+
+            if utcdate not in day_serials:
+                cursor.execute('select max(day_serial) from arxiv '
+                               'where utcdate = ?', (utcdate,))
+                day_serials[utcdate] = cursor.fetchone()[0] or 0
+
+            day_serials[utcdate] = day_serials[utcdate] + 1
+
+            if verbose:
+                print('staging harvested article %s: %s' %
+                      (article['arxiv'], article['title']))
+
+            stage_article(
+                cursor,
+                datetime(utcdate.year, utcdate.month, utcdate.day,
+                         tzinfo=utc),
+                day_serials[utcdate],
+                article['article_type'],
+                article['arxiv'],
+                unicode(article['title']),
+                unicode(','.join(article['authors'])),
+                unicode(article['comments']),
+                unicode(article['abstract']),
+                'http://arxiv.org%s' % article['link'],
+                'http://arxiv.org%s' % article['pdf']
+            )
+
+        # a batch can have the same article twice if it was modified during
+        # the harvest. keep the first one
+        cursor.execute('delete from arxiv_staging where rowid not in '
+                       '(select min(rowid) from arxiv_staging '
+                       'group by arxiv_id)')
+        outcomes['skipped'] += cursor.rowcount
+
+        outcomes['inserted'], nchanged, nunchanged = (
+            diff_staged_articles(cursor)
+        )
+
+        # this only touches the TEMP staging table
+        database.commit()
+
+        if tag_locals and outcomes['inserted']:
+            for utcdate in sorted(day_serials):
+                tag_local_authors(
+                    utcdate,
+                    database=database,
+                    firstname_match_threshold=firstname_match_threshold,
+                    fullname_match_threshold=fullname_match_threshold,
+                    update_db=True,
+                    verbose=verbose,
+                    table='arxiv_staging'
+                )
+
+        publish_staged_articles(database, cursor)
+
+    # the harvester needs to know that the batch didn't make it so it doesn't
+    # checkpoint past it, so we re-raise the exception
+    except Exception as e:
+
+        print('could not insert harvested articles into the DB, '
+              'error was %s' % e)
+        database.rollback()
+        raise
+
+    finally:
+
+        # at the end, close the cursor and DB connection
+        if closedb:
+            cursor.close()
+            database.close()
+
+    return outcomes
+
+
 
 ## RETRIEVING ARTICLES
 
@@ -1010,9 +1620,9 @@ def get_archive_index(start_date=None,
         cursor = database.cursor()
         closedb = False
 
-    query = ("select utcdate, count(*), sum(local_authors), "
-             "sum(case when nvotes > 0 then 1 else 0 end) from arxiv "
-             "group by utcdate order by utcdate desc")
+    # the per-day counts are kept up to date by triggers on the arxiv table
+    query = ("select utcdate, npapers, nlocal, nvoted from daily_stats "
+             "order by utcdate desc")
     cursor.execute(query)
     rows = cursor.fetchall()
 
@@ -1029,13 +1639,194 @@ def get_archive_index(start_date=None,
     return (arxivdates, arxivpapers, arxivlocals, arxivvoted)
 
 
+
+def rebuild_daily_stats(database=None):
+    '''
+    This regenerates the per-day article counts in the daily_stats table from
+    the arxiv table.
+
+    The triggers on the arxiv table keep these counts current, so this only
+    needs to be run once after adding the daily_stats table to an existing
+    database, or if the counts ever get out of sync.
+
+    Returns the number of days in the table.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    try:
+
+        cursor.execute('delete from daily_stats')
+        cursor.execute(
+            "insert into daily_stats (utcdate, npapers, nlocal, nvoted) "
+            "select utcdate, count(*), "
+            "sum(case when local_authors then 1 else 0 end), "
+            "sum(case when nvotes > 0 then 1 else 0 end) from arxiv "
+            "group by utcdate"
+        )
+        cursor.execute('select count(*) from daily_stats')
+        ndays = cursor.fetchone()[0]
+        database.commit()
+
+        print('rebuilt daily article counts for %s days' % ndays)
+
+    except Exception as e:
+
+        print('could not rebuild the daily article counts, error was %s' % e)
+        database.rollback()
+        ndays = None
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return ndays
+
+
+
+def get_daily_stats_version(database=None):
+    '''
+    This returns the current version of the daily_stats table. This goes up
+    every time the table changes, so anything built from get_archive_index can
+    be cached until the version changes.
+
+    Returns None if the version can't be found.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    try:
+        cursor.execute('select version from daily_stats_version')
+        row = cursor.fetchone()
+        version = row[0] if row else None
+    except Exception as e:
+        print('could not get the daily_stats version, error was %s' % e)
+        version = None
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return version
+
+
+
+def get_listing_changes(utcdate=None, database=None):
+    '''
+    This returns the change count for the listing of papers for utcdate (a
+    YYYY-MM-DD string; today if None).
+
+    The listing for a day also has the papers reserved on the
+    RESERVE_INTERVAL_DAYS days before it, and falls back to the latest day
+    with papers if there aren't any on utcdate yet, so this adds up the change
+    counters in the listing_changes table for all of these days. The count
+    goes up whenever anything on the listing changes, so it can be used as a
+    version for the listing page.
+
+    '''
+
+    if not utcdate:
+        utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    cursor.execute('select utcdate from listing_changes where utcdate <= ? '
+                   'order by utcdate desc limit 1', (utcdate,))
+    row = cursor.fetchone()
+
+    if row:
+        latest_utcdate = '%s' % row[0]
+    else:
+        latest_utcdate = utcdate
+
+    earliest_dt = (datetime.strptime(latest_utcdate,'%Y-%m-%d') -
+                   timedelta(days=RESERVE_INTERVAL_DAYS))
+
+    cursor.execute('select sum(changes) from listing_changes '
+                   'where utcdate between ? and ?',
+                   (earliest_dt.strftime('%Y-%m-%d'), utcdate))
+    row = cursor.fetchone()
+    changes = row[0] if row and row[0] else 0
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return changes
+
+
+def get_article_abstracts(arxivids, database=None):
+    '''
+    This returns a dict of the abstracts of the articles in the list arxivids,
+    keyed by arxivid. Articles that don't exist are left out.
+
+    The listing and voting pages only have the abstracts of the local, voted,
+    and reserved articles; the other articles' abstracts are loaded from
+    here when they're shown.
+
+    '''
+
+    if not arxivids:
+        return {}
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    placeholders = ', '.join('?' for x in arxivids)
+    cursor.execute('select arxiv_id, abstract from arxiv '
+                   'where arxiv_id in (%s)' % placeholders,
+                   tuple(arxivids))
+    abstracts = {x[0]:x[1] for x in cursor.fetchall()}
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return abstracts
+
+
 ## VOTERS AND PRESENTERS
 
-def record_vote(arxivid, username, vote, database=None):
+def record_vote(arxivid, username, vote, maxvotes=None, database=None):
     '''This records votes for a paper in the DB. vote is 'up' or 'down'. If the
     arxivid doesn't exist, then returns False. If the vote is successfully
     processed, returns the nvotes for the arxivid.
 
+    The number of papers the user has voted for on the day the arxivid is
+    listed is kept in the user_daily_votes table, and is changed in the same
+    transaction as the vote. If maxvotes is given and the user has already
+    voted for that many papers on that day, an up vote isn't recorded and this
+    returns None.
+
     '''
 
     # open the database if needed and get a cursor
@@ -1081,21 +1872,64 @@ def record_vote(arxivid, username, vote, database=None):
         return False
 
 
+    # the user's vote count for the day the paper is listed. the count is
+    # only changed if the paper's votes were, and an up vote is only allowed
+    # while the count is under maxvotes
+    if voteval > 0:
+        count_query = ("update user_daily_votes set nvotes = nvotes + 1 "
+                       "where username = ? and "
+                       "utcdate = (select max(utcdate) from arxiv "
+                       "where arxiv_id = ?) and "
+                       "(? is null or nvotes < ?)")
+        count_params = (username, arxivid, maxvotes, maxvotes)
+    else:
+        count_query = ("update user_daily_votes set nvotes = nvotes - 1 "
+                       "where username = ? and "
+                       "utcdate = (select max(utcdate) from arxiv "
+                       "where arxiv_id = ?) and "
+                       "nvotes > 0")
+        count_params = (username, arxivid)
+
+    out_of_votes = False
+
     try:
 
         cursor.execute(query, query_params)
+
+        if cursor.rowcount > 0:
+
+            cursor.execute("insert or ignore into user_daily_votes "
+                           "(username, utcdate) "
+                           "select ?, max(utcdate) from arxiv "
+                           "where arxiv_id = ?",
+                           (username, arxivid))
+            cursor.execute(count_query, count_params)
+
+            # the user is out of votes for this day, so undo this one
+            if voteval > 0 and cursor.rowcount == 0:
+                database.rollback()
+                out_of_votes = True
+
         database.commit()
 
-        cursor.execute("select nvotes from arxiv where arxiv_id = ?",
-                       (arxivid,))
-        rows = cursor.fetchone()
+        if out_of_votes:
 
-        if rows and len(rows) > 0:
-            returnval = rows[0]
+            returnval = None
+
+        else:
+
+            cursor.execute("select nvotes from arxiv where arxiv_id = ?",
+                           (arxivid,))
+            rows = cursor.fetchone()
+
+            if rows and len(rows) > 0:
+                returnval = rows[0]
 
     except Exception as e:
+        # don't leave the vote half-done in an open transaction on a shared
+        # connection
+        database.rollback()
         raise
-        returnval = False
 
     # at the end, close the cursor and DB connection
     if closedb:
@@ -1349,6 +2183,65 @@ def get_user_votes(utcdate, username, database=None):
 
 
 
+def rebuild_user_daily_votes(database=None):
+    '''
+    This regenerates the per-user daily vote counts in the user_daily_votes
+    table from the voters of the articles in the arxiv table.
+
+    record_vote keeps these counts current, so this only needs to be run once
+    after adding the user_daily_votes table to an existing database, or if
+    the counts ever get out of sync.
+
+    Returns the number of (user, day) counts in the table.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    try:
+
+        # votes for a paper listed on more than one day count on the latest
+        cursor.execute("select arxiv_id, max(utcdate), voters from arxiv "
+                       "where nvotes > 0 group by arxiv_id")
+
+        vote_counts = {}
+
+        for arxivid, utcdate, voters in cursor.fetchall():
+            for voter in set(x for x in voters.split(',') if x):
+                vote_counts[(voter, utcdate)] = (
+                    vote_counts.get((voter, utcdate), 0) + 1
+                )
+
+        cursor.execute('delete from user_daily_votes')
+        cursor.executemany("insert into user_daily_votes "
+                           "(username, utcdate, nvotes) values (?, ?, ?)",
+                           [(x[0], x[1], vote_counts[x]) for x in vote_counts])
+        database.commit()
+
+        ncounts = len(vote_counts)
+        print('rebuilt daily vote counts for %s users and days' % ncounts)
+
+    except Exception as e:
+
+        print('could not rebuild the daily vote counts, error was %s' % e)
+        database.rollback()
+        ncounts = None
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return ncounts
+
+
+
 def modify_presenters(arxivid, presenter, action, database=None):
     '''
     This adds/removes presenters for a paper.
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+
+'''arxivharvest.py - Oct 2026
+
+This harvests historical astro-ph articles from the arXiv OAI-PMH interface
+and backfills them into the astroph-coffee server database, so the archive
+can go back further than the day the server was installed.
+
+The OAI-PMH responses are parsed incrementally as they stream in, and the
+articles are inserted in batches through the same staging path as the nightly
+update (see arxivdb.insert_harvested_articles). After each batch and at the
+end of each page of records, the harvest position is saved to a checkpoint
+file in the cache directory, so a harvest that crashes or is interrupted picks
+up where it left off when it's run again with the same arguments.
+
+The articles are listed under the date their first version was submitted
+(the <created> date in arXiv's OAI metadata). This is usually a day or so
+before the date they showed up in the arxiv /new listings.
+
+'''
+
+import os
+import os.path
+import json
+from datetime import datetime
+
+import lxml.etree
+from tornado.escape import squeeze, xhtml_escape
+
+from pytz import utc
+
+import arxivutils
+import arxivdb
+
+# this is arxiv's OAI-PMH endpoint
+OAI_URL = 'http://export.arxiv.org/oai2'
+
+# this is the OAI-PMH set for astro-ph
+OAI_SET = 'physics:astro-ph'
+
+# the XML namespaces in the OAI-PMH responses
+OAI_NS = '{http://www.openarchives.org/OAI/2.0/}'
+ARXIV_NS = '{http://arxiv.org/OAI/arXiv/}'
+
+# how many articles to insert into the DB at a time
+BATCHSIZE = 500
+
+# the checkpoint file in the cache directory
+CHECKPOINT_FILE = 'arxiv-harvest-checkpoint.json'
+
+
+class OAIError(Exception):
+    '''
+    This is raised when the OAI-PMH server returns an error.
+
+    '''
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+        Exception.__init__(self, '%s: %s' % (code, message))
+
+
+
+def parse_oai_record(record):
+    '''
+    This turns an OAI-PMH <record> element in the arXiv metadata format into an
+    article dict for arxivdb.insert_harvested_articles.
+
+    Returns None for deleted records and records for articles outside
+    astro-ph. Articles whose primary category isn't astro-ph are cross-lists,
+    and get the same title annotation as the cross-lists in the nightly
+    listings.
+
+    '''
+
+    header = record.find('%sheader' % OAI_NS)
+
+    if header is None or header.get('status') == 'deleted':
+        return None
+
+    meta = record.find('%smetadata/%sarXiv' % (OAI_NS, ARXIV_NS))
+
+    if meta is None:
+        return None
+
+    def field(name):
+        text = meta.findtext('%s%s' % (ARXIV_NS, name))
+        return squeeze(text.replace('\n',' ').strip()) if text else ''
+
+    categories = field('categories').split()
+
+    if not any(x.startswith('astro-ph') for x in categories):
+        return None
+
+    arxivid = field('id')
+    created = datetime.strptime(field('created'), '%Y-%m-%d').date()
+    title = field('title')
+
+    if categories[0].startswith('astro-ph'):
+        article_type = 'astronomy'
+    else:
+        article_type = 'crosslists'
+        title = u'[cross-list from %s] %s' % (categories[0], title)
+
+    authors = []
+
+    for author in meta.iterfind('%sauthors/%sauthor' % (ARXIV_NS, ARXIV_NS)):
+
+        name = [author.findtext('%s%s' % (ARXIV_NS, x))
+                for x in ('forenames', 'keyname', 'suffix')]
+        authors.append(squeeze(' '.join(x.strip() for x in name if x)))
+
+    # the comments are shown as HTML on the listing pages, but these are plain
+    # text
+    comments = xhtml_escape(field('comments'))
+
+    return {'utcdate':created,
+            'article_type':article_type,
+            'arxiv':u'arXiv:%s' % arxivid,
+            'title':title,
+            'authors':authors,
+            'comments':comments,
+            'abstract':field('abstract'),
+            'link':'/abs/%s' % arxivid,
+            'pdf':'/pdf/%s' % arxivid,
+            'datestamp':header.findtext('%sdatestamp' % OAI_NS)}
+
+
+
+def iter_oai_records(url=OAI_URL,
+                     setspec=OAI_SET,
+                     from_date=None,
+                     until_date=None,
+                     resumption_token=None,
+                     timeout=arxivutils.REQUEST_TIMEOUT):
+    '''
+    This goes through all records returned by an OAI-PMH ListRecords request,
+    following the resumption tokens from page to page.
+
+    Each page is parsed as it's downloaded, and the records are thrown away
+    once they've been handed out, so the memory use doesn't grow with the
+    number of records.
+
+    Yields tuples of (record element, token, index), where token is the
+    resumption token used to get the page the record is on (None for the first
+    page) and index is the position of the record on that page. These are what
+    a harvest needs to resume from a record.
+
+    '''
+
+    session = arxivutils.get_http_session()
+    token = resumption_token
+
+    while True:
+
+        if token:
+            params = {'verb':'ListRecords', 'resumptionToken':token}
+        else:
+            params = {'verb':'ListRecords', 'metadataPrefix':'arXiv'}
+            if setspec:
+                params['set'] = setspec
+            if from_date:
+                params['from'] = from_date.strftime('%Y-%m-%d')
+            if until_date:
+                params['until'] = until_date.strftime('%Y-%m-%d')
+
+        response = session.get(url,
+                               params=params,
+                               timeout=timeout,
+                               stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        next_token = None
+        index = 0
+
+        try:
+
+            for event, elem in lxml.etree.iterparse(
+                    response.raw,
+                    events=('end',),
+                    tag=('%srecord' % OAI_NS,
+                         '%sresumptionToken' % OAI_NS,
+                         '%serror' % OAI_NS)
+            ):
+
+                if elem.tag == '%srecord' % OAI_NS:
+                    yield elem, token, index
+                    index = index + 1
+
+                elif elem.tag == '%sresumptionToken' % OAI_NS:
+                    next_token = (elem.text or '').strip()
+
+                else:
+                    # there are no records in an empty date range
+                    if elem.get('code') == 'noRecordsMatch':
+                        return
+                    raise OAIError(elem.get('code'), elem.text)
+
+                # throw away the elements we're done with
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+        finally:
+            response.close()
+
+        # an empty (or missing) resumption token means this is the last page
+        if not next_token:
+            return
+
+        token = next_token
+
+
+
+def load_checkpoint(checkpoint_key, cachedir=None):
+    '''
+    This loads the checkpoint for the harvest identified by checkpoint_key.
+
+    Returns a dict or None if there's no checkpoint for this harvest.
+
+    '''
+
+    if not cachedir:
+        cachedir = arxivutils.CACHEDIR
+
+    checkpoint_file = os.path.join(cachedir, CHECKPOINT_FILE)
+
+    if not os.path.exists(checkpoint_file):
+        return None
+
+    with open(checkpoint_file,'rb') as infd:
+        checkpoints = json.load(infd)
+
+    return checkpoints.get(checkpoint_key)
+
+
+
+def save_checkpoint(checkpoint_key, checkpoint, cachedir=None):
+    '''
+    This saves the checkpoint for the harvest identified by checkpoint_key. If
+    checkpoint is None, the checkpoint is removed.
+
+    '''
+
+    if not cachedir:
+        cachedir = arxivutils.CACHEDIR
+
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    checkpoint_file = os.path.join(cachedir, CHECKPOINT_FILE)
+    checkpoints = {}
+
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file,'rb') as infd:
+            checkpoints = json.load(infd)
+
+    if checkpoint is None:
+        checkpoints.pop(checkpoint_key, None)
+    else:
+        checkpoints[checkpoint_key] = checkpoint
+
+    # write to a temp file and move it into place so a crash doesn't leave a
+    # half-written checkpoint behind
+    with open('%s.tmp' % checkpoint_file,'wb') as outfd:
+        json.dump(checkpoints, outfd, indent=2, sort_keys=True)
+    os.rename('%s.tmp' % checkpoint_file, checkpoint_file)
+
+
+
+def harvest(from_date=None,
+            until_date=None,
+            url=OAI_URL,
+            setspec=OAI_SET,
+            batchsize=BATCHSIZE,
+            database=None,
+            cachedir=None,
+            tag_locals=True,
+            verbose=False):
+    '''
+    This harvests all astro-ph articles added or changed on arxiv between
+    from_date and until_date (datetime.date instances, inclusive) and inserts
+    the ones we don't have yet into the DB.
+
+    If there's a checkpoint for a harvest with the same url, setspec,
+    from_date, and until_date, this resumes from there. If arxiv doesn't
+    accept the checkpointed resumption token anymore (they expire after a
+    while), the harvest starts over from from_date; the articles we already
+    have are skipped. It can't restart from the datestamps of the records done
+    so far, since OAI-PMH doesn't list records in datestamp order.
+
+    Returns a dict with the number of records seen and articles inserted and
+    skipped.
+
+    '''
+
+    checkpoint_key = '%s|%s|%s|%s' % (url,
+                                      setspec,
+                                      from_date.isoformat() if from_date else '',
+                                      until_date.isoformat() if until_date
+                                      else '')
+
+    checkpoint = load_checkpoint(checkpoint_key, cachedir=cachedir)
+
+    if checkpoint:
+        print('resuming harvest from checkpoint: %s records done, '
+              'last datestamp %s' % (checkpoint['nrecords'],
+                                     checkpoint['datestamp']))
+    else:
+        checkpoint = {'token':None,
+                      'index':0,
+                      'datestamp':None,
+                      'nrecords':0,
+                      'inserted':0,
+                      'skipped':0}
+
+    # open the database if needed
+    if not database:
+        database, cursor = arxivdb.opendb()
+        cursor.close()
+        closedb = True
+    else:
+        closedb = False
+
+    def records(checkpoint):
+
+        token, skip = checkpoint['token'], checkpoint['index']
+
+        try:
+
+            for record in iter_oai_records(url=url,
+                                           setspec=setspec,
+                                           from_date=from_date,
+                                           until_date=until_date,
+                                           resumption_token=token):
+                # skip the records on the checkpointed page that we've already
+                # done
+                if record[1] == token and record[2] < skip:
+                    continue
+                yield record
+
+        except OAIError as e:
+
+            if e.code != 'badResumptionToken':
+                raise
+
+            print('resumption token has expired, '
+                  'restarting the harvest from %s' % from_date)
+
+            for record in iter_oai_records(url=url,
+                                           setspec=setspec,
+                                           from_date=from_date,
+                                           until_date=until_date):
+                yield record
+
+    def insert_batch(batch, position, datestamp):
+
+        if batch:
+
+            outcomes = arxivdb.insert_harvested_articles(
+                batch,
+                database=database,
+                tag_locals=tag_locals,
+                verbose=verbose
+            )
+
+            checkpoint['inserted'] += outcomes['inserted']
+            checkpoint['skipped'] += outcomes['skipped']
+
+        checkpoint['token'], checkpoint['index'] = position
+
+        if datestamp:
+            checkpoint['datestamp'] = max(datestamp,
+                                          checkpoint['datestamp'] or '')
+
+        save_checkpoint(checkpoint_key, checkpoint, cachedir=cachedir)
+
+        print('%s: %s records done, %s articles inserted, %s skipped' %
+              (datetime.now(tz=utc).isoformat(),
+               checkpoint['nrecords'],
+               checkpoint['inserted'],
+               checkpoint['skipped']))
+
+    try:
+
+        batch, page_token, datestamp = [], checkpoint['token'], None
+
+        for elem, token, index in records(checkpoint):
+
+            # the last page is done, so save the position at the start of
+            # this one. this moves the checkpoint on even if none of the last
+            # page's records were astro-ph articles
+            if token != page_token:
+                insert_batch(batch, (token, index), datestamp)
+                batch, page_token = [], token
+
+            datestamp = max(
+                elem.findtext('%sheader/%sdatestamp' % (OAI_NS, OAI_NS)) or '',
+                datestamp or ''
+            )
+
+            article = parse_oai_record(elem)
+            checkpoint['nrecords'] += 1
+
+            if article:
+                batch.append(article)
+
+            if len(batch) >= batchsize:
+                insert_batch(batch, (token, index + 1), datestamp)
+                batch = []
+
+        if batch:
+            insert_batch(batch, (token, index + 1), datestamp)
+
+        # we're done, so get rid of the checkpoint
+        save_checkpoint(checkpoint_key, None, cachedir=cachedir)
+
+        print('harvest complete: %s records, %s articles inserted, '
+              '%s skipped' % (checkpoint['nrecords'],
+                              checkpoint['inserted'],
+                              checkpoint['skipped']))
+
+    finally:
+
+        if closedb:
+            database.close()
+
+    return {'nrecords':checkpoint['nrecords'],
+            'inserted':checkpoint['inserted'],
+            'skipped':checkpoint['skipped']}
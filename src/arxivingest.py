@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+
+'''arxivingest.py - Oct 2026
+
+This runs the nightly arxiv ingest as a pipeline of stages:
+
+fetch -> parse -> tag -> write -> mathjax
+
+The listing is fetched once, then each article flows through the parse, tag,
+and write stages one at a time: an article is parsed, checked against the DB,
+tagged for local authors if it's new or changed, and written to the staging
+table before the next one is parsed. Only one article is in flight at any
+time. Once all articles are staged, they're published to the arxiv table in
+one transaction, and the replacements are applied. Finally, the math in the
+new and replaced articles is pre-rendered (see mathrender.py).
+
+The raw listing HTML and the parsed articles are saved to the listing archive
+in the cache directory (see arxivutils.archive_listing_html and
+arxivutils.archive_listing_articles). replay_listings puts archived listings
+back into the DB with the bulk insert path, so the DB can be rebuilt (e.g. after
+a schema change or to re-tag local authors) without going to arxiv again.
+
+The time spent in each stage is written to a JSON report in the logs directory
+after each run.
+
+'''
+
+import os
+import os.path
+import json
+import time
+import ConfigParser
+from datetime import datetime
+
+from pytz import utc
+
+import arxivutils
+import arxivdb
+import mathrender
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the stage timing reports go here
+if CONF.has_option('paths','logs'):
+    LOGDIR = CONF.get('paths','logs')
+else:
+    LOGDIR = 'logs'
+
+
+
+def parse_stage(html, timings, replacements, archived=None):
+    '''
+    This parses the listing HTML and yields the papers and cross-lists one at
+    a time as tuples of (list type, day_serial, article dict).
+
+    The replacements are parsed in one go at the end (they're applied in a
+    separate step), and are added to the replacements dict. If archived is a
+    list, all parsed articles are also appended to it as they come out, so they
+    can be written to the listing archive afterwards.
+
+    '''
+
+    start = time.time()
+
+    tree = arxivutils.parse_listing_html(html)
+
+    (paperlinks, paperdata,
+     crosslinks, crossdata,
+     replacelinks, replacedata) = arxivutils.get_arxiv_lists(tree)
+
+    articles = arxivutils.iter_arxiv_articles(paperlinks, paperdata,
+                                              crosslinks, crossdata)
+
+    timings['parse'] += time.time() - start
+
+    while True:
+
+        start = time.time()
+
+        try:
+            listtype, ind, article = next(articles)
+        except StopIteration:
+            break
+        finally:
+            timings['parse'] += time.time() - start
+
+        if archived is not None:
+            archived.append((listtype, ind, article))
+
+        yield listtype, ind, article
+
+    start = time.time()
+
+    replacements.update(arxivutils.get_arxiv_replacements(replacelinks,
+                                                          replacedata))
+    if archived is not None:
+        archived.extend(('replacements', x, replacements[x])
+                        for x in sorted(replacements))
+
+    timings['parse'] += time.time() - start
+
+
+
+def tag_stage(parsed,
+              cursor,
+              utcdate,
+              timings,
+              counts,
+              tag_locals=True,
+              fullname_match_threshold=99,
+              firstname_match_threshold=99,
+              verbose=False):
+    '''
+    This checks each parsed article against the arxiv table and tags the new
+    and changed ones for local authors.
+
+    Unchanged articles are counted and dropped. Yields dicts with the columns
+    for arxivdb.stage_article.
+
+    '''
+
+    start = time.time()
+
+    if tag_locals:
+        local_authors, local_author_fnames, local_emails = (
+            arxivdb.get_local_authors_from_db(database=cursor.connection)
+        )
+    else:
+        local_authors = []
+
+    timings['tag'] += time.time() - start
+
+    for listtype, ind, article in parsed:
+
+        start = time.time()
+
+        if listtype == 'papers':
+            # get rid of the initial 'Authors: ' bit
+            article_type = 'astronomy'
+            authors = unicode(','.join(article['authors']))
+            authors = authors.replace('Authors:','',1).strip()
+        else:
+            article_type = 'crosslists'
+            authors = unicode(','.join(article['authors']))
+
+        row = {'day_serial':ind,
+               'article_type':article_type,
+               'arxivid':article['arxiv'],
+               'title':unicode(article['title']),
+               'authors':authors,
+               'comments':unicode(article['comments']),
+               'abstract':unicode(article['abstract']),
+               'link':'http://arxiv.org%s' % article['link'],
+               'pdf':'http://arxiv.org%s' % article['pdf'],
+               'local_authors':False,
+               'local_author_indices':None,
+               'local_author_specaffils':None,
+               'target_rowid':None}
+
+        row['content_hash'] = arxivdb.article_content_hash(row['title'],
+                                                           row['authors'],
+                                                           row['comments'],
+                                                           row['abstract'])
+
+        published = arxivdb.find_published_article(cursor,
+                                                    utcdate,
+                                                    article_type,
+                                                    row['arxivid'])
+
+        if published:
+
+            if (published[1] == row['content_hash'] and
+                published[2] == row['day_serial']):
+                counts['unchanged'] += 1
+                timings['tag'] += time.time() - start
+                continue
+
+            row['target_rowid'] = published[0]
+            counts['updated'] += 1
+
+        else:
+
+            counts['inserted'] += 1
+
+        if len(local_authors) > 0:
+
+            (cleaned_authors,
+             local_author_inds,
+             local_author_affils) = arxivdb.match_local_authors(
+                 row['arxivid'],
+                 row['authors'],
+                 local_authors,
+                 local_author_fnames,
+                 local_emails,
+                 firstname_match_threshold=firstname_match_threshold,
+                 fullname_match_threshold=fullname_match_threshold,
+                 verbose=verbose
+             )
+
+            # this is the same as what tag_local_authors does
+            if len(local_author_inds) > 0:
+                row['authors'] = ','.join(cleaned_authors)
+                row['local_authors'] = True
+                row['local_author_indices'] = ','.join(
+                    ['%s' % x for x in local_author_inds]
+                )
+                row['local_author_specaffils'] = ','.join(local_author_affils)
+
+        timings['tag'] += time.time() - start
+
+        yield row
+
+
+
+def write_report(report, logdir=None):
+    '''
+    This writes the ingest report to a JSON file in the logs directory.
+
+    Returns the path to the report.
+
+    '''
+
+    if not logdir:
+        logdir = LOGDIR
+
+    if not os.path.exists(logdir):
+        os.makedirs(logdir)
+
+    report_fpath = os.path.join(
+        logdir,
+        'arxiv-ingest-%s.json' % report['started'].replace(':','')
+    )
+
+    with open(report_fpath,'wb') as outfd:
+        json.dump(report, outfd, indent=2, sort_keys=True)
+
+    return report_fpath
+
+
+
+def ingest_arxiv_listing(url='http://arxiv.org/list/astro-ph/new',
+                         conditional=True,
+                         archive=True,
+                         database=None,
+                         cachedir=None,
+                         logdir=None,
+                         tag_locals=True,
+                         fullname_match_threshold=99,
+                         firstname_match_threshold=99,
+                         verbose=False):
+    '''
+    This fetches the arxiv listing at url and puts its articles into the DB.
+
+    This does the same thing as arxivutils.arxiv_update followed by
+    arxivdb.insert_articles, but the parse, tag, and write stages work on one
+    article at a time. If conditional is True, nothing is done if the listing
+    hasn't changed since the last successful ingest. If archive is True, the
+    listing is saved to the listing archive in the cache directory.
+
+    Returns the report dict, which is also written to a JSON file in the logs
+    directory. This has the time spent in each stage and the numbers of
+    articles inserted, updated, unchanged, and replaced.
+
+    '''
+
+    run_start = time.time()
+
+    report = {'url':url,
+              'started':datetime.now(tz=utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+              'status':None,
+              'stages':{'fetch':0.0,
+                        'archive':0.0,
+                        'parse':0.0,
+                        'tag':0.0,
+                        'write':0.0,
+                        'replace':0.0,
+                        'mathjax':0.0},
+              'counts':{'inserted':0,
+                        'updated':0,
+                        'unchanged':0,
+                        'replaced':0}}
+    timings = report['stages']
+
+    print('updating article DB from arxiv...')
+
+    # stage 1: fetch
+    start = time.time()
+
+    if conditional:
+        state = arxivutils.load_fetch_state(url, cachedir=cachedir)
+    else:
+        state = None
+
+    fetched = arxivutils.fetch_page(url, state=state)
+
+    timings['fetch'] += time.time() - start
+    report['status'] = fetched['status']
+
+    if fetched['status'] != 'ok':
+
+        if fetched['status'] == 'failed':
+            print('could not get the arxiv listing at %s' % url)
+        else:
+            print('arxiv listing at %s has not changed since the last update, '
+                  'nothing to do' % url)
+            # the listing's articles are already in the DB, so its new ETag
+            # and Last-Modified time can be saved right away
+            arxivutils.save_fetch_state({'url':url, 'state':fetched['state']},
+                                        cachedir=cachedir)
+
+        report['total'] = time.time() - run_start
+        report['report'] = write_report(report, logdir=logdir)
+        return report
+
+    arxiv_dt = datetime.now(tz=utc)
+    replacements = {}
+
+    # save the raw listing first, so we have it even if the rest fails
+    if archive:
+        start = time.time()
+        arxivutils.archive_listing_html(fetched['html'],
+                                        arxiv_dt,
+                                        cachedir=cachedir)
+        archived = []
+        timings['archive'] += time.time() - start
+    else:
+        archived = None
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    try:
+
+        arxivdb.create_staging_table(cursor)
+
+        # stages 2 and 3: parse and tag, one article at a time
+        parsed = parse_stage(fetched['html'],
+                             timings,
+                             replacements,
+                             archived=archived)
+        tagged = tag_stage(parsed,
+                           cursor,
+                           arxiv_dt.date(),
+                           timings,
+                           report['counts'],
+                           tag_locals=tag_locals,
+                           fullname_match_threshold=fullname_match_threshold,
+                           firstname_match_threshold=firstname_match_threshold,
+                           verbose=verbose)
+
+        # stage 4: write each article to the staging table as it comes out of
+        # the tag stage, then publish them all at once
+        while True:
+
+            try:
+                row = next(tagged)
+            except StopIteration:
+                break
+
+            start = time.time()
+
+            if verbose:
+                print('staging %s article %s: %s' % (row['article_type'],
+                                                     row['day_serial'],
+                                                     row['title']))
+
+            arxivdb.stage_article(cursor, arxiv_dt, **row)
+
+            timings['write'] += time.time() - start
+
+        if archive:
+            start = time.time()
+            arxivutils.archive_listing_articles(archived,
+                                                arxiv_dt,
+                                                url,
+                                                cachedir=cachedir)
+            timings['archive'] += time.time() - start
+
+        start = time.time()
+
+        # this only touches the TEMP staging table, but it also ends the read
+        # transaction the tag stage's lookups in the arxiv table have been
+        # running in. otherwise, a vote or new session committed by the
+        # server since the first lookup would make the publish fail with
+        # "database is locked", since it couldn't write from an old snapshot
+        database.commit()
+
+        arxivdb.publish_staged_articles(database, cursor)
+        timings['write'] += time.time() - start
+
+        print('articles inserted: %s, updated: %s, unchanged: %s' %
+              (report['counts']['inserted'],
+               report['counts']['updated'],
+               report['counts']['unchanged']))
+
+        # the listing is in the DB now, so we can remember that we've seen it
+        arxivutils.save_fetch_state({'url':url, 'state':fetched['state']},
+                                    cachedir=cachedir)
+
+    except Exception as e:
+
+        print('could not insert articles into the DB, error was %s' % e)
+        database.rollback()
+        report['status'] = 'failed'
+        report['counts']['inserted'], report['counts']['updated'] = 0, 0
+
+    # finally, apply the replacements to articles from previous days
+    if replacements:
+
+        start = time.time()
+
+        replaced = arxivdb.update_replacements(
+            replacements,
+            database=database,
+            tag_locals=tag_locals,
+            firstname_match_threshold=firstname_match_threshold,
+            fullname_match_threshold=fullname_match_threshold,
+            verbose=verbose
+        )
+        report['counts']['replaced'] = len(replaced)
+
+        timings['replace'] += time.time() - start
+
+    else:
+
+        replaced = []
+
+    # last, pre-render the math in the new and replaced articles' titles and
+    # abstracts. if node isn't available, the pages fall back to MathJax in
+    # the browser
+    if report['status'] == 'ok' or replaced:
+
+        start = time.time()
+
+        if report['status'] == 'ok':
+            mathrender.prerender_articles(utcdate=arxiv_dt.date(),
+                                          database=database,
+                                          verbose=verbose)
+        if replaced:
+            mathrender.prerender_articles(arxivids=replaced,
+                                          database=database,
+                                          verbose=verbose)
+
+        timings['mathjax'] += time.time() - start
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    report['total'] = time.time() - run_start
+    report['report'] = write_report(report, logdir=logdir)
+
+    print('ingest stage times (s): %s' %
+          ', '.join('%s: %.3f' % (x, timings[x])
+                    for x in ('fetch', 'archive', 'parse', 'tag', 'write',
+                              'replace', 'mathjax')))
+
+    return report
+
+
+
+def replay_listings(start_date=None,
+                    end_date=None,
+                    reparse=False,
+                    retag=False,
+                    database=None,
+                    cachedir=None,
+                    tag_locals=True,
+                    fullname_match_threshold=99,
+                    firstname_match_threshold=99,
+                    verbose=False):
+    '''
+    This puts the archived listings from start_date to end_date
+    (datetime.date instances, inclusive; None means no limit) back into the
+    DB, oldest first.
+
+    Each listing goes through arxivdb.insert_articles, so this works on an
+    empty DB (to rebuild it from scratch) as well as on an existing one, where
+    unchanged articles are left alone. If reparse is True, the archived HTML is
+    parsed again instead of using the archived articles. If retag is True, the
+    local authors are tagged again for each replayed day, even for articles
+    that didn't change.
+
+    Returns a dict with the number of listings replayed and the total numbers
+    of articles inserted, updated, unchanged, and replaced.
+
+    '''
+
+    archives = arxivutils.find_listing_archives(start_date=start_date,
+                                                end_date=end_date,
+                                                cachedir=cachedir)
+
+    totals = {'listings':0,
+              'inserted':0,
+              'updated':0,
+              'unchanged':0,
+              'replaced':0}
+
+    # open the database if needed
+    if not database:
+        database, cursor = arxivdb.opendb()
+        cursor.close()
+        closedb = True
+    else:
+        closedb = False
+
+    try:
+
+        for utc_dt, htmlpath, jsonlpath in archives:
+
+            print('replaying arxiv listing from %s' % utc_dt.isoformat())
+
+            arxiv = arxivutils.load_listing_archive(utc_dt,
+                                                    htmlpath,
+                                                    jsonlpath,
+                                                    reparse=reparse)
+
+            outcomes = arxivdb.insert_articles(
+                arxiv,
+                database=database,
+                tag_locals=tag_locals,
+                fullname_match_threshold=fullname_match_threshold,
+                firstname_match_threshold=firstname_match_threshold,
+                verbose=verbose
+            )
+
+            if outcomes['failed']:
+                raise Exception('could not replay the listing from %s' %
+                                utc_dt.isoformat())
+
+            if retag and tag_locals:
+                arxivdb.tag_local_authors(
+                    utc_dt.date(),
+                    database=database,
+                    firstname_match_threshold=firstname_match_threshold,
+                    fullname_match_threshold=fullname_match_threshold,
+                    update_db=True,
+                    verbose=verbose
+                )
+
+            totals['listings'] += 1
+            for key in ('inserted', 'updated', 'unchanged', 'replaced'):
+                totals[key] += outcomes[key]
+
+    finally:
+
+        if closedb:
+            database.close()
+
+    print('replayed %s listings: %s articles inserted, %s updated, '
+          '%s unchanged, %s replaced' % (totals['listings'],
+                                         totals['inserted'],
+                                         totals['updated'],
+                                         totals['unchanged'],
+                                         totals['replaced']))
+
+    return totals
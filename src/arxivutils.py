@@ -7,30 +7,237 @@ astroph-coffee server.
 
 '''
 
+import os
+import os.path
 import random
 import time
+import json
+import gzip
+import glob
+import hashlib
+import ConfigParser
 from datetime import date, datetime
 
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
-from bs4 import BeautifulSoup
+import lxml.html
 from tornado.escape import squeeze
 import requests, requests.exceptions
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from pytz import utc
 
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the last-fetch state for the arxiv listing pages is kept here
+if CONF.has_option('paths','cache'):
+    CACHEDIR = CONF.get('paths','cache')
+else:
+    CACHEDIR = 'cache'
+FETCH_STATE_FILE = 'arxiv-fetch-state.json'
+
+# the raw listings and their parsed articles are archived in this subdirectory
+# of the cache directory
+LISTING_ARCHIVE_DIR = 'listings'
+
 CHUNKSIZE = 64
 REQUEST_HEADERS = {
     'User-Agent': ('Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:40.0)'
                    ' Gecko/20100101 Firefox/40.0')
     }
 
+# (connect, read) timeouts in seconds for requests to arxiv
+REQUEST_TIMEOUT = (10.0, 60.0)
+
+# how many times to retry a request that fails to connect or gets a 5xx or 429
+# back from arxiv. the waits between retries go as REQUEST_BACKOFF*(2**n)
+# seconds and arxiv's Retry-After header is honored
+REQUEST_RETRIES = 4
+REQUEST_BACKOFF = 2.0
+
+# this is the pooled HTTP session we use for all requests to arxiv. it's
+# created by get_http_session
+HTTP_SESSION = None
+
+# this is used to parse the arxiv listing pages
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+# these are written as <tag/> in the comments markup
+VOID_ELEMENTS = set(['br','hr','input','img','meta','spacer','link',
+                     'frame','base'])
+
+
+def get_http_session():
+    '''
+    This returns the pooled requests.Session used for all requests to arxiv,
+    creating it if needed.
+
+    The session keeps connections to arxiv alive between requests and retries
+    failed requests with exponential backoff.
+
+    '''
+
+    global HTTP_SESSION
+
+    if HTTP_SESSION is None:
+
+        retries = Retry(total=REQUEST_RETRIES,
+                        backoff_factor=REQUEST_BACKOFF,
+                        status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(max_retries=retries)
+
+        HTTP_SESSION = requests.Session()
+        HTTP_SESSION.headers.update(REQUEST_HEADERS)
+        HTTP_SESSION.mount('http://', adapter)
+        HTTP_SESSION.mount('https://', adapter)
+
+    return HTTP_SESSION
+
+
+
+def load_fetch_state(url, cachedir=None):
+    '''
+    This gets the state of the last successful ingest of the page at url from
+    the fetch state file in the cache directory.
+
+    Returns a dict with the 'etag', 'last_modified', and 'sha1' of the page at
+    the time, or an empty dict if we've never fetched it.
+
+    '''
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    statefile = os.path.join(cachedir, FETCH_STATE_FILE)
+
+    if not os.path.exists(statefile):
+        return {}
+
+    try:
+        with open(statefile,'rb') as infd:
+            fetchstate = json.load(infd)
+    except ValueError:
+        print('fetch state file %s is corrupt, ignoring it' % statefile)
+        return {}
+
+    return fetchstate.get(url, {})
+
+
+
+def save_fetch_state(fetch, cachedir=None):
+    '''
+    This saves the fetch state of a page to the fetch state file in the cache
+    directory. fetch is the dict in the 'fetch' key of the arxivdict returned
+    by arxiv_update.
+
+    This should only be called once the page's articles are safely in the
+    DB. Otherwise, the next run would see the page as unchanged and skip it.
+
+    '''
+
+    if not fetch or not fetch.get('state'):
+        return
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    statefile = os.path.join(cachedir, FETCH_STATE_FILE)
+    fetchstate = {}
+
+    if os.path.exists(statefile):
+        try:
+            with open(statefile,'rb') as infd:
+                fetchstate = json.load(infd)
+        except ValueError:
+            fetchstate = {}
+
+    fetchstate[fetch['url']] = fetch['state']
+
+    # write to a temp file and move it into place so a crash doesn't leave a
+    # half-written state file behind
+    with open('%s.tmp' % statefile,'wb') as outfd:
+        json.dump(fetchstate, outfd, indent=2, sort_keys=True)
+    os.rename('%s.tmp' % statefile, statefile)
+
+
+
+def fetch_page(url, state=None, timeout=REQUEST_TIMEOUT):
+    '''
+    This fetches the page at url using the pooled HTTP session.
+
+    If state is a dict from load_fetch_state, the request is made conditional
+    with If-None-Match and If-Modified-Since headers, and a page whose body
+    hasn't changed is treated the same as a 304 Not Modified response.
+
+    Returns a dict with keys:
+
+    'status': 'ok', 'notmodified', 'unchanged', or 'failed'
+    'html': the HTML of the page if status is 'ok', otherwise None
+    'state': the new fetch state of the page to pass to save_fetch_state
+
+    '''
+
+    session = get_http_session()
+    headers = {}
+
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
+    try:
+
+        pagerequest = session.get(url,
+                                  headers=headers,
+                                  timeout=timeout)
+
+    except requests.exceptions.RequestException as e:
+
+        print('could not fetch %s: %s' % (url, e))
+        return {'status':'failed', 'html':None, 'state':None}
+
+    if pagerequest.status_code == requests.codes.not_modified:
+
+        # only the time we last checked the page changes
+        if state:
+            state = dict(state,
+                         fetched=datetime.now(tz=utc).isoformat())
+
+        return {'status':'notmodified', 'html':None, 'state':state}
+
+    elif pagerequest.status_code != requests.codes.ok:
+
+        print('could not fetch %s: HTTP status %s' %
+              (url, pagerequest.status_code))
+        return {'status':'failed', 'html':None, 'state':None}
+
+    newstate = {
+        'etag':pagerequest.headers.get('ETag'),
+        'last_modified':pagerequest.headers.get('Last-Modified'),
+        'sha1':hashlib.sha1(pagerequest.content).hexdigest(),
+        'fetched':datetime.now(tz=utc).isoformat()
+    }
+
+    if state and state.get('sha1') == newstate['sha1']:
+        return {'status':'unchanged', 'html':None, 'state':newstate}
+
+    return {'status':'ok', 'html':pagerequest.text, 'state':newstate}
+
+
 
 def get_page_html(url, fakery=False):
     '''
     This connects to the arxiv server and downloads the HTML of the page, while
     faking some activity if requested via the Selenium browser driver.
 
+    Returns None if the page couldn't be fetched.
+
     '''
 
     if fakery:
@@ -52,199 +259,652 @@ def get_page_html(url, fakery=False):
 
     else:
 
-        pagerequest = requests.get(url,
-                                   headers=REQUEST_HEADERS)
+        html = fetch_page(url)['html']
+
+    return html
+
+
+def parse_listing_html(htmldoc):
+    '''
+    Loads the HTML document obtained by get_page_html into an lxml element
+    tree.
+
+    This replaces the BeautifulSoup tree we used to build here. lxml builds the
+    tree in C and is many times faster and smaller than BeautifulSoup for the
+    large /new and /pastweek pages.
+
+    '''
+
+    if isinstance(htmldoc, unicode):
+        htmldoc = htmldoc.encode('utf-8')
+
+    return lxml.html.document_fromstring(htmldoc, parser=HTML_PARSER)
+
+
+
+def element_text(elem):
+    '''
+    This returns all the text inside elem as a plain unicode string.
+
+    lxml's text results keep a reference to their tree, so we don't hang on to
+    them.
+
+    The text of any <script> elements is left out, like BeautifulSoup did.
+    Pages saved from a browser have MathJax's <script type="math/tex"> copy of
+    the TeX next to each bit of rendered math.
+
+    '''
+
+    if elem.find('.//script') is None:
+        return unicode(elem.text_content())
+
+    parts = []
+
+    def gather(node):
+        if node.tag == 'script':
+            return
+        # HTML comments don't count as text
+        if isinstance(node.tag, basestring) and node.text:
+            parts.append(node.text)
+        for child in node:
+            gather(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    gather(elem)
+    return u''.join(parts)
+
+
+
+def element_class(elem):
+    '''
+    This returns the list of CSS classes of elem.
+
+    '''
+
+    return (elem.get('class') or '').split()
+
+
+
+def escape_markup(text):
+    '''
+    This escapes &, <, and > in text or attribute values.
+
+    '''
+
+    return text.replace(
+        '&','&amp;'
+    ).replace(
+        '<','&lt;'
+    ).replace(
+        '>','&gt;'
+    )
+
+
 
-        if pagerequest.status_code == requests.codes.ok:
-            html = pagerequest.text
+def element_markup(elem):
+    '''
+    This turns elem (but not its tail) back into HTML markup.
+
+    This is used for the links, etc. in the article comments, and writes the
+    same markup that BeautifulSoup used to write for these, so the comments
+    stored in the DB don't change: attributes are sorted, quoted with single
+    quotes only if the value has a double quote, void elements are closed with
+    />, and HTML comments are reduced to their text.
+
+    '''
+
+    # HTML comments and processing instructions only keep their text
+    if not isinstance(elem.tag, basestring):
+        return elem.text or u''
+
+    attrs = []
+
+    for key, val in sorted(elem.attrib.items()):
+
+        if key == 'class':
+            val = ' '.join(val.split())
+
+        val = escape_markup(val)
+
+        if '"' in val:
+            if "'" in val:
+                val = u'"%s"' % val.replace('"','&quot;')
+            else:
+                val = u"'%s'" % val
         else:
-            html = None
+            val = u'"%s"' % val
 
-    return html
+        attrs.append(u' %s=%s' % (key, val))
+
+    if elem.tag in VOID_ELEMENTS:
+        return u'<%s%s/>' % (elem.tag, ''.join(attrs))
+
+    contents = [escape_markup(elem.text or u'')]
+    for child in elem:
+        contents.append(element_markup(child))
+        contents.append(escape_markup(child.tail or u''))
+
+    return u'<%s%s>%s</%s>' % (elem.tag,
+                               ''.join(attrs),
+                               ''.join(contents),
+                               elem.tag)
 
 
-def soupify(htmldoc):
+
+def get_listing_entries(listing):
     '''
-    Loads the HTML document obtained by get_page_html into an instance of
-    BeautifulSoup.
+    This gets the <dt> and <div class="meta"> elements for all entries in a
+    single <dl> listing element, walking its children only once.
+
+    Returns two lists of the same length: the <dt> elements (which hold the
+    arxiv links) and the corresponding <div class="meta"> elements (which hold
+    the title, authors, comments, and abstract).
 
     '''
 
-    return BeautifulSoup(htmldoc)
+    links, data = [], []
+
+    for elem in listing:
+
+        if elem.tag == 'dt':
+            links.append(elem)
 
+        elif elem.tag == 'dd':
+            for child in elem.iter('div'):
+                if 'meta' in element_class(child):
+                    data.append(child)
+                    break
 
-def get_arxiv_lists(soup):
+    return links, data
+
+
+
+def get_arxiv_lists(tree):
     '''
-    This gets a list of articles from the soupified HTML document.
+    This gets a list of articles from the parsed HTML document.
 
     '''
 
-    docparts = soup.find_all('dl')
+    docparts = list(tree.iter('dl'))
 
     papers, crosslists, replacements = docparts
 
+    paperlinks, paperdata = get_listing_entries(papers)
+    crosslinks, crossdata = get_listing_entries(crosslists)
+    replacelinks, replacedata = get_listing_entries(replacements)
 
-    paperlinks, paperdata = (papers.find_all('dt'),
-                             papers.find_all('div', class_='meta'))
-    crosslinks, crossdata = (crosslists.find_all('dt'),
-                             crosslists.find_all('div', class_='meta'))
+    return (paperlinks, paperdata,
+            crosslinks, crossdata,
+            replacelinks, replacedata)
 
 
-    return paperlinks, paperdata, crosslinks, crossdata
 
+def parse_listing_entry(link, data, fix_comment_links=True):
+    '''
+    This parses a single listing entry into a dict, given its <dt> element
+    (link) and its <div class="meta"> element (data).
 
+    The children of the meta element are only walked once. Entries without an
+    abstract (replacements and the /pastweek listings) get an empty string for
+    it. If fix_comment_links is True, internal arxiv links in the comments are
+    turned into absolute URLs.
 
-def get_arxiv_articles(paperlinks, paperdata, crosslinks, crossdata):
+    '''
 
-    paperdict = {}
-    crossdict = {}
+    title_elem, authors_elem, comments_elem, abstract_elem = (
+        None, None, None, None
+    )
 
-    for ind, link, data in zip(range(len(paperlinks)), paperlinks, paperdata):
+    for elem in data:
+
+        if elem.tag == 'div':
+
+            elem_class = element_class(elem)
 
-        paper_abstract = squeeze(data.p.text.replace('\n',' ').strip())
-        paper_title = squeeze(
-            data.find_all(
-                'div',class_='list-title'
-            )[0].text.strip('\n').replace('Title:','',1)
+            if 'list-title' in elem_class and title_elem is None:
+                title_elem = elem
+            elif 'list-authors' in elem_class and authors_elem is None:
+                authors_elem = elem
+            elif 'list-comments' in elem_class and comments_elem is None:
+                comments_elem = elem
+
+        elif elem.tag == 'p' and abstract_elem is None:
+            abstract_elem = elem
+
+    if abstract_elem is not None:
+        abstract = squeeze(
+            element_text(abstract_elem).replace('\n',' ').strip()
         )
+    else:
+        abstract = ''
 
-        paper_authors = (
-            data.find_all(
-                'div',class_='list-authors'
-            )[0].text.strip('\n').replace('Authors:','',1)
-            )
-        paper_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
-                         for x in paper_authors.split(', ')]
+    title = squeeze(
+        element_text(title_elem).strip('\n').replace('Title:','',1)
+    )
 
-        paper_links = link.find_all('a')[1:3]
-        paper_link, arxiv_id = paper_links[0]['href'], paper_links[0].text
-        paper_pdf = paper_links[1]['href']
+    authors = element_text(authors_elem).strip('\n').replace('Authors:','',1)
+    authors = [squeeze(x.lstrip('\n').rstrip('\n'))
+               for x in authors.split(', ')]
 
-        try:
-            comment_contents = data.find(
-                'div',class_='list-comments'
-            ).contents[2:]
-            paper_comments = squeeze(' '.join(
-                [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
-                ).strip())
+    entry_links = list(link.iter('a'))[1:3]
+    entry_link, arxiv_id = (entry_links[0].get('href'),
+                            element_text(entry_links[0]))
+    entry_pdf = entry_links[1].get('href')
 
-            # handle internal arxiv links correctly
-            if '<a href="/abs' in paper_comments:
-                paper_comments = paper_comments.replace(
-                    '/abs','https://arxiv.org/abs'
-                    )
+    if comments_elem is not None and len(comments_elem) > 0:
 
-        except AttributeError:
-            paper_comments = ''
+        # the comments are everything after the 'Comments:' descriptor
+        comment_contents = [comments_elem[0].tail]
+        for elem in comments_elem[1:]:
+            comment_contents.extend([element_markup(elem), elem.tail])
 
+        comments = squeeze(' '.join(
+            [x.lstrip('\n').rstrip('\n') for x in comment_contents if x]
+            ).strip())
 
-        paperdict[ind+1] = {'authors':paper_authors,
-                            'title':paper_title,
-                            'abstract':paper_abstract,
-                            'comments':paper_comments,
-                            'arxiv':arxiv_id,
-                            'link':paper_link,
-                            'pdf':paper_pdf}
+        # handle internal arxiv links correctly
+        if fix_comment_links and '<a href="/abs' in comments:
+            comments = comments.replace(
+                '/abs','https://arxiv.org/abs'
+                )
 
+    else:
+        comments = ''
 
-    for ind, link, data in zip(range(len(crosslinks)), crosslinks, crossdata):
+    return {'authors':authors,
+            'title':title,
+            'abstract':abstract,
+            'comments':comments,
+            'arxiv':arxiv_id,
+            'link':entry_link,
+            'pdf':entry_pdf}
 
-        cross_abstract = squeeze(data.p.text.replace('\n',' ').strip())
-        cross_title = squeeze(
-            data.find_all(
-                'div',class_='list-title'
-            )[0].text.strip('\n').replace('Title:','',1)
-        )
 
-        cross_authors = (
-            data.find_all(
-                'div',class_='list-authors'
-            )[0].text.strip('\n').replace('Authors:','',1)
-            )
-        cross_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
-                         for x in cross_authors.split(', ')]
 
-        cross_links = link.find_all('a')[1:3]
-        cross_link, arxiv_id = cross_links[0]['href'], cross_links[0].text
-        cross_pdf = cross_links[1]['href']
+def iter_arxiv_articles(paperlinks, paperdata, crosslinks, crossdata):
+    '''
+    This parses the papers and cross-lists one at a time, so the ingest
+    pipeline in arxivingest can work on each one as soon as it's parsed.
+
+    Yields tuples of ('papers' or 'crosslists', index, article dict). The index
+    starts at 1 for both lists.
+
+    '''
+
+    for ind, link, data in zip(range(len(paperlinks)), paperlinks, paperdata):
+
+        yield 'papers', ind+1, parse_listing_entry(link, data)
+
+
+    for ind, link, data in zip(range(len(crosslinks)), crosslinks, crossdata):
+
+        # the comments for cross-lists have always kept arxiv's relative links.
+        # we keep it that way so the stored comments don't change.
+        article = parse_listing_entry(link, data, fix_comment_links=False)
+        cross_title = article['title']
 
         # figure out which original arxiv this came from
         try:
-            cltext = link.text
+            cltext = element_text(link)
             cltext_xlind_start = cltext.index('cross-list')
             cltext_xlind_end = cltext.index('[pdf') - 2
 
             # annotate the title with the original arxiv category
             cltext = cltext[cltext_xlind_start:cltext_xlind_end]
-            cross_title = u'[%s] %s' % (cltext, cross_title)
+            article['title'] = u'[%s] %s' % (cltext, cross_title)
 
         # if the cross-list doesn't say where it came from, just add a
         # [cross-list] annotation
         except:
-            cross_title = u'[cross-list] %s' % cross_title
+            article['title'] = u'[cross-list] %s' % cross_title
 
-        try:
-            comment_contents = data.find(
-                'div',class_='list-comments'
-            ).contents[2:]
-            cross_comments = squeeze(
-                ' '.join(
-                    [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
-                ).strip()
-            )
+        yield 'crosslists', ind+1, article
 
-            # handle internal arxiv links correctly
-            if '<a href="/abs' in paper_comments:
-                paper_comments = paper_comments.replace(
-                    '/abs','https://arxiv.org/abs'
-                    )
 
-        except AttributeError:
-            cross_comments = ''
 
-        crossdict[ind+1] = {'authors':cross_authors,
-                            'title':cross_title,
-                            'abstract':cross_abstract,
-                            'comments':cross_comments,
-                            'arxiv':arxiv_id,
-                            'link':cross_link,
-                            'pdf':cross_pdf}
+def get_arxiv_articles(paperlinks, paperdata, crosslinks, crossdata):
+
+    articles = {'papers':{}, 'crosslists':{}}
+
+    for listtype, ind, article in iter_arxiv_articles(paperlinks, paperdata,
+                                                      crosslinks, crossdata):
+        articles[listtype][ind] = article
+
+    return articles['papers'], articles['crosslists']
+
+
+
+def get_arxiv_replacements(replacelinks, replacedata):
+    '''
+    This gets the replaced articles from the third part of the arxiv listing.
+
+    Replacement entries usually don't come with an abstract, so the 'abstract'
+    key is an empty string for these. The 'title' doesn't get the cross-list
+    annotation that get_arxiv_articles adds; arxivdb.update_replacements keeps
+    whatever annotation the stored article already has.
 
+    '''
+
+    replacedict = {}
+
+    for ind, link, data in zip(range(len(replacelinks)),
+                               replacelinks,
+                               replacedata):
+
+        replacedict[ind+1] = parse_listing_entry(link, data)
+
+    return replacedict
+
+
+
+def parse_arxiv_listing(html):
+    '''
+    This parses the HTML of an arxiv /new listing.
+
+    Returns a tuple of dicts: (papers, crosslists, replacements).
+
+    '''
+
+    tree = parse_listing_html(html)
+
+    (paperlinks, paperdata,
+     crosslinks, crossdata,
+     replacelinks, replacedata) = get_arxiv_lists(tree)
+
+    # process the papers and crosslists
+    paperdict, crosslistdict = get_arxiv_articles(paperlinks, paperdata,
+                                                  crosslinks, crossdata)
 
-    return paperdict, crossdict
+    # process the replacements
+    replacedict = get_arxiv_replacements(replacelinks, replacedata)
+
+    return paperdict, crosslistdict, replacedict
+
+
+
+def make_arxivdict(utc_dt, paperdict, crosslistdict, replacedict):
+    '''
+    This puts together the arxivdict that arxivdb.insert_articles takes.
+
+    '''
+
+    return {'utc':utc_dt,
+            'npapers':len(paperdict.keys()),
+            'papers':paperdict,
+            'ncrosslists':len(crosslistdict.keys()),
+            'crosslists':crosslistdict,
+            'nreplacements':len(replacedict.keys()),
+            'replacements':replacedict}
+
+
+
+## LISTING ARCHIVE
+
+def listing_archive_paths(utc_dt, cachedir=None):
+    '''
+    This returns the paths of the archived HTML and the archived articles for
+    the listing ingested at utc_dt.
+
+    '''
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    basepath = os.path.join(cachedir,
+                            LISTING_ARCHIVE_DIR,
+                            utc_dt.strftime('%Y'),
+                            utc_dt.strftime('arxiv-listing-%Y%m%dT%H%M%SZ'))
+
+    return '%s.html.gz' % basepath, '%s.jsonl.gz' % basepath
+
+
+
+def archive_listing_html(html, utc_dt, cachedir=None):
+    '''
+    This saves the raw HTML of the listing ingested at utc_dt as a gzipped file
+    in the listing archive.
+
+    Returns the path to the file.
+
+    '''
+
+    htmlpath, jsonlpath = listing_archive_paths(utc_dt, cachedir=cachedir)
+
+    if not os.path.exists(os.path.dirname(htmlpath)):
+        os.makedirs(os.path.dirname(htmlpath))
+
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+
+    # write to a temp file and move it into place so we never have a partial
+    # archive lying around
+    outfd = gzip.open('%s.tmp' % htmlpath, 'wb')
+    try:
+        outfd.write(html)
+    finally:
+        outfd.close()
+    os.rename('%s.tmp' % htmlpath, htmlpath)
+
+    return htmlpath
+
+
+
+def archive_listing_articles(articles, utc_dt, url, cachedir=None):
+    '''
+    This saves the parsed articles of the listing ingested at utc_dt as a
+    gzipped JSON lines file in the listing archive.
+
+    articles is an iterable of (list type, index, article dict) tuples, where
+    the list type is 'papers', 'crosslists', or 'replacements'. The first line
+    of the file has the utc datetime and url of the listing; each line after
+    that has one article with its 'list' and 'index' added.
+
+    Returns the path to the file.
+
+    '''
+
+    htmlpath, jsonlpath = listing_archive_paths(utc_dt, cachedir=cachedir)
+
+    if not os.path.exists(os.path.dirname(jsonlpath)):
+        os.makedirs(os.path.dirname(jsonlpath))
+
+    outfd = gzip.open('%s.tmp' % jsonlpath, 'wb')
+
+    try:
+
+        outfd.write('%s\n' % json.dumps({'utc':utc_dt.isoformat(),
+                                         'url':url}))
+
+        for listtype, index, article in articles:
+            line = dict(article)
+            line['list'] = listtype
+            line['index'] = index
+            outfd.write('%s\n' % json.dumps(line, sort_keys=True))
+
+    finally:
+        outfd.close()
+
+    os.rename('%s.tmp' % jsonlpath, jsonlpath)
+
+    return jsonlpath
+
+
+
+def find_listing_archives(start_date=None, end_date=None, cachedir=None):
+    '''
+    This finds the archived listings ingested between start_date and end_date
+    (datetime.date instances, inclusive).
+
+    Returns a list of (utc datetime, HTML path, JSONL path) tuples sorted by
+    date. The JSONL path is None if only the HTML was archived.
+
+    '''
+
+    if not cachedir:
+        cachedir = CACHEDIR
+
+    archives = []
+
+    for htmlpath in glob.glob(os.path.join(cachedir,
+                                           LISTING_ARCHIVE_DIR,
+                                           '*',
+                                           'arxiv-listing-*.html.gz')):
+
+        utc_dt = datetime.strptime(
+            os.path.basename(htmlpath),
+            'arxiv-listing-%Y%m%dT%H%M%SZ.html.gz'
+        ).replace(tzinfo=utc)
+
+        if start_date and utc_dt.date() < start_date:
+            continue
+        if end_date and utc_dt.date() > end_date:
+            continue
+
+        jsonlpath = htmlpath.replace('.html.gz','.jsonl.gz')
+        if not os.path.exists(jsonlpath):
+            jsonlpath = None
+
+        archives.append((utc_dt, htmlpath, jsonlpath))
+
+    return sorted(archives)
+
+
+
+def iter_archived_articles(jsonlpath):
+    '''
+    This reads the articles from an archived JSONL file one at a time.
+
+    Yields (list type, index, article dict) tuples like the ones that went into
+    archive_listing_articles.
+
+    '''
+
+    infd = gzip.open(jsonlpath, 'rb')
+
+    try:
+
+        # skip the header
+        infd.readline()
+
+        for line in infd:
+            article = json.loads(line)
+            yield article.pop('list'), article.pop('index'), article
+
+    finally:
+        infd.close()
+
+
+
+def load_listing_archive(utc_dt, htmlpath, jsonlpath, reparse=False):
+    '''
+    This loads an archived listing into an arxivdict for
+    arxivdb.insert_articles.
+
+    The articles come from the archived JSONL file, unless reparse is True or
+    there is no JSONL file, in which case the archived HTML is parsed again
+    (e.g. to pick up changes to the parser).
+
+    '''
+
+    if reparse or not jsonlpath:
+
+        infd = gzip.open(htmlpath, 'rb')
+        try:
+            html = infd.read().decode('utf-8')
+        finally:
+            infd.close()
+
+        return make_arxivdict(utc_dt, *parse_arxiv_listing(html))
+
+    articles = {'papers':{}, 'crosslists':{}, 'replacements':{}}
+
+    for listtype, index, article in iter_archived_articles(jsonlpath):
+        articles[listtype][index] = article
+
+    return make_arxivdict(utc_dt,
+                          articles['papers'],
+                          articles['crosslists'],
+                          articles['replacements'])
 
 
 
 def arxiv_update(url='http://arxiv.org/list/astro-ph/new',
                  fakery=False,
-                 pickledict=False):
+                 archive=True,
+                 conditional=True,
+                 cachedir=None):
     '''
     This rolls up all the functions above.
 
+    If conditional is True (and fakery is False), the listing is only fetched
+    and parsed if it changed since the last time it was ingested (see
+    load_fetch_state and save_fetch_state). Returns None if the listing hasn't
+    changed or couldn't be fetched.
+
+    If archive is True, the raw HTML and the parsed articles are saved to the
+    listing archive in the cache directory. These can be put back into the DB
+    later without going to arxiv again (see arxivingest.replay_listings).
+
+    The returned arxivdict has a 'fetch' key with the url and the new fetch
+    state of the listing. Pass this to save_fetch_state once the articles are
+    in the DB.
+
     '''
 
     print('updating article DB from arxiv...')
 
-    html = get_page_html(url, fakery=fakery)
-    soup = soupify(html)
+    fetch = {'url':url, 'state':None}
 
-    paperlinks, paperdata, crosslinks, crossdata = get_arxiv_lists(soup)
+    if fakery:
+
+        html = get_page_html(url, fakery=fakery)
+
+    else:
+
+        if conditional:
+            state = load_fetch_state(url, cachedir=cachedir)
+        else:
+            state = None
+
+        fetched = fetch_page(url, state=state)
+
+        if fetched['status'] in ('notmodified', 'unchanged'):
+            print('arxiv listing at %s has not changed since the last update, '
+                  'nothing to do' % url)
+            # the listing's articles are already in the DB, so its new ETag
+            # and Last-Modified time can be saved right away
+            save_fetch_state({'url':url, 'state':fetched['state']},
+                             cachedir=cachedir)
+            return None
+
+        html = fetched['html']
+        fetch['state'] = fetched['state']
+
+    if not html:
+        print('could not get the arxiv listing at %s' % url)
+        return None
 
-    # process the papers and crosslists
-    paperdict, crosslistdict = get_arxiv_articles(paperlinks, paperdata,
-                                                  crosslinks, crossdata)
     now = datetime.now(tz=utc)
 
-    arxiv = {'utc':now,
-             'npapers':len(paperdict.keys()),
-             'papers':paperdict,
-             'ncrosslists':len(crosslistdict.keys()),
-             'crosslists':crosslistdict}
-
-    if pickledict:
-        import cPickle as pickle
-        pickle_fpath = 'data/%s-UT-arxiv.pkl' % now.strftime('%Y-%m-%d')
-        with open(pickle_fpath,'wb') as fd:
-            pickle.dump(arxiv, fd, pickle.HIGHEST_PROTOCOL)
+    if archive:
+        archive_listing_html(html, now, cachedir=cachedir)
+
+    paperdict, crosslistdict, replacedict = parse_arxiv_listing(html)
+
+    arxiv = make_arxivdict(now, paperdict, crosslistdict, replacedict)
+    arxiv['fetch'] = fetch
+
+    if archive:
+        archive_listing_articles(
+            ([('papers', x, paperdict[x]) for x in sorted(paperdict)] +
+             [('crosslists', x, crosslistdict[x])
+              for x in sorted(crosslistdict)] +
+             [('replacements', x, replacedict[x])
+              for x in sorted(replacedict)]),
+            now,
+            url,
+            cachedir=cachedir
+        )
 
     return arxiv
@@ -10,6 +10,10 @@ import os.path
 import logging
 import base64
 import re
+import hashlib
+import hmac
+import time
+import math
 
 LOGGER = logging.getLogger(__name__)
 
@@ -17,13 +21,22 @@ from datetime import datetime, timedelta
 from pytz import utc, timezone
 
 import tornado.web
+import tornado.gen
+from tornado.concurrent import Future
 from tornado.escape import xhtml_escape, xhtml_unescape, url_unescape, squeeze
+from tornado.escape import json_encode
 
 import arxivdb
+import archivecache
 import webdb
 import fulltextsearch as fts
-
-import ipaddress
+import mathrender
+import pagecache
+import staleresults
+import geofence
+import ratelimit
+import metrics
+import sqlprofile
 
 ######################
 ## USEFUL CONSTANTS ##
@@ -33,6 +46,48 @@ ARCHIVEDATE_REGEX = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
 MONTH_NAMES = {x:datetime(year=2014,month=x,day=12)
                for x in range(1,13)}
 
+# the archive index is rebuilt only when the daily_stats table changes. this
+# holds the daily_stats version it was built for, the tree of dates from
+# group_arxiv_dates, and the rendered HTML
+ARCHIVE_INDEX_CACHE = {'version':None,
+                       'paper_archives':None,
+                       'html':None}
+
+# the vote totals and reservations changed since the last tick, keyed by
+# arxivid, and the open vote streams they're sent to. send_vote_updates sends
+# these out once every VOTE_UPDATE_INTERVAL seconds, so a paper that gets
+# several votes in one tick only sends its latest vote total
+VOTE_UPDATES = {}
+VOTE_LISTENERS = set()
+VOTE_UPDATE_INTERVAL = 1.0
+
+# the vote streams get a comment line this often if nothing else was sent, so
+# proxies don't close them
+VOTE_STREAM_KEEPALIVE = 30.0
+VOTE_STREAM_STATE = {'last_sent':0.0}
+
+# the longest time a vote stream is kept open for; the browser then opens a
+# new one after VOTE_STREAM_RETRY milliseconds
+VOTE_STREAM_MAX_AGE = 3600.0
+VOTE_STREAM_RETRY = 5000
+
+# the paper listing on the voting page is the same for every user, so it's
+# rendered once for each change to the listing. this holds the UTC date and
+# the listing change count it was rendered for, and the rendered HTML
+VOTING_PAGE_CACHE = {'utcdate':None,
+                     'changes':None,
+                     'html':None}
+
+# the pages in the page cache are rendered with these in place of the XSRF
+# form field and the clock in the footer, which are filled in for each request
+PAGE_XSRF_PLACEHOLDER = '__pagecache_xsrf_form_html__'
+PAGE_TIME_PLACEHOLDER = '__pagecache_local_today__'
+
+# the most abstracts that can be asked for in one request, and how long
+# browsers can keep them
+MAX_ABSTRACTS_PER_REQUEST = 100
+ABSTRACTS_MAX_AGE = 3600
+
 
 ######################
 ## USEFUL FUNCTIONS ##
@@ -95,29 +150,172 @@ def group_arxiv_dates(dates, npapers, nlocal, nvoted):
 
     '''
 
-    years, months = [], []
+    yeardict = {}
 
-    for x in dates:
-        years.append(x.year)
-        months.append(x.month)
+    for (x,y,z,w) in zip(dates, npapers, nlocal, nvoted):
 
-    unique_years = set(years)
-    unique_months = set(months)
+        months = yeardict.setdefault(x.year, {})
+        months.setdefault(MONTH_NAMES[x.month], []).append((x,y,z,w))
 
-    yeardict = {}
+    return yeardict
 
-    for year in unique_years:
-        yeardict[year] = {}
-        for month in unique_months:
-            yeardict[year][MONTH_NAMES[month]] = [
-                (x,y,z,w) for (x,y,z,w) in zip(dates, npapers, nlocal, nvoted)
-                if (x.year == year and x.month == month)
-                ]
-        for month in yeardict[year].copy():
-            if not yeardict[year][month]:
-                del yeardict[year][month]
 
-    return yeardict
+
+def queue_vote_update(arxivid, nvotes=None, reserved=None):
+    '''
+    This adds a change in the vote total or reservation status of arxivid to
+    the updates sent to the open voting pages on the next tick.
+
+    '''
+
+    update = VOTE_UPDATES.setdefault(arxivid, {'arxivid':arxivid})
+
+    if nvotes is not None:
+        update['nvotes'] = nvotes
+    if reserved is not None:
+        update['reserved'] = reserved
+
+
+
+def send_vote_updates():
+    '''
+    This sends the queued vote and reservation updates to all open vote
+    streams as a single event, and clears the queue. The server runs this
+    every VOTE_UPDATE_INTERVAL seconds.
+
+    '''
+
+    now = time.time()
+
+    if VOTE_UPDATES:
+        message = 'data: %s\n\n' % json_encode(
+            [VOTE_UPDATES[x] for x in sorted(VOTE_UPDATES)]
+        )
+        VOTE_UPDATES.clear()
+    elif now - VOTE_STREAM_STATE['last_sent'] > VOTE_STREAM_KEEPALIVE:
+        message = ': keepalive\n\n'
+    else:
+        return
+
+    VOTE_STREAM_STATE['last_sent'] = now
+
+    for listener in list(VOTE_LISTENERS):
+        listener.send_event(message)
+
+
+
+def page_not_modified(handler, *etag_parts):
+    '''
+    This sets the ETag header for a page to the SHA1 of etag_parts (everything
+    the page depends on: the listing change count, the user name, the flash
+    message, the clock in the top bar, etc.), and checks it against the
+    If-None-Match header of the request.
+
+    Returns True if the browser's copy of the page is still current, in which
+    case the handler can just send back an empty 304.
+
+    '''
+
+    etag = hashlib.sha1(repr(etag_parts)).hexdigest()
+    handler.set_header('Etag', '"%s"' % etag)
+
+    # the pages have per-user parts, so they shouldn't be cached by proxies,
+    # and browsers should always check if their copy is current
+    handler.set_header('Cache-Control', 'private, no-cache')
+
+    return handler.check_etag_header()
+
+
+
+def finish_cached_page(handler, html):
+    '''
+    This fills in the per-request parts of a page from the page cache (the
+    XSRF form field and the clock in the footer) and sends it.
+
+    '''
+
+    local_today = datetime.now(tz=utc).strftime('%Y-%m-%d %H:%M %Z')
+
+    html = html.replace(PAGE_XSRF_PLACEHOLDER, handler.xsrf_form_html())
+    html = html.replace(PAGE_TIME_PLACEHOLDER, local_today)
+
+    handler.finish(html)
+
+
+
+def send_cached_page(handler):
+    '''
+    This sends the cached copy of the page at the request's URL, if there's an
+    up-to-date one in the page cache.
+
+    Returns True if the page was sent.
+
+    '''
+
+    html = pagecache.load_page(handler.request.uri,
+                               database=handler.database)
+
+    if html is None:
+        return False
+
+    finish_cached_page(handler, html)
+    return True
+
+
+
+def render_cached_page(handler, versions, template_name, **kwargs):
+    '''
+    This renders a page that's the same for every visitor, saves it to the
+    page cache along with versions (the tag versions from
+    pagecache.get_tag_versions it depends on), and sends it. Pages with a
+    flash message are just rendered.
+
+    '''
+
+    if kwargs.get('flash_message'):
+        handler.render(template_name, **kwargs)
+        return
+
+    # render the page with placeholders for the per-request parts
+    kwargs['local_today'] = PAGE_TIME_PLACEHOLDER
+    handler.xsrf_form_html = lambda: PAGE_XSRF_PLACEHOLDER
+
+    try:
+        html = handler.render_string(template_name, **kwargs)
+    finally:
+        del handler.xsrf_form_html
+
+    pagecache.save_page(handler.request.uri, html, versions)
+    finish_cached_page(handler, html)
+
+
+
+def stale_flash_message(handler, flash_message, stale_since):
+    '''
+    This marks a page made from stale results (see staleresults.fetch) as
+    stale, and returns flash_message with a note saying how old the page is.
+
+    stale_since is the UNIX time the oldest of the stale results was fetched.
+
+    '''
+
+    # the page_not_modified ETag is for the current results, so leave it
+    # to Tornado to make one out of the page itself
+    handler.clear_header('Etag')
+    handler.set_header('Warning', '110 - "Response is Stale"')
+
+    stale_time = datetime.fromtimestamp(stale_since, tz=utc).strftime(
+        '%Y-%m-%d %H:%M %Z'
+    )
+
+    return (
+        (flash_message or '') +
+        "<div data-alert class=\"alert-box radius\">"
+        "The Astro-Coffee database is busy at the moment, so this page "
+        "shows the papers as they were at %s. "
+        "Please reload it in a few minutes for the latest updates."
+        "<a href=\"#\" class=\"close\">&times;</a></div>"
+    ) % stale_time
 
 
 
@@ -126,7 +324,142 @@ def group_arxiv_dates(dates, npapers, nlocal, nvoted):
 ##################
 
 
-class CoffeeHandler(tornado.web.RequestHandler):
+class InstrumentedHandler(tornado.web.RequestHandler):
+    '''
+    This is the base class for the handlers whose requests are timed in the
+    metrics (see metrics.py). It records how long each request takes, the
+    number of SQL queries it runs, the requests being handled right now, and
+    how long each template takes to render.
+
+    '''
+
+    def prepare(self):
+        '''
+        This counts the request as being handled.
+
+        '''
+
+        metrics.add_value('coffee_requests_in_flight', (), 1)
+        self.metrics_in_flight = True
+        self.queries_at_start = sqlprofile.QUERIES_RUN
+
+
+    def render_string(self, template_name, **kwargs):
+        '''
+        This times the template render.
+
+        '''
+
+        start = time.time()
+
+        try:
+            return super(InstrumentedHandler, self).render_string(
+                template_name,
+                **kwargs
+            )
+        finally:
+            metrics.observe('coffee_template_render_seconds',
+                            (template_name,),
+                            time.time() - start)
+
+
+    def on_finish(self):
+        '''
+        This records how long the request took.
+
+        '''
+
+        # requests turned away before prepare (e.g. by the XSRF check) were
+        # never counted as being handled
+        if getattr(self, 'metrics_in_flight', False):
+            metrics.add_value('coffee_requests_in_flight', (), -1)
+
+        handler = self.__class__.__name__
+        method = self.request.method
+
+        metrics.observe('coffee_request_duration_seconds',
+                        (handler, method),
+                        self.request.request_time())
+        metrics.add_value('coffee_requests_total',
+                          (handler, method, '%s' % self.get_status()))
+
+        if getattr(self, 'queries_at_start', None) is not None:
+
+            nqueries = sqlprofile.QUERIES_RUN - self.queries_at_start
+            metrics.observe('coffee_request_db_queries', (handler,), nqueries)
+
+            if nqueries > sqlprofile.REQUEST_QUERY_WARNING:
+                LOGGER.warning('%s %s ran %s SQL queries, '
+                               'check for queries run in a loop' %
+                               (method, self.request.uri, nqueries))
+
+
+
+class RateLimitedHandler(InstrumentedHandler):
+    '''
+    This is the base class for the handlers that use the DB. Requests from IPs
+    or sessions that are over their rate limits (see ratelimit.py) get a 429
+    before the handler does anything else.
+
+    POSTs (votes, reservations, edits, and searches) count as writes, and so
+    do page views without a session cookie on handlers that start a new
+    session for these. Everything else counts as a read.
+
+    '''
+
+    # set this to False for handlers that never start a new session
+    starts_sessions = True
+
+    def prepare(self):
+        '''
+        This takes a token from the rate limit buckets for the request's IP
+        and session, or turns the request away if there aren't any left.
+
+        '''
+
+        super(RateLimitedHandler, self).prepare()
+
+        session_token = self.get_secure_cookie('coffee_session',
+                                               max_age_days=30)
+
+        if (self.request.method == 'POST' or
+            (self.starts_sessions and not session_token)):
+            kind = 'write'
+        else:
+            kind = 'read'
+
+        keys = [('ip', self.request.remote_ip)]
+        if session_token:
+            keys.append(('session', session_token))
+
+        retry_after = ratelimit.take_token(kind, keys)
+
+        if retry_after > 0.0:
+
+            LOGGER.warning('rate limit for %ss hit by %s, %s '
+                           '(%s %ss refused so far)' %
+                           (kind, self.request.remote_ip,
+                            self.request.headers.get('User-Agent'),
+                            ratelimit.RATE_LIMITED[kind], kind))
+
+            message = ("You're sending requests too quickly. "
+                       "Please wait a few seconds and try again.")
+
+            self.set_status(429)
+            self.set_header('Retry-After', '%d' % math.ceil(retry_after))
+
+            # the JS on the pages gets a message it can show
+            if 'application/json' in self.request.headers.get('Accept', ''):
+                self.finish({'status':'failed',
+                             'message':message,
+                             'results':None})
+            else:
+                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+                self.finish(message)
+
+
+
+class CoffeeHandler(RateLimitedHandler):
 
     '''
     This handles all requests for /astroph-coffee and redirects based on
@@ -331,6 +664,20 @@ class CoffeeHandler(tornado.web.RequestHandler):
         utc_end = self.voting_end.strftime('%H:%M %Z')
         utc_coffee = self.coffee_time.strftime('%H:%M %Z')
 
+        # if the browser has the current version of the page, we're done
+        if page_not_modified(self,
+                             'index',
+                             user_name,
+                             new_user,
+                             flash_message,
+                             local_today,
+                             local_start,
+                             local_end,
+                             local_coffee):
+            self.set_status(304)
+            self.finish()
+            return
+
         self.render("index.html",
                     user_name=user_name,
                     local_today=local_today,
@@ -350,7 +697,7 @@ class CoffeeHandler(tornado.web.RequestHandler):
 
 
 
-class ArticleListHandler(tornado.web.RequestHandler):
+class ArticleListHandler(RateLimitedHandler):
     '''This handles all requests for the listing of selected articles and voting
     pages. Note: if nobody voted on anything, the default is to return all
     articles with local authors at the top.
@@ -528,28 +875,85 @@ class ArticleListHandler(tornado.web.RequestHandler):
 
         # check if we're in voting time-limits
         timenow = datetime.now(tz=utc).timetz()
+        voting_open = self.voting_start < timenow < self.voting_end
+
+        # if nothing on today's listing has changed since the browser got its
+        # copy of the page, we're done. if the DB is busy or slow, the page is
+        # made from the last good results instead, and stale_since is set to
+        # the time these were fetched
+        listing_changes, stale_since = staleresults.fetch(
+            'listing',
+            ('listing_changes', todays_utcdate),
+            None,
+            arxivdb.get_listing_changes,
+            todays_utcdate,
+            database=self.database
+        )
+
+        # the stale results are only kept again once they're fresh
+        results_version = None if stale_since else listing_changes
+
+        if not stale_since and page_not_modified(self,
+                                                 'papers',
+                                                 todays_utcdate,
+                                                 listing_changes,
+                                                 voting_open,
+                                                 user_name,
+                                                 new_user,
+                                                 flash_message,
+                                                 local_today):
+            self.set_status(304)
+            self.finish()
+            return
 
         # if we are within the time limits, then show the voting page
-        if (self.voting_start < timenow < self.voting_end):
+        if voting_open:
 
-            # get the articles for today
-            (local_articles, voted_articles,
-             other_articles, reserved_articles) = (
-                 arxivdb.get_articles_for_voting(database=self.database)
-            )
+            # the paper listing on the voting page is the same for everyone,
+            # so it's only rendered again after something on it changes
+            if (VOTING_PAGE_CACHE['utcdate'] == todays_utcdate and
+                VOTING_PAGE_CACHE['changes'] == listing_changes):
+
+                metrics.count_cache('voting_page', True)
+                voting_papers = VOTING_PAGE_CACHE['html']
+
+            else:
+
+                metrics.count_cache('voting_page', False)
+
+                voting_papers = None
+
+                # get the articles for today
+                ((local_articles, voted_articles,
+                  other_articles, reserved_articles),
+                 voting_stale_since) = staleresults.fetch(
+                     'listing',
+                     ('voting', todays_utcdate),
+                     results_version,
+                     arxivdb.get_articles_for_voting,
+                     database=self.database
+                 )
+                stale_since = stale_since or voting_stale_since
 
             # if today's papers aren't ready yet, redirect to the papers display
-            if not local_articles and not voted_articles and not other_articles:
+            if (voting_papers is None and
+                not local_articles and
+                not voted_articles and
+                not other_articles):
 
                 LOGGER.warning('no papers for today yet, '
                                'redirecting to previous day papers')
 
-                (latestdate, local_articles,
-                 voted_articles, other_articles, reserved_articles) = (
-                     arxivdb.get_articles_for_listing(
-                         database=self.database
-                     )
-                )
+                ((latestdate, local_articles,
+                  voted_articles, other_articles, reserved_articles),
+                 latest_stale_since) = staleresults.fetch(
+                     'listing',
+                     ('listing', None),
+                     None,
+                     arxivdb.get_articles_for_listing,
+                     database=self.database
+                 )
+                stale_since = stale_since or latest_stale_since
                 todays_date = datetime.strptime(
                     latestdate,
                     '%Y-%m-%d'
@@ -591,6 +995,19 @@ class ArticleListHandler(tornado.web.RequestHandler):
                         # update this article's local authors
                         local_articles[lind][4] = ', '.join(author_list)
 
+                # use the pre-rendered math for the titles and abstracts,
+                # unless the DB is busy
+                if stale_since:
+                    flash_message = stale_flash_message(self,
+                                                        flash_message,
+                                                        stale_since)
+                else:
+                    self.math_renders = mathrender.get_listing_renders(
+                        (local_articles, voted_articles,
+                         other_articles, reserved_articles),
+                        database=self.database
+                    )
+
                 # show the listing page
                 self.render("listing.html",
                             user_name=user_name,
@@ -607,76 +1024,106 @@ class ArticleListHandler(tornado.web.RequestHandler):
             # if today's papers are ready, show them and ask for votes
             else:
 
-                # get this user's votes
-                user_articles = arxivdb.get_user_votes(todays_utcdate,
-                                                       user_name,
-                                                       database=self.database)
-                user_reserved = arxivdb.get_user_reservations(
-                    todays_utcdate,
-                    user_name,
-                    database=self.database
-                )
-                LOGGER.info('user has votes on: %s, has reservations on: %s'
-                            % (user_articles, user_reserved))
+                if voting_papers is None:
 
-                # preprocess the local papers to highlight local author names
-                if len(local_articles) > 0:
+                    # preprocess the local papers to highlight local author
+                    # names
+                    if len(local_articles) > 0:
 
-                    for lind in range(len(local_articles)):
+                        for lind in range(len(local_articles)):
 
-                        author_list = local_articles[lind][4]
-                        author_list = author_list.split(': ')[-1].split(',')
+                            author_list = local_articles[lind][4]
+                            author_list = author_list.split(
+                                ': '
+                            )[-1].split(',')
 
-                        local_indices = local_articles[lind][-2]
+                            local_indices = local_articles[lind][-2]
 
-                        if local_indices and len(local_indices) > 0:
+                            if local_indices and len(local_indices) > 0:
 
-                            local_indices = [
-                                int(x) for x in local_indices.split(',')
-                            ]
+                                local_indices = [
+                                    int(x) for x in local_indices.split(',')
+                                ]
 
-                            for li in local_indices:
-                                author_list[li] = '<strong>%s</strong>' % (
-                                    author_list[li]
-                                )
+                                for li in local_indices:
+                                    author_list[li] = (
+                                        '<strong>%s</strong>' %
+                                        author_list[li]
+                                    )
 
-                        # update this article's local authors
-                        local_articles[lind][4] = ', '.join(author_list)
+                            # update this article's local authors
+                            local_articles[lind][4] = ', '.join(author_list)
+
+                    # use the pre-rendered math for the titles and
+                    # abstracts, unless the DB is busy
+                    if not stale_since:
+                        self.math_renders = mathrender.get_listing_renders(
+                            (local_articles, voted_articles,
+                             other_articles, reserved_articles),
+                            database=self.database
+                        )
+
+                    voting_papers = self.render_string(
+                        "voting-papers.html",
+                        local_articles=local_articles,
+                        voted_articles=voted_articles,
+                        other_articles=other_articles,
+                        reserved_articles=reserved_articles,
+                        reserve_interval_days=self.reserve_interval,
+                        user_articles=[],
+                        user_reserved=[]
+                    )
+
+                    # a listing made from stale results isn't kept
+                    if not stale_since:
+                        VOTING_PAGE_CACHE['utcdate'] = todays_utcdate
+                        VOTING_PAGE_CACHE['changes'] = listing_changes
+                        VOTING_PAGE_CACHE['html'] = voting_papers
+
+                if stale_since:
+                    flash_message = stale_flash_message(self,
+                                                        flash_message,
+                                                        stale_since)
 
-                # show the voting page
+                # show the voting page. this user's own votes and
+                # reservations are marked on it by coffee.load_user_overlay
                 self.render("voting.html",
                             user_name=user_name,
                             local_today=local_today,
                             todays_date=todays_date,
-                            local_articles=local_articles,
-                            voted_articles=voted_articles,
-                            other_articles=other_articles,
-                            reserved_articles=reserved_articles,
+                            voting_papers=voting_papers,
                             flash_message=flash_message,
-                            new_user=new_user,
-                            reserve_interval_days=self.reserve_interval,
-                            user_articles=user_articles,
-                            user_reserved=user_reserved)
+                            new_user=new_user)
 
         # otherwise, show the article list
         else:
 
             # get the articles for today
-            (latestdate, local_articles,
-             voted_articles, other_articles, reserved_articles) = (
-                 arxivdb.get_articles_for_listing(utcdate=todays_utcdate,
-                                                  database=self.database)
-            )
+            ((latestdate, local_articles,
+              voted_articles, other_articles, reserved_articles),
+             listing_stale_since) = staleresults.fetch(
+                 'listing',
+                 ('listing', todays_utcdate),
+                 results_version,
+                 arxivdb.get_articles_for_listing,
+                 utcdate=todays_utcdate,
+                 database=self.database
+             )
+            stale_since = stale_since or listing_stale_since
 
             # if today's papers aren't ready yet, show latest papers
             if not local_articles and not voted_articles and not other_articles:
 
-                (latestdate, local_articles,
-                 voted_articles, other_articles, reserved_articles) = (
-                     arxivdb.get_articles_for_listing(
-                         database=self.database
-                     )
-                )
+                ((latestdate, local_articles,
+                  voted_articles, other_articles, reserved_articles),
+                 latest_stale_since) = staleresults.fetch(
+                     'listing',
+                     ('listing', None),
+                     None,
+                     arxivdb.get_articles_for_listing,
+                     database=self.database
+                 )
+                stale_since = stale_since or latest_stale_since
 
                 todays_date = datetime.strptime(
                     latestdate,
@@ -719,6 +1166,19 @@ class ArticleListHandler(tornado.web.RequestHandler):
                     # update this article's local authors
                     local_articles[lind][4] = ', '.join(author_list)
 
+            # use the pre-rendered math for the titles and abstracts, unless
+            # the DB is busy
+            if stale_since:
+                flash_message = stale_flash_message(self,
+                                                    flash_message,
+                                                    stale_since)
+            else:
+                self.math_renders = mathrender.get_listing_renders(
+                    (local_articles, voted_articles,
+                     other_articles, reserved_articles),
+                    database=self.database
+                )
+
             # show the listing page
             self.render("listing.html",
                         user_name=user_name,
@@ -734,7 +1194,150 @@ class ArticleListHandler(tornado.web.RequestHandler):
 
 
 
-class ReservationHandler(tornado.web.RequestHandler):
+class AbstractsHandler(RateLimitedHandler):
+    '''
+    This handles requests for /astroph-coffee/abstracts, which returns the
+    abstracts of the papers in the ids argument (a comma-separated list of
+    arxivids) as JSON. The listing and voting pages use this to load the
+    abstracts of the other papers as they're shown.
+
+    Each abstract is returned as HTML, with its math pre-rendered if
+    mathrender.prerender_articles has done that already, and a flag saying
+    whether it still needs typesetting by MathJax.
+
+    '''
+
+    starts_sessions = False
+
+    def initialize(self, database):
+        '''
+        Sets up the database.
+
+        '''
+
+        self.database = database
+
+
+    def get(self):
+        '''
+        This handles GET requests.
+
+        '''
+
+        arxivids = self.get_argument('ids', '')
+        arxivids = sorted(set(xhtml_escape(x.strip())
+                              for x in arxivids.split(',') if x.strip()))
+
+        if (not arxivids or
+            len(arxivids) > MAX_ABSTRACTS_PER_REQUEST or
+            any('arXiv:' not in x for x in arxivids)):
+
+            self.set_status(400)
+            jsondict = {'status':'failed',
+                        'message':'Invalid request for paper abstracts.',
+                        'results':None}
+            self.write(jsondict)
+            self.finish()
+            return
+
+        abstracts = arxivdb.get_article_abstracts(arxivids,
+                                                  database=self.database)
+
+        # send the pre-rendered math for the abstracts that have it, and the
+        # escaped text for the ones that need typesetting in the browser
+        self.math_renders = mathrender.get_math_renders(
+            [(x, 'abstract', abstracts[x]) for x in abstracts],
+            database=self.database
+        )
+        abstracts = {
+            x:{'html':mathrender.math_html(self, x, 'abstract', abstracts[x]),
+               'prerendered':(x, 'abstract') in self.math_renders}
+            for x in abstracts
+        }
+
+        # abstracts only change when arxiv gets a new version of a paper, so
+        # browsers can keep these for a while. Tornado adds an ETag, so
+        # browsers asking again after that mostly get 304s
+        self.set_header('Cache-Control',
+                        'public, max-age=%s' % ABSTRACTS_MAX_AGE)
+
+        jsondict = {'status':'success',
+                    'message':'found %s abstracts' % len(abstracts),
+                    'results':abstracts}
+        self.write(jsondict)
+        self.finish()
+
+
+
+class VotingOverlayHandler(RateLimitedHandler):
+    '''
+    This handles requests for /astroph-coffee/voting-overlay, which returns
+    the arxivids of the papers the user has voted for and reserved as JSON.
+    The paper listing on the voting page is the same for everyone, and
+    coffee.load_user_overlay uses this to mark the user's own votes and
+    reservations on it.
+
+    '''
+
+    starts_sessions = False
+
+    def initialize(self, database):
+        '''
+        Sets up the database.
+
+        '''
+
+        self.database = database
+
+
+    def get(self):
+        '''
+        This handles GET requests.
+
+        '''
+
+        session_token = self.get_secure_cookie('coffee_session',
+                                               max_age_days=30)
+        todays_utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+        if session_token:
+            sessioninfo = webdb.session_check(session_token,
+                                              database=self.database)
+        else:
+            sessioninfo = (False,)
+
+        if sessioninfo[0]:
+
+            user_name = sessioninfo[2]
+            user_articles = arxivdb.get_user_votes(todays_utcdate,
+                                                   user_name,
+                                                   database=self.database)
+            user_reserved = arxivdb.get_user_reservations(
+                todays_utcdate,
+                user_name,
+                database=self.database
+            )
+            LOGGER.info('user has votes on: %s, has reservations on: %s'
+                        % (user_articles, user_reserved))
+
+        else:
+
+            user_articles, user_reserved = [], []
+
+        # this changes with every vote or reservation, so browsers always ask
+        # again. Tornado adds an ETag, so most of these get 304s
+        self.set_header('Cache-Control', 'private, no-cache')
+
+        jsondict = {'status':'success',
+                    'message':'found votes and reservations for this user',
+                    'results':{'voted':user_articles or [],
+                               'reserved':user_reserved or []}}
+        self.write(jsondict)
+        self.finish()
+
+
+
+class ReservationHandler(RateLimitedHandler):
     '''
     This handles all requests for the voting page.
 
@@ -794,20 +1397,20 @@ class ReservationHandler(tornado.web.RequestHandler):
         geolocked = False
 
         # check the network as well
-        try:
-            userip_addrobj = ipaddress.ip_address(user_ip.decode())
-            trustedip = any([(userip_addrobj in x) for x in self.ipaddrs])
-        except:
-            trustedip = False
+        trustedip = geofence.ip_in_ranges(user_ip, self.ipaddrs)
 
-        if self.geofence and user_ip != '127.0.0.1':
+        # people on the trusted networks don't need a location check
+        if self.geofence and not trustedip and user_ip != '127.0.0.1':
 
             try:
-                geoip = self.geofence.city(user_ip)
 
-                if (geoip.country.iso_code in self.countries and
-                    geoip.subdivisions.most_specific.iso_code
-                    in self.regions):
+                # check the geoip location
+                allowed, location = geofence.check_location(self.geofence,
+                                                            user_ip,
+                                                            self.countries,
+                                                            self.regions)
+
+                if allowed:
                     LOGGER.info('geofencing ok: '
                                 'reservation request '
                                 'from inside allowed regions')
@@ -816,11 +1419,7 @@ class ReservationHandler(tornado.web.RequestHandler):
                     LOGGER.warning(
                         'geofencing activated: '
                         'vote request from %s '
-                        'is outside allowed regions' %
-                        ('%s-%s' % (
-                            geoip.country.iso_code,
-                            geoip.subdivisions.most_specific.iso_code
-                            ))
+                        'is outside allowed regions' % location
                         )
                     message = ("Sorry, you're trying to vote "
                                "from an IP address that is "
@@ -929,6 +1528,8 @@ class ReservationHandler(tornado.web.RequestHandler):
                         if (reserve_outcome[0] == 1 and
                             reserve_outcome[1] == user_name):
 
+                            queue_vote_update(arxivid, reserved=1)
+
                             message = ("Reservation successfully recorded for %s"
                                        % arxivid)
 
@@ -947,6 +1548,8 @@ class ReservationHandler(tornado.web.RequestHandler):
 
                         elif (reserve_outcome[0] == 0):
 
+                            queue_vote_update(arxivid, reserved=0)
+
                             message = ("Release successfully recorded for %s"
                                        % arxivid)
 
@@ -1002,7 +1605,7 @@ class ReservationHandler(tornado.web.RequestHandler):
             self.finish()
 
 
-class VotingHandler(tornado.web.RequestHandler):
+class VotingHandler(RateLimitedHandler):
     '''
     This handles all requests for the voting page.
 
@@ -1097,23 +1700,20 @@ class VotingHandler(tornado.web.RequestHandler):
         geolocked = False
 
         # check the network as well
-        try:
-            userip_addrobj = ipaddress.ip_address(user_ip.decode())
-            trustedip = any([(userip_addrobj in x) for x in self.ipaddrs])
-        except:
-            trustedip = False
+        trustedip = geofence.ip_in_ranges(user_ip, self.ipaddrs)
 
-        if self.geofence and user_ip != '127.0.0.1':
+        # people on the trusted networks don't need a location check
+        if self.geofence and not trustedip and user_ip != '127.0.0.1':
 
             try:
 
                 # check the geoip location
-                geoip = self.geofence.city(user_ip)
-
+                allowed, location = geofence.check_location(self.geofence,
+                                                            user_ip,
+                                                            self.countries,
+                                                            self.regions)
 
-                if (geoip.country.iso_code in self.countries and
-                    geoip.subdivisions.most_specific.iso_code
-                    in self.regions):
+                if allowed:
                     LOGGER.info('geofencing ok: '
                                 'vote request from inside allowed regions')
 
@@ -1121,11 +1721,7 @@ class VotingHandler(tornado.web.RequestHandler):
                     LOGGER.warning(
                         'geofencing activated: '
                         'vote request from %s '
-                        'is outside allowed regions' %
-                        ('%s-%s' % (
-                            geoip.country.iso_code,
-                            geoip.subdivisions.most_specific.iso_code
-                            ))
+                        'is outside allowed regions' % location
                         )
                     message = ("Sorry, you're trying to vote "
                                "from an IP address that is "
@@ -1195,18 +1791,15 @@ class VotingHandler(tornado.web.RequestHandler):
 
             else:
 
-                # first, check how many votes this user has
-                user_votes = arxivdb.get_user_votes(todays_utcdate,
-                                                    user_name,
-                                                    database=self.database)
+                # record the vote. an up vote only goes through if this
+                # user has voted for less than 5 papers on the paper's day
+                vote_outcome = arxivdb.record_vote(arxivid,
+                                                   user_name,
+                                                   votetype,
+                                                   maxvotes=5,
+                                                   database=self.database)
 
-                # make sure it's less than 5 or the votetype isn't up
-                if len(user_votes) < 5 or votetype != 'up':
-
-                    vote_outcome = arxivdb.record_vote(arxivid,
-                                                       user_name,
-                                                       votetype,
-                                                       database=self.database)
+                if vote_outcome is not None:
 
                     if vote_outcome is False:
 
@@ -1221,6 +1814,8 @@ class VotingHandler(tornado.web.RequestHandler):
 
                     else:
 
+                        queue_vote_update(arxivid, nvotes=vote_outcome)
+
                         message = ("Vote successfully recorded for %s" % arxivid)
 
                         jsondict = {'status':'success',
@@ -1263,7 +1858,104 @@ class VotingHandler(tornado.web.RequestHandler):
             self.finish()
 
 
-class EditHandler(tornado.web.RequestHandler):
+class VoteStreamHandler(tornado.web.RequestHandler):
+    '''
+    This handles the /astroph-coffee/vote-stream Server-Sent Events stream.
+    The voting page keeps this open and gets the vote totals and reservations
+    changed by everyone else from it, instead of being reloaded to see them.
+
+    Each event is a JSON list of {'arxivid', 'nvotes', 'reserved'} dicts, one
+    per paper that changed since the last tick; a dict only has the items
+    that changed.
+
+    '''
+
+    def initialize(self, voting_start, voting_end):
+        '''
+        Sets up the voting times.
+
+        '''
+
+        self.voting_start = voting_start
+        self.voting_end = voting_end
+        self.stream_closed = None
+
+
+    @tornado.gen.coroutine
+    def get(self):
+        '''
+        This handles GET requests.
+
+        '''
+
+        dtnow = datetime.now(tz=utc)
+        timenow = dtnow.timetz()
+
+        # outside the voting period, there's nothing to send. a 204 tells the
+        # browser to stop trying to reconnect
+        if not (self.voting_start < timenow < self.voting_end):
+            self.set_status(204)
+            self.finish()
+            return
+
+        self.set_header('Content-Type', 'text/event-stream; charset=UTF-8')
+        self.set_header('Cache-Control', 'no-cache')
+
+        # this stops nginx from buffering the events
+        self.set_header('X-Accel-Buffering', 'no')
+
+        # keep the stream open until the end of the voting period
+        dtend = dtnow.replace(hour=self.voting_end.hour,
+                              minute=self.voting_end.minute,
+                              second=self.voting_end.second,
+                              microsecond=0)
+        stream_age = min((dtend - dtnow).total_seconds(), VOTE_STREAM_MAX_AGE)
+
+        self.stream_closed = Future()
+        VOTE_LISTENERS.add(self)
+
+        try:
+
+            self.write('retry: %s\n\n' % VOTE_STREAM_RETRY)
+            yield self.flush()
+
+            yield tornado.gen.with_timeout(timedelta(seconds=stream_age),
+                                           self.stream_closed)
+
+        except tornado.gen.TimeoutError:
+            pass
+
+        finally:
+            VOTE_LISTENERS.discard(self)
+
+
+    def send_event(self, message):
+        '''
+        This sends an event to the browser on the other end of this stream.
+
+        '''
+
+        if self.stream_closed is None or self.stream_closed.done():
+            return
+
+        self.write(message)
+        self.flush()
+
+
+    def on_connection_close(self):
+        '''
+        This stops sending events once the browser closes the stream.
+
+        '''
+
+        VOTE_LISTENERS.discard(self)
+
+        if self.stream_closed is not None and not self.stream_closed.done():
+            self.stream_closed.set_result(None)
+
+
+
+class EditHandler(RateLimitedHandler):
     '''This handles all requests for the editing function.
 
     This allows users in the trustedip range to edit the arxiv listing for the
@@ -1328,11 +2020,7 @@ class EditHandler(tornado.web.RequestHandler):
         user_ip = self.request.remote_ip
 
         # check the network
-        try:
-            userip_addrobj = ipaddress.ip_address(user_ip.decode())
-            trustedip = any([(userip_addrobj in x) for x in self.editips])
-        except:
-            trustedip = False
+        trustedip = geofence.ip_in_ranges(user_ip, self.editips)
 
         ######################
         ## PROCESS THE EDIT ##
@@ -1391,7 +2079,7 @@ class EditHandler(tornado.web.RequestHandler):
 
 
 
-class AboutHandler(tornado.web.RequestHandler):
+class AboutHandler(RateLimitedHandler):
 
     '''
     This handles all requests for /astroph-coffee/about.
@@ -1429,6 +2117,13 @@ class AboutHandler(tornado.web.RequestHandler):
             flash_message = ''
 
 
+        # this page is the same for everyone, so visitors without a session
+        # get the cached copy without starting one
+        if (not flash_message and
+            not self.get_cookie('coffee_session') and
+            send_cached_page(self)):
+            return
+
         local_today = datetime.now(tz=utc).strftime('%Y-%m-%d %H:%M %Z')
 
         # first, get the session token
@@ -1547,17 +2242,22 @@ class AboutHandler(tornado.web.RequestHandler):
         #########################
         # show the contact page #
         #########################
-        self.render("about.html",
-                    local_today=local_today,
-                    user_name=user_name,
-                    flash_message=flash_message,
-                    new_user=new_user)
+        if not flash_message and send_cached_page(self):
+            return
 
+        render_cached_page(self,
+                           {},
+                           "about.html",
+                           local_today=local_today,
+                           user_name=user_name,
+                           flash_message=flash_message,
+                           new_user=new_user)
 
 
 
 
-class ArchiveHandler(tornado.web.RequestHandler):
+
+class ArchiveHandler(RateLimitedHandler):
     '''
     This handles all paper archive requests.
 
@@ -1568,7 +2268,8 @@ class ArchiveHandler(tornado.web.RequestHandler):
     def initialize(self,
                    database,
                    reserve_interval,
-                   signer):
+                   signer,
+                   cachedir):
         '''
         Sets up the database.
 
@@ -1577,6 +2278,105 @@ class ArchiveHandler(tornado.web.RequestHandler):
         self.database = database
         self.reserve_interval = reserve_interval
         self.signer = signer
+        self.cachedir = cachedir
+
+
+    def render_archive_index(self,
+                             user_name,
+                             flash_message,
+                             new_user,
+                             local_today):
+        '''
+        This renders the archive index page.
+
+        The tree of archive dates and its HTML are cached in
+        ARCHIVE_INDEX_CACHE, and are only built again if the daily_stats table
+        has changed since. The whole page is kept in the page cache too,
+        tagged with daily_stats.
+
+        '''
+
+        # get the version first, so if the stats change while we're building
+        # the index, the next request builds it again
+        version, stale_since = staleresults.fetch(
+            'archive',
+            ('daily_stats_version',),
+            None,
+            arxivdb.get_daily_stats_version,
+            database=self.database
+        )
+
+        # if the browser has the current version of the page, we're done
+        if (not stale_since and
+            version is not None and
+            page_not_modified(self,
+                              'archive-index',
+                              version,
+                              user_name,
+                              new_user,
+                              flash_message,
+                              local_today)):
+            self.set_status(304)
+            self.finish()
+            return
+
+        if not stale_since and not flash_message and send_cached_page(self):
+            return
+
+        # a page made from stale results isn't kept in the page cache, so
+        # its tag versions aren't needed
+        if stale_since:
+            versions = {}
+        else:
+            versions = pagecache.get_tag_versions(['daily_stats'],
+                                                  database=self.database)
+
+        if version is None or version != ARCHIVE_INDEX_CACHE['version']:
+
+            metrics.count_cache('archive_index', False)
+
+            ((archive_dates, archive_npapers,
+              archive_nlocal, archive_nvoted),
+             index_stale_since) = staleresults.fetch(
+                 'archive',
+                 ('archive_index',),
+                 None if stale_since else version,
+                 arxivdb.get_archive_index,
+                 database=self.database
+             )
+            stale_since = stale_since or index_stale_since
+
+            paper_archives = group_arxiv_dates(archive_dates,
+                                               archive_npapers,
+                                               archive_nlocal,
+                                               archive_nvoted)
+            archive_index = self.render_string("archive-index.html",
+                                               paper_archives=paper_archives)
+
+            if version is not None and not stale_since:
+                ARCHIVE_INDEX_CACHE['version'] = version
+                ARCHIVE_INDEX_CACHE['paper_archives'] = paper_archives
+                ARCHIVE_INDEX_CACHE['html'] = archive_index
+
+        else:
+
+            metrics.count_cache('archive_index', True)
+            archive_index = ARCHIVE_INDEX_CACHE['html']
+
+        # pages with a flash message aren't kept in the page cache either
+        if stale_since:
+            flash_message = stale_flash_message(self,
+                                                flash_message,
+                                                stale_since)
+
+        render_cached_page(self,
+                           versions,
+                           "archive.html",
+                           user_name=user_name,
+                           flash_message=flash_message,
+                           new_user=new_user,
+                           archive_index=archive_index,
+                           local_today=local_today)
 
 
     def get(self, archivedate):
@@ -1600,6 +2400,13 @@ class ArchiveHandler(tornado.web.RequestHandler):
             flash_message = ''
 
 
+        # the archive index is the same for everyone, so visitors without a
+        # session get the cached copy without starting one
+        if (not flash_message and
+            not self.get_cookie('coffee_session') and
+            send_cached_page(self)):
+            return
+
         local_today = datetime.now(tz=utc).strftime('%Y-%m-%d %H:%M %Z')
 
         # first, get the session token
@@ -1729,18 +2536,69 @@ class ArchiveHandler(tornado.web.RequestHandler):
                 year, month, day = archivedate.groups()
                 listingdate = '%s-%s-%s' % (year, month, day)
 
-                # get the articles for today
-                (latestdate, local_articles,
-                 voted_articles, other_articles, reserved_articles) = (
-                     arxivdb.get_articles_for_listing(utcdate=listingdate,
-                                                      database=self.database)
+                # if the DB is busy or slow, the page is made from the last
+                # good results instead, and stale_since is set to the time
+                # these were fetched
+                listing_changes, stale_since = staleresults.fetch(
+                    'archive',
+                    ('listing_changes', listingdate),
+                    None,
+                    arxivdb.get_listing_changes,
+                    listingdate,
+                    database=self.database
                 )
 
+                # if the browser has the current version of the page, we're
+                # done
+                if (not stale_since and
+                    listing_changes and
+                    page_not_modified(self,
+                                      'archive',
+                                      listingdate,
+                                      listing_changes,
+                                      user_name,
+                                      new_user,
+                                      flash_message,
+                                      local_today)):
+                    self.set_status(304)
+                    self.finish()
+                    return
+
+                # the listings for past days are rendered once and cached
+                if listingdate < todays_utcdate:
+                    cached_listing = archivecache.load_archive_listing(
+                        listingdate,
+                        listing_changes,
+                        cachedir=self.cachedir
+                    )
+                else:
+                    cached_listing = None
+
+                if cached_listing:
+
+                    have_articles = True
+
+                else:
+
+                    # get the articles for today
+                    ((latestdate, local_articles,
+                      voted_articles, other_articles, reserved_articles),
+                     listing_stale_since) = staleresults.fetch(
+                         'archive',
+                         ('listing', listingdate),
+                         None if stale_since else listing_changes,
+                         arxivdb.get_articles_for_listing,
+                         utcdate=listingdate,
+                         database=self.database
+                     )
+                    stale_since = stale_since or listing_stale_since
+                    have_articles = (local_articles or
+                                     voted_articles or
+                                     other_articles or
+                                     reserved_articles)
+
                 # if this date's papers aren't available, show the archive index
-                if (not local_articles and
-                    not voted_articles and
-                    not other_articles and
-                    not reserved_articles):
+                if not have_articles:
 
                     flash_message = (
                         "<div data-alert class=\"alert-box radius\">"
@@ -1749,21 +2607,10 @@ class ArchiveHandler(tornado.web.RequestHandler):
                         "<a href=\"#\" class=\"close\">&times;</a></div>"
                         ) % listingdate
 
-                    (archive_dates, archive_npapers,
-                     archive_nlocal, archive_nvoted) = arxivdb.get_archive_index(
-                         database=self.database
-                     )
-                    paper_archives = group_arxiv_dates(archive_dates,
-                                                       archive_npapers,
-                                                       archive_nlocal,
-                                                       archive_nvoted)
-
-                    self.render("archive.html",
-                                user_name=user_name,
-                                flash_message=flash_message,
-                                new_user=new_user,
-                                paper_archives=paper_archives,
-                                local_today=local_today)
+                    self.render_archive_index(user_name,
+                                              flash_message,
+                                              new_user,
+                                              local_today)
 
                 else:
 
@@ -1779,99 +2626,139 @@ class ArchiveHandler(tornado.web.RequestHandler):
                         ).strftime('%A, %b %d %Y')
 
                     # JGKIM
-                    # get this user's votes
-                    user_articles = arxivdb.get_user_votes(todays_utcdate,
-                                                           user_name,
-                                                           database=self.database)
-                    user_reserved = arxivdb.get_user_reservations(
-                        todays_utcdate,
-                        user_name,
-                        database=self.database
-                    )
+                    # get this user's votes. if the DB is busy, the page
+                    # goes without them
+                    if stale_since:
+                        user_articles, user_reserved = [], []
+                    else:
+                        user_articles = arxivdb.get_user_votes(
+                            todays_utcdate,
+                            user_name,
+                            database=self.database
+                        )
+                        user_reserved = arxivdb.get_user_reservations(
+                            todays_utcdate,
+                            user_name,
+                            database=self.database
+                        )
                     # JGKIM
 
                     LOGGER.info('user has votes on: %s, has reservations on: %s'
                                 % (user_articles, user_reserved))
 
-                    # preprocess the local papers to highlight local author names
-                    if len(local_articles) > 0:
+                    if cached_listing is None:
 
-                        for lind in range(len(local_articles)):
+                        # preprocess the local papers to highlight local author
+                        # names
+                        if len(local_articles) > 0:
 
-                            author_list = local_articles[lind][4]
-                            author_list = author_list.split(': ')[-1].split(',')
+                            for lind in range(len(local_articles)):
 
-                            local_indices = local_articles[lind][-2]
+                                author_list = local_articles[lind][4]
+                                author_list = author_list.split(
+                                    ': '
+                                )[-1].split(',')
 
-                            if local_indices and len(local_indices) > 0:
+                                local_indices = local_articles[lind][-2]
 
-                                local_indices = [
-                                    int(x) for x in local_indices.split(',')
-                                ]
+                                if local_indices and len(local_indices) > 0:
 
-                                for li in local_indices:
-                                    author_list[li] = '<strong>%s</strong>' % (
-                                        author_list[li]
-                                    )
+                                    local_indices = [
+                                        int(x) for x in local_indices.split(',')
+                                    ]
 
-                            # update this article's local authors
-                            local_articles[lind][4] = ', '.join(author_list)
+                                    for li in local_indices:
+                                        author_list[li] = (
+                                            '<strong>%s</strong>' %
+                                            author_list[li]
+                                        )
+
+                                # update this article's local authors
+                                local_articles[lind][4] = ', '.join(author_list)
+
+                        # past days are rendered for no user in particular
+                        # and cached; the user's own reservations are marked
+                        # by coffee.show_user_reservations on the page
+                        if listingdate < todays_utcdate:
+                            listing_user_articles, listing_user_reserved = (
+                                [], []
+                            )
+                        else:
+                            listing_user_articles, listing_user_reserved = (
+                                user_articles, user_reserved
+                            )
+
+                        # use the pre-rendered math for the titles and
+                        # abstracts, unless the DB is busy
+                        if not stale_since:
+                            self.math_renders = (
+                                mathrender.get_listing_renders(
+                                    (local_articles, voted_articles,
+                                     other_articles, reserved_articles),
+                                    database=self.database
+                                )
+                            )
+
+                        archive_papers = self.render_string(
+                            "archivelisting-papers.html",
+                            local_articles=local_articles,
+                            voted_articles=voted_articles,
+                            other_articles=other_articles,
+                            reserved_articles=reserved_articles,
+                            reserve_interval_days=self.reserve_interval,
+                            user_articles=listing_user_articles, # JGKIM
+                            user_reserved=listing_user_reserved # JGKIM
+                        )
+
+                        # a listing made from stale results isn't cached
+                        if listingdate < todays_utcdate and not stale_since:
+                            cached_listing = archivecache.save_archive_listing(
+                                listingdate,
+                                archive_papers,
+                                listing_changes,
+                                cachedir=self.cachedir
+                            )
+
+                    else:
+
+                        archive_papers = cached_listing['html']
 
+                    if cached_listing:
+                        self.set_header('Last-Modified',
+                                        cached_listing['last_modified'])
 
-                    # show the listing page 
+                    if stale_since:
+                        flash_message = stale_flash_message(self,
+                                                            flash_message,
+                                                            stale_since)
+
+                    # show the listing page
                     self.render("archivelisting.html",
                                 user_name=user_name,
                                 local_today=local_today,
                                 todays_date=archive_datestr,
-                                local_articles=local_articles,
-                                voted_articles=voted_articles,
-                                other_articles=other_articles,
-                                reserved_articles=reserved_articles,
-                                reserve_interval_days=self.reserve_interval,
+                                archive_papers=archive_papers,
                                 flash_message=flash_message,
                                 new_user=new_user,
-                                user_articles=user_articles, # JGKIM
                                 user_reserved=user_reserved) # JGKIM
 
             else:
 
-                (archive_dates, archive_npapers,
-                 archive_nlocal, archive_nvoted) = arxivdb.get_archive_index(
-                     database=self.database
-                 )
-                paper_archives = group_arxiv_dates(archive_dates,
-                                                   archive_npapers,
-                                                   archive_nlocal,
-                                                   archive_nvoted)
-
-                self.render("archive.html",
-                            user_name=user_name,
-                            flash_message=flash_message,
-                            new_user=new_user,
-                            paper_archives=paper_archives,
-                            local_today=local_today)
+                self.render_archive_index(user_name,
+                                          flash_message,
+                                          new_user,
+                                          local_today)
 
         else:
 
-            (archive_dates, archive_npapers,
-             archive_nlocal, archive_nvoted) = arxivdb.get_archive_index(
-                 database=self.database
-             )
-            paper_archives = group_arxiv_dates(archive_dates,
-                                               archive_npapers,
-                                               archive_nlocal,
-                                               archive_nvoted)
-
-            self.render("archive.html",
-                        user_name=user_name,
-                        flash_message=flash_message,
-                        new_user=new_user,
-                        paper_archives=paper_archives,
-                        local_today=local_today)
+            self.render_archive_index(user_name,
+                                      flash_message,
+                                      new_user,
+                                      local_today)
 
 
 
-class LocalListHandler(tornado.web.RequestHandler):
+class LocalListHandler(RateLimitedHandler):
 
     '''
     This handles all requests for /astroph-coffee/local-authors.
@@ -1911,6 +2798,13 @@ class LocalListHandler(tornado.web.RequestHandler):
             flash_message = ''
 
 
+        # this page is the same for everyone, so visitors without a session
+        # get the cached copy without starting one
+        if (not flash_message and
+            not self.get_cookie('coffee_session') and
+            send_cached_page(self)):
+            return
+
         local_today = datetime.now(tz=utc).strftime('%Y-%m-%d %H:%M %Z')
 
         # first, get the session token
@@ -2030,18 +2924,27 @@ class LocalListHandler(tornado.web.RequestHandler):
         # show the local authors page #
         ###############################
 
+        if not flash_message and send_cached_page(self):
+            return
+
+        # get the tag versions first, so if the local authors change while
+        # we're rendering the page, the next request renders it again
+        versions = pagecache.get_tag_versions(['local_authors'],
+                                              database=self.database)
         authorlist = webdb.get_local_authors(database=self.database)
 
         if authorlist:
 
-            self.render("local-authors.html",
-                        local_today=local_today,
-                        user_name=user_name,
-                        flash_message=flash_message,
-                        new_user=new_user,
-                        authorlist=authorlist,
-                        admincontact=self.admincontact,
-                        adminemail=self.adminemail)
+            render_cached_page(self,
+                               versions,
+                               "local-authors.html",
+                               local_today=local_today,
+                               user_name=user_name,
+                               flash_message=flash_message,
+                               new_user=new_user,
+                               authorlist=authorlist,
+                               admincontact=self.admincontact,
+                               adminemail=self.adminemail)
 
         else:
 
@@ -2060,7 +2963,7 @@ class LocalListHandler(tornado.web.RequestHandler):
                         new_user=new_user)
 
 
-class FTSHandler(tornado.web.RequestHandler):
+class FTSHandler(RateLimitedHandler):
     '''
     This handles all requests for searching.
 
@@ -2436,7 +3339,13 @@ class FTSHandler(tornado.web.RequestHandler):
                     # phrase matching
                     searchquery = searchquery.replace('&quot;','"')
 
-                    ftsdict = fts.fts4_phrase_query_paginated(
+                    # if the DB is busy or slow, use the last good results
+                    # for this query
+                    ftsdict, stale_since = staleresults.fetch(
+                        'search',
+                        ('search', searchquery),
+                        None,
+                        fts.fts4_phrase_query_paginated,
                         searchquery,
                         ['arxiv_id','day_serial','title',
                          'authors','comments','abstract',
@@ -2504,6 +3413,22 @@ class FTSHandler(tornado.web.RequestHandler):
                              search_nmatches,
                              relevance_sticker))
 
+                    # use the pre-rendered math for the results that have
+                    # it, unless the DB is busy
+                    if stale_since:
+                        flash_message = stale_flash_message(self,
+                                                            flash_message,
+                                                            stale_since)
+                    else:
+                        self.math_renders = mathrender.get_math_renders(
+                            [(search_results['arxiv_id'][x],
+                              field,
+                              search_results[field][x])
+                             for x in range(search_nmatches)
+                             for field in ('title','abstract')],
+                            database=self.database
+                        )
+
                     self.render(
                         "search.html",
                         user_name=user_name,
@@ -2562,3 +3487,71 @@ class FTSHandler(tornado.web.RequestHandler):
                             search_nmatches=search_nmatches,
                             search_result_info=search_result_info,
                             new_user=new_user)
+
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    '''
+    This handles the /astroph-coffee/metrics URL, which has the server's
+    metrics (see metrics.py) in the Prometheus text format. Only requests with
+    one of the admin_keys from the conf file, either as the key argument or as
+    an Authorization: Bearer header, get these.
+
+    '''
+
+    def initialize(self, admin_keys):
+        '''
+        Sets up the admin keys.
+
+        '''
+
+        self.admin_keys = admin_keys
+
+
+    def get(self):
+        '''
+        This handles GET requests.
+
+        '''
+
+        key = self.get_argument('key', default=None)
+        authorization = self.request.headers.get('Authorization','')
+
+        if key is None and authorization.startswith('Bearer '):
+            key = authorization[7:].strip()
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        # compare with every key so the time taken doesn't give away which
+        # one was close
+        allowed = False
+
+        for admin_key in self.admin_keys:
+            if key and hmac.compare_digest(key, admin_key):
+                allowed = True
+
+        if not allowed:
+            raise tornado.web.HTTPError(403)
+
+        # copy in the counters kept by the other modules
+        for page in staleresults.STALE_SERVES:
+            metrics.set_value('coffee_stale_serves_total',
+                              (page,),
+                              staleresults.STALE_SERVES[page])
+
+        for result in staleresults.STALE_REFRESHES:
+            metrics.set_value('coffee_stale_refreshes_total',
+                              (result,),
+                              staleresults.STALE_REFRESHES[result])
+
+        for kind in ratelimit.RATE_LIMITED:
+            metrics.set_value('coffee_rate_limited_total',
+                              (kind,),
+                              ratelimit.RATE_LIMITED[kind])
+
+        metrics.set_value('coffee_vote_streams', (), len(VOTE_LISTENERS))
+
+        self.set_header('Content-Type','text/plain; version=0.0.4')
+        self.set_header('Cache-Control','no-cache')
+        self.write(metrics.render_metrics())
@@ -29,8 +29,7 @@ from pytz import utc
 from itsdangerous import Signer
 
 # for geofencing
-import geoip2.database
-import ipaddress
+import geofence
 
 
 # setup signal trapping on SIGINT
@@ -63,6 +62,13 @@ from tornado.options import define, options
 ####################################
 
 import coffeehandlers
+import coffeestatic
+import mathrender
+import metrics
+import arxivdb
+import webdb
+import fulltextsearch
+import sqlprofile
 
 
 ###############################
@@ -124,15 +130,24 @@ if __name__ == '__main__':
     )
     TEMPLATEPATH = os.path.join(STATICPATH,'templates')
 
+    # the rendered archive listings for past days are cached here
+    CACHEPATH = os.path.abspath(
+        os.path.join(os.getcwd(), CONF.get('paths','cache'))
+    )
+
     # set up the database
     DBPATH = os.path.abspath(
         os.path.join(os.getcwd(), CONF.get('sqlite3','database'))
     )
     DATABASE = sqlite3.connect(
         DBPATH,
-        detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES
+        detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+        factory=sqlprofile.ProfilingConnection
     )
 
+    # keep the query plans in debug mode, so full table scans show up
+    sqlprofile.EXPLAIN_PLANS = DEBUG
+
     # get the times of day (UTC) to switch between voting and list mode
     VOTING_START = CONF.get('times','voting_start')
     VOTING_END = CONF.get('times','voting_end')
@@ -163,7 +178,7 @@ if __name__ == '__main__':
         # check geographical regions
         GEOFENCE_DB = CONF.get('access_control','database')
         LOGGER.info('geofence active, using database: %s' % GEOFENCE_DB)
-        GEOFENCE_DB = geoip2.database.Reader(GEOFENCE_DB)
+        GEOFENCE_DB = geofence.open_geoip_database(GEOFENCE_DB)
         GEOFENCE_COUNTRIES = [
             x.strip() for x in
             CONF.get('access_control','allowed_countries').split(',')
@@ -175,15 +190,15 @@ if __name__ == '__main__':
 
         # check the IP address restrictions for people always allowed to
         # vote/reserve papers
-        GEOFENCE_IPS = CONF.get('access_control', 'allowed_cidr')
-        GEOFENCE_IPS = [ipaddress.IPv4Network(x.strip().decode())
-                        for x in GEOFENCE_IPS.split(',')]
+        GEOFENCE_IPS = geofence.compile_cidr_ranges(
+            CONF.get('access_control', 'allowed_cidr')
+        )
 
-        # check the IP address restrictions for people always allowed to
-        # vote/reserve papers
-        EDITOR_IPS = CONF.get('access_control', 'edit_cidr')
-        EDITOR_IPS = [ipaddress.IPv4Network(x.strip().decode())
-                        for x in EDITOR_IPS.split(',')]
+        # check the IP address restrictions for people allowed to edit the
+        # papers
+        EDITOR_IPS = geofence.compile_cidr_ranges(
+            CONF.get('access_control', 'edit_cidr')
+        )
 
     else:
 
@@ -191,6 +206,20 @@ if __name__ == '__main__':
         GEOFENCE_COUNTRIES = None
         GEOFENCE_REGIONS = None
         GEOFENCE_IPS = None
+        EDITOR_IPS = None
+
+    # the keys that can get the metrics
+    if CONF.has_option('access_control','admin_keys'):
+        ADMIN_KEYS = [
+            x.strip() for x in
+            CONF.get('access_control','admin_keys').split(',') if x.strip()
+        ]
+    else:
+        ADMIN_KEYS = []
+
+    # time the calls to the DB functions for the metrics
+    for module in (arxivdb, webdb, fulltextsearch):
+        metrics.instrument_module(module)
 
     # this is used to sign flash messages so they can't be forged
     FLASHSIGNER = Signer(SESSIONSECRET)
@@ -248,10 +277,15 @@ if __name__ == '__main__':
           'server_tz':SERVER_TZ,
           'reserve_interval':RESERVE_INTERVAL_DAYS,
           'signer':FLASHSIGNER}),
+        (r'/astroph-coffee/abstracts',coffeehandlers.AbstractsHandler,
+         {'database':DATABASE}),
+        (r'/astroph-coffee/voting-overlay',coffeehandlers.VotingOverlayHandler,
+         {'database':DATABASE}),
         (r'/astroph-coffee/archive/?(.*)',coffeehandlers.ArchiveHandler,
          {'database':DATABASE,
           'reserve_interval':RESERVE_INTERVAL_DAYS,
-          'signer':FLASHSIGNER}),
+          'signer':FLASHSIGNER,
+          'cachedir':CACHEPATH}),
         (r'/astroph-coffee/vote',coffeehandlers.VotingHandler,
          {'database':DATABASE,
           'voting_start':VOTING_START,
@@ -270,6 +304,9 @@ if __name__ == '__main__':
           'geofence': (GEOFENCE_DB, GEOFENCE_IPS, EDITOR_IPS),
           'countries':GEOFENCE_COUNTRIES,
           'regions':GEOFENCE_REGIONS}),
+        (r'/astroph-coffee/vote-stream',coffeehandlers.VoteStreamHandler,
+         {'voting_start':VOTING_START,
+          'voting_end':VOTING_END}),
         (r'/astroph-coffee/edit',coffeehandlers.EditHandler,
          {'database':DATABASE,
           'voting_start':VOTING_START,
@@ -298,18 +335,32 @@ if __name__ == '__main__':
         (r'/astroph-coffee/local-authors/',coffeehandlers.LocalListHandler,
          {'database':DATABASE,
           'admincontact':ADMINCONTACT, 'adminemail':ADMINEMAIL}),
+        (r'/astroph-coffee/metrics',coffeehandlers.MetricsHandler,
+         {'admin_keys':ADMIN_KEYS}),
     ]
 
     #######################
     ## APPLICATION SETUP ##
     #######################
 
+    # compress the HTML and JSON responses with brotli if it's installed and
+    # the browser accepts it, and gzip otherwise. the static files are served
+    # from their precompressed siblings if these are available (see
+    # shell/compress_static.sh)
+    TRANSFORMS = [tornado.web.GZipContentEncoding]
+    if coffeestatic.brotli is not None:
+        TRANSFORMS.insert(0, coffeestatic.BrotliContentEncoding)
+
     app = tornado.web.Application(
         handlers=HANDLERS,
+        transforms=TRANSFORMS,
         cookie_secret=SESSIONSECRET,
         static_path=STATICPATH,
         template_path=TEMPLATEPATH,
+        ui_methods={'math_html':mathrender.math_html,
+                    'math_class':mathrender.math_class},
         static_url_prefix='/astroph-coffee/static/',
+        static_handler_class=coffeestatic.PrecompressedStaticFileHandler,
         xsrf_cookies=True,
         debug=DEBUG,
     )
@@ -319,6 +370,14 @@ if __name__ == '__main__':
     http_server = tornado.httpserver.HTTPServer(app, xheaders=True)
     http_server.listen(options.port, options.serve)
 
+    # send the vote totals and reservations changed in each tick to the open
+    # voting pages
+    vote_updater = tornado.ioloop.PeriodicCallback(
+        coffeehandlers.send_vote_updates,
+        coffeehandlers.VOTE_UPDATE_INTERVAL*1000.0
+    )
+    vote_updater.start()
+
     LOGGER.info('starting event loop...')
 
     # start the IOLoop and begin serving requests
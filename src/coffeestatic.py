@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+'''coffeestatic.py - Oct 2026
+
+This has the pieces that make the astroph-coffee server's responses smaller on
+the wire:
+
+- BrotliContentEncoding: a Tornado output transform that compresses the HTML
+  and JSON responses with brotli for browsers that accept it. This is only
+  used if the brotli package is installed; Tornado's own GZipContentEncoding
+  handles everyone else.
+
+- PrecompressedStaticFileHandler: a static file handler that serves the .br or
+  .gz sibling of a static file (e.g. css/foundation.min.css.gz) instead of
+  the file itself if the browser accepts that encoding. URLs made with
+  static_url in the templates have a ?v=<content hash> fingerprint, and these
+  are sent with far-future cache headers.
+
+- precompress_static: this makes the .gz and .br siblings for the static
+  files. Run it (or shell/compress_static.sh) after every install or update of
+  the static directory.
+
+'''
+
+import os
+import os.path
+import gzip
+import mimetypes
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import tornado.web
+from tornado.escape import native_str
+
+
+# the static files with these extensions are precompressed. images and web
+# fonts other than the old EOT/TTF/SVG ones are already compressed
+COMPRESSIBLE_EXTENSIONS = ('.css','.js','.svg','.eot','.ttf','.json','.txt')
+
+# these are the encodings we precompress static files with, in order of
+# preference, and the extensions of their sibling files
+STATIC_ENCODINGS = (('br','.br'),
+                    ('gzip','.gz'))
+
+
+
+def accepted_encodings(request):
+    '''
+    This returns the set of content encodings listed in the Accept-Encoding
+    header of a request, leaving out any that are explicitly refused with
+    q=0.
+
+    '''
+
+    encodings = set()
+
+    for item in request.headers.get('Accept-Encoding','').split(','):
+
+        item = [x.strip() for x in item.split(';')]
+        encoding, quality = item[0].lower(), 1.0
+
+        for param in item[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    pass
+
+        if encoding and quality > 0.0:
+            encodings.add(encoding)
+
+    return encodings
+
+
+
+class BrotliContentEncoding(tornado.web.OutputTransform):
+    '''
+    This applies the brotli content encoding to a response, for browsers that
+    accept it (most only do over HTTPS).
+
+    This goes before Tornado's GZipContentEncoding in the list of transforms
+    for the application, which then leaves the brotli-compressed responses
+    alone. GZipContentEncoding also adds the Vary: Accept-Encoding header to
+    all responses, so this doesn't.
+
+    '''
+
+    # the same content types as GZipContentEncoding
+    CONTENT_TYPES = tornado.web.GZipContentEncoding.CONTENT_TYPES
+
+    # the listing pages are compressed on every request, so use a quality
+    # that's quick to compress, but still smaller than gzip
+    BROTLI_QUALITY = 5
+
+    MIN_LENGTH = tornado.web.GZipContentEncoding.MIN_LENGTH
+
+
+    def __init__(self, request):
+
+        self._compressing = (brotli is not None and
+                             'br' in accepted_encodings(request))
+
+
+    def _compressible_type(self, ctype):
+
+        return ctype.startswith('text/') or ctype in self.CONTENT_TYPES
+
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+
+        if self._compressing:
+            ctype = native_str(headers.get('Content-Type','')).split(';')[0]
+            self._compressing = (
+                self._compressible_type(ctype) and
+                (not finishing or len(chunk) >= self.MIN_LENGTH) and
+                ('Content-Encoding' not in headers)
+            )
+
+        if self._compressing:
+
+            headers['Content-Encoding'] = 'br'
+            self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT,
+                                                 quality=self.BROTLI_QUALITY)
+            chunk = self.transform_chunk(chunk, finishing)
+
+            # see GZipContentEncoding for why this is done
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+
+        return status_code, headers, chunk
+
+
+    def transform_chunk(self, chunk, finishing):
+
+        if self._compressing:
+
+            if finishing:
+                chunk = self._compressor.process(chunk) + (
+                    self._compressor.finish()
+                )
+            else:
+                chunk = self._compressor.process(chunk) + (
+                    self._compressor.flush()
+                )
+
+        return chunk
+
+
+
+class PrecompressedStaticFileHandler(tornado.web.StaticFileHandler):
+    '''
+    This serves the static files, using their precompressed siblings made by
+    precompress_static if the browser accepts their encoding. A sibling that's
+    older than its file is out of date and isn't used.
+
+    Set this as the static_handler_class of the application.
+
+    '''
+
+    def validate_absolute_path(self, root, absolute_path):
+        '''
+        This switches the file to serve to the best precompressed sibling of
+        absolute_path.
+
+        '''
+
+        absolute_path = super(PrecompressedStaticFileHandler,
+                              self).validate_absolute_path(root,
+                                                           absolute_path)
+        self.uncompressed_path = absolute_path
+        self.content_encoding = None
+
+        # this happens for directories, which are redirected
+        if absolute_path is None:
+            return absolute_path
+
+        encodings = accepted_encodings(self.request)
+
+        for encoding, extension in STATIC_ENCODINGS:
+
+            if encoding not in encodings:
+                continue
+
+            compressed_path = absolute_path + extension
+
+            try:
+                if (os.path.getmtime(compressed_path) >=
+                    os.path.getmtime(absolute_path)):
+                    self.content_encoding = encoding
+                    return compressed_path
+            except OSError:
+                pass
+
+        return absolute_path
+
+
+    def get_content_type(self):
+        '''
+        This returns the content type of the uncompressed file.
+
+        '''
+
+        if self.content_encoding:
+            mime_type, encoding = mimetypes.guess_type(self.uncompressed_path)
+            return mime_type or 'application/octet-stream'
+
+        return super(PrecompressedStaticFileHandler, self).get_content_type()
+
+
+    def set_extra_headers(self, path):
+        '''
+        This marks precompressed responses, and tells browsers that
+        fingerprinted URLs never change.
+
+        '''
+
+        if self.content_encoding:
+            self.set_header('Content-Encoding', self.content_encoding)
+
+        if self.get_cache_time(path,
+                               self.modified,
+                               self.get_content_type()) > 0:
+            self.set_header('Cache-Control',
+                            'public, max-age=%s, immutable' %
+                            self.CACHE_MAX_AGE)
+
+
+
+def gzip_compress(content):
+    '''
+    This gzips content at the highest compression level.
+
+    '''
+
+    outbuf = BytesIO()
+
+    # a fixed mtime makes the same file compress to the same bytes each time
+    with gzip.GzipFile(filename='', mode='wb', fileobj=outbuf,
+                       compresslevel=9, mtime=0) as outfd:
+        outfd.write(content)
+
+    return outbuf.getvalue()
+
+
+
+def precompress_static(staticpath, verbose=True):
+    '''
+    This makes .gz (and .br, if the brotli package is installed) siblings of
+    the compressible files in the static directory. Siblings that are already
+    up to date are left alone, and siblings that don't end up smaller than
+    their file aren't kept.
+
+    Returns the total size of the files, and the total size sent to browsers
+    that accept gzip and brotli.
+
+    '''
+
+    sizes = {'original':0, 'gzip':0, 'br':0}
+
+    for dirpath, dirnames, filenames in os.walk(staticpath):
+
+        # the templates are rendered by the server, not served directly
+        if 'templates' in dirnames:
+            dirnames.remove('templates')
+
+        for filename in filenames:
+
+            if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            filepath = os.path.join(dirpath, filename)
+
+            with open(filepath,'rb') as infd:
+                content = infd.read()
+
+            sizes['original'] += len(content)
+
+            for encoding, extension in STATIC_ENCODINGS:
+
+                if encoding == 'br' and brotli is None:
+                    sizes['br'] += len(content)
+                    continue
+
+                compressed_path = filepath + extension
+
+                if (os.path.exists(compressed_path) and
+                    (os.path.getmtime(compressed_path) >=
+                     os.path.getmtime(filepath))):
+                    sizes[encoding] += min(os.path.getsize(compressed_path),
+                                           len(content))
+                    continue
+
+                if encoding == 'br':
+                    compressed = brotli.compress(content,
+                                                 mode=brotli.MODE_TEXT,
+                                                 quality=11)
+                else:
+                    compressed = gzip_compress(content)
+
+                if len(compressed) >= len(content):
+                    if os.path.exists(compressed_path):
+                        os.remove(compressed_path)
+                    sizes[encoding] += len(content)
+                    continue
+
+                # write to a temp file and move it into place, so a sibling
+                # that's being written is never served
+                temp_path = '%s.%s.tmp' % (compressed_path, os.getpid())
+                with open(temp_path,'wb') as outfd:
+                    outfd.write(compressed)
+                os.rename(temp_path, compressed_path)
+
+                sizes[encoding] += len(compressed)
+
+                if verbose:
+                    print('%s: %s -> %s bytes' % (compressed_path,
+                                                  len(content),
+                                                  len(compressed)))
+
+    if verbose:
+        print('static files: %s bytes, %s bytes with gzip, %s bytes with brotli'
+              % (sizes['original'], sizes['gzip'], sizes['br']))
+
+    return sizes
+
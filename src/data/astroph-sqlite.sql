@@ -24,6 +24,8 @@ create table arxiv (
        reserved integer default 0,
        local_author_indices text,
        local_author_specaffils text,
+       content_hash text,
+       version integer default 1,
        primary key(utcdate, day_serial, article_type, arxiv_id)
 );
 
@@ -92,6 +94,204 @@ create trigger fts_after_insert after insert on arxiv begin
 end;
 
 
+-- per-day article counts for the archive index. the triggers below keep these
+-- up to date whenever articles are inserted, deleted, voted on, or tagged as
+-- local, so the archive index doesn't have to aggregate the whole arxiv table.
+-- arxivdb.rebuild_daily_stats regenerates the table from scratch.
+create table daily_stats (
+       utcdate date,
+       npapers integer default 0,
+       nlocal integer default 0,
+       nvoted integer default 0,
+       primary key (utcdate)
+);
+
+create trigger daily_stats_after_insert after insert on arxiv begin
+       insert or ignore into daily_stats (utcdate) values (new.utcdate);
+       update daily_stats set
+              npapers = npapers + 1,
+              nlocal = nlocal + (case when new.local_authors then 1 else 0 end),
+              nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end)
+       where utcdate = new.utcdate;
+end;
+
+create trigger daily_stats_after_delete after delete on arxiv begin
+       update daily_stats set
+              npapers = npapers - 1,
+              nlocal = nlocal - (case when old.local_authors then 1 else 0 end),
+              nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end)
+       where utcdate = old.utcdate;
+       delete from daily_stats where utcdate = old.utcdate and npapers <= 0;
+end;
+
+-- articles moved to another day are taken off the old day's counts and added
+-- to the new day's
+create trigger daily_stats_after_update_utcdate
+after update of utcdate on arxiv
+when old.utcdate is not new.utcdate begin
+       update daily_stats set
+              npapers = npapers - 1,
+              nlocal = nlocal - (case when old.local_authors then 1 else 0 end),
+              nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end)
+       where utcdate = old.utcdate;
+       insert or ignore into daily_stats (utcdate) values (new.utcdate);
+       update daily_stats set
+              npapers = npapers + 1,
+              nlocal = nlocal + (case when new.local_authors then 1 else 0 end),
+              nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end)
+       where utcdate = new.utcdate;
+       delete from daily_stats where utcdate = old.utcdate and npapers <= 0;
+end;
+
+-- otherwise, the counts only change when an article is tagged or untagged as
+-- local, or gets its first vote or loses its last one. other votes don't touch
+-- daily_stats, so they don't throw away the cached archive index
+create trigger daily_stats_after_update
+after update of local_authors, nvotes on arxiv
+when old.utcdate is new.utcdate and
+     ((case when old.local_authors then 1 else 0 end) !=
+      (case when new.local_authors then 1 else 0 end) or
+      (case when old.nvotes > 0 then 1 else 0 end) !=
+      (case when new.nvotes > 0 then 1 else 0 end)) begin
+       update daily_stats set
+              nlocal = nlocal -
+                       (case when old.local_authors then 1 else 0 end) +
+                       (case when new.local_authors then 1 else 0 end),
+              nvoted = nvoted -
+                       (case when old.nvotes > 0 then 1 else 0 end) +
+                       (case when new.nvotes > 0 then 1 else 0 end)
+       where utcdate = new.utcdate;
+end;
+
+-- this is bumped whenever daily_stats changes, so the archive index can be
+-- cached until then
+create table daily_stats_version (
+       version integer
+);
+
+insert into daily_stats_version (version) values (0);
+
+create trigger daily_stats_version_after_insert after insert on daily_stats
+begin
+       update daily_stats_version set version = version + 1;
+end;
+
+create trigger daily_stats_version_after_update after update on daily_stats
+when (old.utcdate is not new.utcdate or
+      old.npapers is not new.npapers or
+      old.nlocal is not new.nlocal or
+      old.nvoted is not new.nvoted)
+begin
+       update daily_stats_version set version = version + 1;
+end;
+
+create trigger daily_stats_version_after_delete after delete on daily_stats
+begin
+       update daily_stats_version set version = version + 1;
+end;
+
+
+-- change counters for each day's articles. these go up whenever an article
+-- listed on that day is inserted, changed (votes, reservations, edits,
+-- tagging), or deleted. the listing and archive pages use them to tell if a
+-- page has changed since a browser last saw it
+create table listing_changes (
+       utcdate date,
+       changes integer default 0,
+       primary key (utcdate)
+);
+
+create trigger listing_changes_after_insert after insert on arxiv begin
+       insert or ignore into listing_changes (utcdate) values (new.utcdate);
+       update listing_changes set changes = changes + 1
+       where utcdate = new.utcdate;
+end;
+
+create trigger listing_changes_after_update after update on arxiv begin
+       insert or ignore into listing_changes (utcdate) values (new.utcdate);
+       update listing_changes set changes = changes + 1
+       where utcdate in (old.utcdate, new.utcdate);
+end;
+
+create trigger listing_changes_after_delete after delete on arxiv begin
+       update listing_changes set changes = changes + 1
+       where utcdate = old.utcdate;
+end;
+
+
+-- MathJax renders of the TeX in article titles and abstracts, made at ingest
+-- time by mathrender.prerender_articles. content_hash is the SHA1 of the text
+-- that was rendered; a render is only used while it matches the article's
+-- current text. html is null for text that doesn't have any TeX in it
+create table math_renders (
+       arxiv_id text,
+       field text,
+       content_hash text,
+       html text,
+       primary key (arxiv_id, field)
+);
+
+-- new renders change how the article's day is listed
+create trigger listing_changes_after_math_render after insert on math_renders
+begin
+       update listing_changes set changes = changes + 1
+       where utcdate in (select utcdate from arxiv
+                         where arxiv_id = new.arxiv_id);
+end;
+
+
+
+-- version counters for the tags on the pages cached by pagecache.py. a cached
+-- page is only used while all of its tags have the same versions as when it
+-- was rendered, so the triggers below invalidate the pages that depend on a
+-- table whenever it changes
+create table cache_tags (
+       tag text,
+       version integer default 0,
+       primary key (tag)
+);
+
+create trigger cache_tags_local_authors_after_insert
+after insert on local_authors
+begin
+       insert or ignore into cache_tags (tag) values ('local_authors');
+       update cache_tags set version = version + 1 where tag = 'local_authors';
+end;
+
+create trigger cache_tags_local_authors_after_update
+after update on local_authors
+begin
+       insert or ignore into cache_tags (tag) values ('local_authors');
+       update cache_tags set version = version + 1 where tag = 'local_authors';
+end;
+
+create trigger cache_tags_local_authors_after_delete
+after delete on local_authors
+begin
+       insert or ignore into cache_tags (tag) values ('local_authors');
+       update cache_tags set version = version + 1 where tag = 'local_authors';
+end;
+
+create trigger cache_tags_daily_stats_after_update
+after update on daily_stats_version
+begin
+       insert or ignore into cache_tags (tag) values ('daily_stats');
+       update cache_tags set version = version + 1 where tag = 'daily_stats';
+end;
+
+
+
+-- the number of papers each user has voted for on each day's listing.
+-- arxivdb.record_vote changes these along with the votes themselves, and
+-- only lets an up vote through while the count is under the vote limit.
+-- arxivdb.rebuild_user_daily_votes regenerates the table from scratch.
+create table user_daily_votes (
+       username text,
+       utcdate date,
+       nvotes integer default 0,
+       primary key (username, utcdate)
+);
+
 
 -- SQLite specific settings
 pragma journal_mode = wal;
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''geofence.py - Oct 2026
+
+This has the geofencing checks for the voting, reservation, and edit
+requests.
+
+The allowed_cidr and edit_cidr lists from the conf file are compiled into
+sorted lists of integer address ranges, separately for IPv4 and IPv6, so
+checking an IP against them is a bisect instead of a test against every
+network in the list.
+
+The GeoLite2 database is opened memory-mapped, and the location checks for
+each IP are kept for GEOIP_CACHE_TTL seconds in a small LRU cache, so people
+voting for several papers in a row only cause one lookup.
+
+'''
+
+import time
+import bisect
+from collections import OrderedDict
+
+import ipaddress
+import geoip2.database
+import geoip2.errors
+
+import metrics
+
+# the most IPs with location checks kept, and how long these are kept for
+GEOIP_CACHE_SIZE = 4096
+GEOIP_CACHE_TTL = 3600.0
+
+# the location checks, oldest first. each is keyed by IP and has the check's
+# result, the location, and the time the check expires
+GEOIP_CACHE = OrderedDict()
+
+
+
+def open_geoip_database(database_path):
+    '''
+    This opens the GeoLite2 database at database_path memory-mapped, using
+    the libmaxminddb C extension if it's installed.
+
+    '''
+
+    try:
+        return geoip2.database.Reader(database_path,
+                                      mode=geoip2.database.MODE_MMAP_EXT)
+    except ValueError:
+        return geoip2.database.Reader(database_path,
+                                      mode=geoip2.database.MODE_MMAP)
+
+
+
+def parse_ip(ip):
+    '''
+    This turns ip (a string) into an ipaddress.IPv4Address or IPv6Address.
+    IPv4 addresses mapped into IPv6 (::ffff:a.b.c.d) are turned into plain
+    IPv4 addresses.
+
+    Returns None if ip isn't a valid IP address.
+
+    '''
+
+    try:
+        if isinstance(ip, str):
+            ip = ip.decode('ascii')
+        ipaddr = ipaddress.ip_address(ip)
+    except (ValueError, UnicodeError):
+        return None
+
+    if ipaddr.version == 6 and ipaddr.ipv4_mapped is not None:
+        return ipaddr.ipv4_mapped
+
+    return ipaddr
+
+
+
+def compile_cidr_ranges(cidrs):
+    '''
+    This turns cidrs (a comma-separated string or a list of CIDR network
+    definitions, IPv4 or IPv6) into a dict keyed by IP version, with the
+    sorted start and end addresses of the networks as integers. Overlapping
+    and adjacent networks are merged.
+
+    Raises ValueError if any of the networks isn't valid.
+
+    '''
+
+    if isinstance(cidrs, basestring):
+        cidrs = cidrs.split(',')
+
+    ranges = {4:[], 6:[]}
+
+    for cidr in cidrs:
+
+        cidr = cidr.strip()
+        if not cidr:
+            continue
+        if isinstance(cidr, str):
+            cidr = cidr.decode('ascii')
+
+        network = ipaddress.ip_network(cidr, strict=False)
+        ranges[network.version].append(
+            (int(network.network_address), int(network.broadcast_address))
+        )
+
+    compiled = {}
+
+    for version in ranges:
+
+        starts, ends = [], []
+
+        for start, end in sorted(ranges[version]):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+        compiled[version] = (starts, ends)
+
+    return compiled
+
+
+
+def ip_in_ranges(ip, ranges):
+    '''
+    This checks if ip (a string) is in ranges, from compile_cidr_ranges.
+
+    '''
+
+    if not ranges:
+        return False
+
+    ipaddr = parse_ip(ip)
+
+    if ipaddr is None:
+        return False
+
+    starts, ends = ranges[ipaddr.version]
+    ipint = int(ipaddr)
+
+    ind = bisect.bisect_right(starts, ipint) - 1
+
+    return ind >= 0 and ipint <= ends[ind]
+
+
+
+def check_location(reader, ip, countries, regions):
+    '''
+    This looks up ip in the GeoLite2 database opened as reader, and checks if
+    it's in one of the allowed countries and subdivisions. IPs that aren't in
+    the database aren't allowed.
+
+    Returns a tuple of True if ip is allowed, and its location as a
+    'country-subdivision' string. Other errors from the lookup are raised.
+
+    '''
+
+    now = time.time()
+    cached = GEOIP_CACHE.pop(ip, None)
+
+    # move the IP to the end of the cache, since it was just used
+    if cached is not None and cached[2] > now:
+        GEOIP_CACHE[ip] = cached
+        metrics.count_cache('geoip', True)
+        return cached[0], cached[1]
+
+    metrics.count_cache('geoip', False)
+
+    try:
+
+        geoip = reader.city(ip)
+        country = geoip.country.iso_code
+        region = geoip.subdivisions.most_specific.iso_code
+
+        allowed = country in countries and region in regions
+        location = '%s-%s' % (country, region)
+
+    except geoip2.errors.AddressNotFoundError:
+
+        allowed = False
+        location = 'unknown location'
+
+    GEOIP_CACHE.pop(ip, None)
+
+    while len(GEOIP_CACHE) >= GEOIP_CACHE_SIZE:
+        GEOIP_CACHE.popitem(last=False)
+
+    GEOIP_CACHE[ip] = (allowed, location, now + GEOIP_CACHE_TTL)
+
+    return allowed, location
@@ -0,0 +1,81 @@
+#!/usr/bin/env node
+
+/*
+  mathrender.js - Oct 2026
+
+  This typesets the TeX in article titles and abstracts to SVG with MathJax,
+  for mathrender.py. It reads a JSON object of {key: HTML fragment} from stdin
+  and writes a JSON object of {key: typeset HTML fragment} to stdout.
+
+  This needs the mathjax-node-page package, installed next to this file:
+
+  $ npm install --prefix /path/to/astroph-coffee/run mathjax-node-page
+
+*/
+
+var mjpage = require('mathjax-node-page').mjpage;
+
+// the same delimiters and macros as the MathJax config in base.html
+var PAGE_CONFIG = {
+    format: ['TeX'],
+    singleDollars: true,
+    fragment: true,
+    displayErrors: false,
+    MathJax: {
+        TeX: {
+            Macros: {
+                AA: '\\unicode{x212B}',
+                Ha: '\\mathrm{H}\\alpha',
+                MEarth: 'M_{\\oplus}',
+                farcs: '.^{\\prime\\prime}',
+                MJup: 'M_{\\mathrm{J}}',
+                mjup: 'M_{\\mathrm{J}}',
+                Msun: 'M_{\\odot}',
+                msun: 'M_{\\odot}'
+            }
+        }
+    }
+};
+
+// SVG output doesn't need any web fonts or stylesheets on the page
+var NODE_CONFIG = {
+    svg: true
+};
+
+
+// this typesets the fragments one at a time, then calls done with all of them
+function typeset_fragments(fragments, keys, typeset, done) {
+
+    if (keys.length == 0) {
+        done(typeset);
+        return;
+    }
+
+    var key = keys.shift();
+
+    mjpage(fragments[key], PAGE_CONFIG, NODE_CONFIG, function (output) {
+        typeset[key] = output;
+        typeset_fragments(fragments, keys, typeset, done);
+    });
+
+}
+
+
+var input = '';
+
+process.stdin.setEncoding('utf8');
+
+process.stdin.on('data', function (chunk) {
+    input += chunk;
+});
+
+process.stdin.on('end', function () {
+
+    var fragments = JSON.parse(input);
+
+    typeset_fragments(fragments, Object.keys(fragments), {},
+                      function (typeset) {
+                          process.stdout.write(JSON.stringify(typeset));
+                      });
+
+});
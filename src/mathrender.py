@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+'''mathrender.py - Oct 2026
+
+This pre-renders the TeX in article titles and abstracts, so browsers don't
+have to run MathJax over hundreds of abstracts on every listing, archive, and
+search page.
+
+The rendering is done by MathJax itself, running under node.js (see
+mathrender.js, which needs the mathjax-node-page package), and turns the math
+into inline SVG. The nightly ingest calls prerender_articles for the day's
+articles once they're in the DB; call it for older days to render those too.
+
+Renders are kept in the math_renders table, one row for each article's title
+and abstract, with the SHA1 of the text they were made from. A render is only
+used while the article's text still has the same SHA1, so an article replaced
+by a new arxiv version goes back to being typeset in the browser until it's
+rendered again. Text without any TeX gets a row with no HTML, so the pages can
+tell MathJax to skip it.
+
+If node or mathjax-node-page isn't installed, nothing is pre-rendered, and
+the pages are typeset by MathJax in the browser as before.
+
+'''
+
+import os.path
+import re
+import json
+import hashlib
+import subprocess
+import ConfigParser
+
+from tornado.escape import xhtml_escape
+
+import arxivdb
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the node.js binary used to run mathrender.js
+if CONF.has_option('mathjax','node'):
+    NODE = CONF.get('mathjax','node')
+else:
+    NODE = 'node'
+
+RENDER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'mathrender.js')
+
+# the article fields that are pre-rendered and their columns in the arxiv table
+MATH_FIELDS = (('title','title'),
+               ('abstract','abstract'))
+
+# this many texts are sent to mathrender.js at a time
+RENDER_BATCH_SIZE = 100
+
+# this many arxivids are looked up in one query (sqlite's default limit on
+# query parameters is 999)
+LOOKUP_BATCH_SIZE = 400
+
+# an unescaped $ starts or ends TeX (see the tex2jax config in base.html)
+math_regex = re.compile(r'(?<!\\)\$')
+
+
+
+def text_hash(text):
+    '''
+    This returns the SHA1 of text, which is what renders are keyed on.
+
+    '''
+
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+
+    return hashlib.sha1(text or '').hexdigest()
+
+
+
+def has_math(text):
+    '''
+    This returns True if text has any TeX in it that MathJax would typeset.
+
+    '''
+
+    return bool(text and math_regex.search(text))
+
+
+
+def render_math(texts):
+    '''
+    This renders the TeX in texts (a dict of plain text titles or abstracts)
+    with mathrender.js.
+
+    Returns a dict with the same keys, with each text turned into HTML with
+    its TeX as inline SVG, or None if mathrender.js couldn't be run.
+
+    '''
+
+    fragments = json.dumps({x:xhtml_escape(texts[x]) for x in texts})
+
+    try:
+
+        proc = subprocess.Popen([NODE, RENDER_SCRIPT],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate(fragments)
+
+    except OSError as e:
+
+        print('could not run %s to render math, error was %s' % (NODE, e))
+        return None
+
+    if proc.returncode != 0:
+
+        print('could not render math, %s failed with: %s' %
+              (RENDER_SCRIPT, stderr.strip()))
+        return None
+
+    try:
+        rendered = json.loads(stdout)
+    except ValueError:
+        print('could not render math, %s returned bad output' % RENDER_SCRIPT)
+        return None
+
+    return {x:rendered[x] for x in texts if x in rendered}
+
+
+
+def prerender_articles(utcdate=None,
+                       arxivids=None,
+                       force=False,
+                       database=None,
+                       verbose=False):
+    '''
+    This renders the TeX in the titles and abstracts of the articles listed on
+    utcdate (a datetime.date or a YYYY-MM-DD string; the latest date in the DB
+    if None), or of the articles in the list arxivids if that's given instead.
+
+    Only the titles and abstracts that changed since they were last rendered
+    are rendered again, unless force is True.
+
+    Returns a dict with the numbers of texts rendered, texts that don't have
+    any TeX, texts that didn't need rendering again, and texts that couldn't
+    be rendered.
+
+    '''
+
+    counts = {'rendered':0, 'plain':0, 'unchanged':0, 'failed':0}
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    columns = ', '.join(x[1] for x in MATH_FIELDS)
+
+    if arxivids:
+
+        articles = []
+
+        for ind in range(0, len(arxivids), LOOKUP_BATCH_SIZE):
+
+            batch = arxivids[ind:ind+LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join('?' for x in batch)
+            cursor.execute('select arxiv_id, %s from arxiv '
+                           'where arxiv_id in (%s)' % (columns, placeholders),
+                           tuple(batch))
+            articles.extend(cursor.fetchall())
+
+    else:
+
+        # if no utcdate is provided, find the latest utcdate and use that
+        if not utcdate:
+            cursor.execute('select utcdate from arxiv '
+                           'order by utcdate desc limit 1')
+            row = cursor.fetchone()
+            utcdate = row[0] if row else None
+
+        cursor.execute('select arxiv_id, %s from arxiv '
+                       'where utcdate = ?' % columns,
+                       (utcdate,))
+        articles = cursor.fetchall()
+
+    try:
+
+        rendered_hashes = {}
+
+        if not force:
+
+            for ind in range(0, len(articles), LOOKUP_BATCH_SIZE):
+
+                batch = [x[0] for x in articles[ind:ind+LOOKUP_BATCH_SIZE]]
+                placeholders = ', '.join('?' for x in batch)
+                cursor.execute('select arxiv_id, field, content_hash '
+                               'from math_renders '
+                               'where arxiv_id in (%s)' % placeholders,
+                               tuple(batch))
+                for arxivid, field, content_hash in cursor.fetchall():
+                    rendered_hashes[(arxivid, field)] = content_hash
+
+        # work out which texts need rendering
+        torender, plain = {}, []
+
+        for article in articles:
+
+            for field, text in zip((x[0] for x in MATH_FIELDS), article[1:]):
+
+                key = (article[0], field)
+                content_hash = text_hash(text)
+
+                if rendered_hashes.get(key) == content_hash:
+                    counts['unchanged'] += 1
+                elif has_math(text):
+                    torender[key] = (text, content_hash)
+                else:
+                    plain.append((article[0], field, content_hash, None))
+
+        cursor.executemany('insert or replace into math_renders '
+                           '(arxiv_id, field, content_hash, html) '
+                           'values (?, ?, ?, ?)',
+                           plain)
+        counts['plain'] = len(plain)
+
+        # then render the ones with TeX in them
+        keys = sorted(torender.keys())
+
+        for ind in range(0, len(keys), RENDER_BATCH_SIZE):
+
+            batch = keys[ind:ind+RENDER_BATCH_SIZE]
+            rendered = render_math({'%s|%s' % x:torender[x][0]
+                                    for x in batch})
+
+            # if mathrender.js doesn't work, don't bother with the rest
+            if rendered is None:
+                counts['failed'] += len(keys) - ind
+                break
+
+            rows = []
+
+            for key in batch:
+
+                html = rendered.get('%s|%s' % key)
+
+                if html:
+                    rows.append((key[0], key[1], torender[key][1], html))
+                else:
+                    counts['failed'] += 1
+
+            cursor.executemany('insert or replace into math_renders '
+                               '(arxiv_id, field, content_hash, html) '
+                               'values (?, ?, ?, ?)',
+                               rows)
+            counts['rendered'] += len(rows)
+
+            if verbose:
+                print('rendered math for %s of %s texts' %
+                      (min(ind + RENDER_BATCH_SIZE, len(keys)), len(keys)))
+
+        database.commit()
+
+    except Exception as e:
+
+        print('could not save math renders, error was %s' % e)
+        database.rollback()
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    print('math renders: %s rendered, %s without TeX, %s unchanged, '
+          '%s failed' % (counts['rendered'], counts['plain'],
+                         counts['unchanged'], counts['failed']))
+
+    return counts
+
+
+
+def get_math_renders(texts, database=None):
+    '''
+    This looks up the renders for texts, a list of (arxivid, field, text)
+    tuples.
+
+    Returns a dict keyed by (arxivid, field) with the rendered HTML, or None
+    for text that doesn't have any TeX. Texts that haven't been rendered, or
+    that have changed since they were rendered, are left out.
+
+    '''
+
+    if not texts:
+        return {}
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    hashes = {(x[0], x[1]):text_hash(x[2]) for x in texts}
+    arxivids = sorted(set(x[0] for x in texts))
+    renders = {}
+
+    for ind in range(0, len(arxivids), LOOKUP_BATCH_SIZE):
+
+        batch = arxivids[ind:ind+LOOKUP_BATCH_SIZE]
+        placeholders = ', '.join('?' for x in batch)
+        cursor.execute('select arxiv_id, field, content_hash, html '
+                       'from math_renders '
+                       'where arxiv_id in (%s)' % placeholders,
+                       tuple(batch))
+
+        for arxivid, field, content_hash, html in cursor.fetchall():
+            if hashes.get((arxivid, field)) == content_hash:
+                renders[(arxivid, field)] = html
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return renders
+
+
+
+def get_listing_renders(article_lists, database=None):
+    '''
+    This looks up the renders for the titles and abstracts of the articles in
+    article_lists (e.g. the local, voted, other, and reserved articles from
+    arxivdb.get_articles_for_listing).
+
+    Returns the same dict as get_math_renders.
+
+    '''
+
+    texts = []
+
+    for articles in article_lists:
+        for article in articles:
+            texts.append((article[0], 'title', article[2]))
+            texts.append((article[0], 'abstract', article[6]))
+
+    return get_math_renders(texts, database=database)
+
+
+
+## TEMPLATE HELPERS
+
+# these are the ui_methods for the templates. handlers that render titles and
+# abstracts put the result of get_math_renders in their math_renders attribute
+
+def math_html(handler, arxivid, field, text):
+    '''
+    This returns the pre-rendered HTML for an article's title or abstract, or
+    the escaped text if there isn't an up-to-date render of it.
+
+    '''
+
+    renders = getattr(handler, 'math_renders', None) or {}
+    html = renders.get((arxivid, field))
+
+    if html:
+        return html
+
+    return xhtml_escape(text)
+
+
+
+def math_class(handler, arxivid, field):
+    '''
+    This returns the class for the element holding an article's title or
+    abstract: no-mathjax if it's been pre-rendered (or doesn't have any TeX),
+    so MathJax in the browser skips it, otherwise mathjax.
+
+    '''
+
+    renders = getattr(handler, 'math_renders', None) or {}
+
+    if (arxivid, field) in renders:
+        return 'no-mathjax'
+
+    return 'mathjax'
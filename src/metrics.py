@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+'''metrics.py - Oct 2026
+
+This keeps the server's metrics in memory and turns them into the Prometheus
+text format for the /astroph-coffee/metrics URL:
+
+- how long requests take, for each handler and HTTP method
+- the number of requests, for each handler, method, and status code
+- the number of requests being handled right now
+- how long each call to the arxivdb, webdb, and fulltextsearch functions takes
+- how long each template takes to render
+- the hits and misses of the caches
+
+The metrics are for the server process they're kept in, and start again
+from zero when it restarts. Counters kept by other modules (e.g. the stale
+results and rate limit counters) are copied in with set_value when the
+metrics are asked for.
+
+'''
+
+import time
+import bisect
+import inspect
+import functools
+from collections import OrderedDict
+
+# the upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the upper bounds of the buckets of the histogram of the number of queries
+# run by each request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# the metrics, in the order they're shown. each has its type, help text,
+# label names, and a dict of values keyed by label values. a histogram also
+# has the upper bounds of its buckets, and its values are lists of the counts
+# in each bucket (plus one for +Inf), followed by the sum and count of the
+# observations
+METRICS = OrderedDict()
+
+
+
+def define(name, metrictype, helptext, labelnames=(),
+           buckets=LATENCY_BUCKETS):
+    '''
+    This adds a metric. metrictype is 'counter', 'gauge', or 'histogram'.
+    buckets are the upper bounds of the buckets of a histogram.
+
+    '''
+
+    METRICS[name] = {'type':metrictype,
+                     'help':helptext,
+                     'labelnames':tuple(labelnames),
+                     'buckets':tuple(buckets),
+                     'values':{}}
+
+
+
+def observe(name, labelvalues, value):
+    '''
+    This adds value (e.g. a duration in seconds) to the histogram name, for
+    the tuple of labelvalues.
+
+    '''
+
+    buckets = METRICS[name]['buckets']
+    values = METRICS[name]['values']
+    series = values.get(labelvalues)
+
+    if series is None:
+        series = values[labelvalues] = [0]*(len(buckets) + 3)
+
+    series[bisect.bisect_left(buckets, value)] += 1
+    series[-2] += value
+    series[-1] += 1
+
+
+
+def add_value(name, labelvalues, amount=1):
+    '''
+    This adds amount to the counter or gauge name, for the tuple of
+    labelvalues.
+
+    '''
+
+    values = METRICS[name]['values']
+    values[labelvalues] = values.get(labelvalues, 0) + amount
+
+
+
+def set_value(name, labelvalues, value):
+    '''
+    This sets the counter or gauge name to value, for the tuple of
+    labelvalues.
+
+    '''
+
+    METRICS[name]['values'][labelvalues] = value
+
+
+
+def count_cache(cache, hit):
+    '''
+    This counts a lookup in cache, which was a hit if hit is True.
+
+    '''
+
+    add_value('coffee_cache_requests_total',
+              (cache, 'hit' if hit else 'miss'))
+
+
+
+def timed_function(func, modulename):
+    '''
+    This returns a wrapper for func that records how long each call takes in
+    the coffee_db_call_duration_seconds histogram.
+
+    '''
+
+    labelvalues = (modulename, func.__name__)
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe('coffee_db_call_duration_seconds',
+                    labelvalues,
+                    time.time() - start)
+
+    timed.metrics_timed = True
+    return timed
+
+
+
+def instrument_module(module):
+    '''
+    This replaces the public functions of module (e.g. arxivdb) with
+    timed_function wrappers. This only affects calls made through the module
+    (arxivdb.get_articles_for_listing(...)), which is how the handlers make
+    them.
+
+    '''
+
+    for name, func in inspect.getmembers(module, inspect.isfunction):
+
+        if (name.startswith('_') or
+            func.__module__ != module.__name__ or
+            getattr(func, 'metrics_timed', False)):
+            continue
+
+        setattr(module, name, timed_function(func, module.__name__))
+
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    '''
+    This returns the {name="value",...} part of a metric line.
+
+    '''
+
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (x, ('%s' % y).replace('\\', '\\\\').replace(
+            '"', '\\"'
+        ).replace('\n', '\\n'))
+        for x, y in pairs
+    )
+
+
+
+def format_number(value):
+    '''
+    This formats a metric value.
+
+    '''
+
+    if isinstance(value, float):
+        return repr(value)
+
+    return '%s' % value
+
+
+
+def render_metrics():
+    '''
+    This returns all of the metrics in the Prometheus text format.
+
+    '''
+
+    lines = []
+
+    for name in METRICS:
+
+        metric = METRICS[name]
+        labelnames = metric['labelnames']
+
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+
+        for labelvalues in sorted(metric['values']):
+
+            value = metric['values'][labelvalues]
+
+            if metric['type'] != 'histogram':
+                lines.append('%s%s %s' % (name,
+                                          format_labels(labelnames,
+                                                        labelvalues),
+                                          format_number(value)))
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip(metric['buckets'] + ('+Inf',), value):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (
+                    name,
+                    format_labels(labelnames, labelvalues,
+                                  extra=(('le', bound),)),
+                    cumulative
+                ))
+
+            lines.append('%s_sum%s %s' % (name,
+                                          format_labels(labelnames,
+                                                        labelvalues),
+                                          repr(float(value[-2]))))
+            lines.append('%s_count%s %s' % (name,
+                                            format_labels(labelnames,
+                                                          labelvalues),
+                                            value[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+
+
+## THE METRICS
+
+define('coffee_request_duration_seconds', 'histogram',
+       'How long requests take to handle.',
+       ('handler','method'))
+define('coffee_requests_total', 'counter',
+       'Requests handled.',
+       ('handler','method','code'))
+define('coffee_requests_in_flight', 'gauge',
+       'Requests being handled right now.')
+define('coffee_request_db_queries', 'histogram',
+       'SQL queries run by each request.',
+       ('handler',),
+       buckets=QUERY_COUNT_BUCKETS)
+define('coffee_db_call_duration_seconds', 'histogram',
+       'How long calls to the DB functions take.',
+       ('module','function'))
+define('coffee_template_render_seconds', 'histogram',
+       'How long templates take to render.',
+       ('template',))
+define('coffee_cache_requests_total', 'counter',
+       'Cache lookups that found (hit) or did not find (miss) what they '
+       'were looking for.',
+       ('cache','result'))
+define('coffee_stale_serves_total', 'counter',
+       'Pages shown from stale results because the DB was busy or slow.',
+       ('page',))
+define('coffee_stale_refreshes_total', 'counter',
+       'Refreshes of stale results that worked or failed.',
+       ('result',))
+define('coffee_rate_limited_total', 'counter',
+       'Requests refused for going over the rate limits.',
+       ('kind',))
+define('coffee_vote_streams', 'gauge',
+       'Vote streams open to voting pages.')
+
+set_value('coffee_requests_in_flight', (), 0)
+set_value('coffee_vote_streams', (), 0)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+'''pagecache.py - Oct 2026
+
+This keeps whole rendered pages that are the same for every visitor in
+memory (the about page, the local authors list, and the archive index), so
+these don't need a session lookup, DB queries, or template rendering on every
+view.
+
+Pages are keyed by their URL (path and query string), and are saved along
+with the versions of the tags they depend on, e.g. local_authors or
+daily_stats. The versions are kept in the cache_tags table, where triggers
+bump a tag whenever the table it names changes, no matter which process
+changes it (the server, the nightly ingest, or someone in the sqlite3 shell).
+A cached page is only used while all of its tags are still at the versions it
+was rendered with. invalidate_tags bumps tags by hand.
+
+'''
+
+from collections import OrderedDict
+
+import arxivdb
+import metrics
+
+# the pages are kept here, oldest first
+PAGE_CACHE = OrderedDict()
+
+# the most pages kept at once. the archive index can be reached by many URLs,
+# so this keeps odd ones from piling up
+MAX_CACHED_PAGES = 100
+
+
+
+def get_tag_versions(tags, database=None):
+    '''
+    This returns a dict of the current versions of tags. Tags that have never
+    been bumped are at version 0.
+
+    '''
+
+    if not tags:
+        return {}
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    placeholders = ', '.join('?' for x in tags)
+    cursor.execute('select tag, version from cache_tags '
+                   'where tag in (%s)' % placeholders,
+                   tuple(tags))
+    versions = {x:0 for x in tags}
+    versions.update({x[0]:x[1] for x in cursor.fetchall()})
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return versions
+
+
+
+def load_page(key, database=None):
+    '''
+    This returns the cached HTML of the page for key, or None if it isn't in
+    the cache or any of its tags have changed since it was rendered.
+
+    '''
+
+    cached = PAGE_CACHE.get(key)
+
+    if cached is None:
+        metrics.count_cache('page', False)
+        return None
+
+    if (cached['versions'] and
+        get_tag_versions(list(cached['versions']),
+                         database=database) != cached['versions']):
+        PAGE_CACHE.pop(key, None)
+        metrics.count_cache('page', False)
+        return None
+
+    metrics.count_cache('page', True)
+    return cached['html']
+
+
+
+def save_page(key, html, versions):
+    '''
+    This saves the HTML of the page for key to the cache. versions is the
+    dict of the versions of its tags from get_tag_versions, which should be
+    called before the page is rendered, so changes made while it's being
+    rendered aren't missed.
+
+    '''
+
+    PAGE_CACHE.pop(key, None)
+
+    while len(PAGE_CACHE) >= MAX_CACHED_PAGES:
+        PAGE_CACHE.popitem(last=False)
+
+    PAGE_CACHE[key] = {'html':html,
+                       'versions':versions}
+
+
+
+def invalidate_tags(tags, database=None):
+    '''
+    This bumps the versions of tags, so cached pages that depend on them are
+    rendered again on their next view, in every server process.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    try:
+
+        for tag in tags:
+            cursor.execute('insert or ignore into cache_tags (tag) values (?)',
+                           (tag,))
+            cursor.execute('update cache_tags set version = version + 1 '
+                           'where tag = ?',
+                           (tag,))
+
+        database.commit()
+
+    except Exception as e:
+
+        print('could not invalidate cache tags %s, error was %s' % (tags, e))
+        database.rollback()
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+'''ratelimit.py - Oct 2026
+
+This keeps token buckets for each client IP and session, so clients sending
+requests faster than they should are turned away before they get to the DB.
+
+Reads (page views and JSON lookups) and writes (votes, reservations, edits,
+searches, and page views that start a new session) have their own buckets. A
+bucket holds up to burst tokens and gets rate new tokens per second; each
+request takes one token from the IP's bucket and one from the session's
+bucket, and is refused if either is empty. The rates and bursts can be set in
+the [ratelimit] section of the conf file as "rate, burst".
+
+The buckets are kept in memory, so each server process has its own.
+
+'''
+
+import time
+import ConfigParser
+from collections import OrderedDict
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the default (tokens per second, burst) for each bucket type
+RATE_LIMITS = {('ip','read'):(10.0, 100),
+               ('ip','write'):(2.0, 30),
+               ('session','read'):(2.0, 30),
+               ('session','write'):(0.5, 15)}
+
+for keytype, kind in RATE_LIMITS:
+
+    option = '%s_%ss' % (keytype, kind)
+
+    if CONF.has_option('ratelimit', option):
+        rate, burst = CONF.get('ratelimit', option).split(',')
+        RATE_LIMITS[(keytype, kind)] = (float(rate), int(burst))
+
+# the buckets, least recently used first. each is keyed by (keytype, key,
+# kind) and holds its tokens and the time they were last topped up
+BUCKETS = OrderedDict()
+
+# the most buckets kept at once. a bucket that's dropped starts off full
+# again, so this only needs to be big enough to hold the busy clients
+MAX_BUCKETS = 20000
+
+# the number of requests refused for each kind of request
+RATE_LIMITED = {'read':0,
+                'write':0}
+
+
+
+def take_token(kind, keys):
+    '''
+    This takes a token for a request of kind ('read' or 'write') from the
+    buckets for each of keys, a list of (keytype, key) tuples, where keytype
+    is 'ip' or 'session'.
+
+    Returns 0.0 if the request can go ahead, or the number of seconds until
+    it can be tried again if any of the buckets are empty. No tokens are
+    taken in that case.
+
+    '''
+
+    now = time.time()
+    buckets, wait = [], 0.0
+
+    for keytype, key in keys:
+
+        rate, burst = RATE_LIMITS[(keytype, kind)]
+        bucket_key = (keytype, key, kind)
+        bucket = BUCKETS.pop(bucket_key, None)
+
+        if bucket is None:
+            while len(BUCKETS) >= MAX_BUCKETS:
+                BUCKETS.popitem(last=False)
+            bucket = [float(burst), now]
+        else:
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1])*rate)
+            bucket[1] = now
+
+        # put it back at the end, since it was just used
+        BUCKETS[bucket_key] = bucket
+        buckets.append(bucket)
+
+        if bucket[0] < 1.0:
+            wait = max(wait, (1.0 - bucket[0])/rate)
+
+    if wait > 0.0:
+        RATE_LIMITED[kind] += 1
+        return wait
+
+    for bucket in buckets:
+        bucket[0] = bucket[0] - 1.0
+
+    return 0.0
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+'''sqlprofile.py - Oct 2026
+
+This has the connection and cursor classes that profile the server's SQL
+queries. The connections from arxivdb.opendb and the server's DATABASE use
+these, so every query run through their cursors is recorded with:
+
+- its normalized SQL, with the literals and bound values replaced by ?, and
+  lists of these collapsed, so all queries of the same shape are counted
+  together
+- the number of bound values
+- its wall time, including the time taken to fetch its rows
+- the number of rows it returned
+
+The totals for each query shape are kept in QUERY_STATS. Queries taking
+longer than slow_query_ms milliseconds (from the [sqlite3] section of the conf
+file) are written to the slow_query_log file. If EXPLAIN_PLANS is True (the
+server sets this in debug mode), the EXPLAIN QUERY PLAN of each query shape is
+kept in QUERY_PLANS the first time it runs, and plans with full table scans
+are printed.
+
+QUERIES_RUN counts every query run, so the handlers can tell how many queries
+a request ran (see coffeehandlers.InstrumentedHandler).
+
+'''
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except:
+    print("can't find internal pysqlite2, falling back to Python sqlite3 "
+          "full-text search may not work right "
+          "if your sqlite3.sqlite3_version is old (< 3.8.6 or so)")
+    import sqlite3
+
+import re
+import time
+import ConfigParser
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# queries taking longer than this in milliseconds go in the slow query log
+if CONF.has_option('sqlite3','slow_query_ms'):
+    SLOW_QUERY_MS = CONF.getfloat('sqlite3','slow_query_ms')
+else:
+    SLOW_QUERY_MS = 100.0
+
+if CONF.has_option('sqlite3','slow_query_log'):
+    SLOW_QUERY_LOG = CONF.get('sqlite3','slow_query_log')
+else:
+    SLOW_QUERY_LOG = 'logs/slow-queries.log'
+
+# requests running more than this many queries are logged by the handlers,
+# since these are usually looking up something for each paper in a loop
+if CONF.has_option('sqlite3','request_query_warning'):
+    REQUEST_QUERY_WARNING = CONF.getint('sqlite3','request_query_warning')
+else:
+    REQUEST_QUERY_WARNING = 50
+
+# if this is True, the query plan for each query shape is kept
+EXPLAIN_PLANS = False
+
+# the number of queries run so far
+QUERIES_RUN = 0
+
+# the totals for each query shape: the number of times it ran, the number of
+# bound values, rows returned, and total and longest wall times in seconds
+QUERY_STATS = {}
+
+# the query plans for each query shape, as lists of the plan details
+QUERY_PLANS = {}
+
+# the most query shapes kept. there should only be a few dozen of these,
+# unless something is putting values in its SQL instead of binding them
+MAX_QUERY_SHAPES = 1000
+
+# the normalized forms of the SQL strings, keyed by the SQL string
+NORMALIZED_SQL = {}
+
+# these turn SQL into its normalized form, in order
+NORMALIZE_REGEXES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.I), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+)
+
+# only these statements can be explained
+EXPLAINABLE = ('select', 'with', 'insert', 'replace', 'update', 'delete')
+
+
+
+def normalize_sql(sql):
+    '''
+    This returns the normalized form of sql: its whitespace collapsed, its
+    string and number literals replaced by ?, and lists of ? collapsed into
+    (?, ...).
+
+    '''
+
+    normalized = NORMALIZED_SQL.get(sql)
+
+    if normalized is None:
+
+        normalized = ' '.join(sql.split())
+        for regex, replacement in NORMALIZE_REGEXES:
+            normalized = regex.sub(replacement, normalized)
+
+        if len(NORMALIZED_SQL) >= MAX_QUERY_SHAPES:
+            NORMALIZED_SQL.clear()
+        NORMALIZED_SQL[sql] = normalized
+
+    return normalized
+
+
+
+def explain_query(connection, sql, parameters):
+    '''
+    This returns the EXPLAIN QUERY PLAN of sql run with parameters on
+    connection, as a list of the plan details.
+
+    '''
+
+    # use a plain cursor so this query isn't profiled itself
+    cursor = sqlite3.Cursor(connection)
+
+    try:
+        cursor.execute('explain query plan %s' % sql, parameters)
+        return [x[-1] for x in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+
+def is_full_scan(plan):
+    '''
+    This checks if any step of plan (from explain_query) scans a whole table
+    without an index.
+
+    '''
+
+    for detail in plan:
+        if (detail.startswith('SCAN ') and
+            'USING' not in detail and
+            'VIRTUAL TABLE' not in detail and
+            detail != 'SCAN CONSTANT ROW'):
+            return True
+
+    return False
+
+
+
+def log_slow_query(shape, nbinds, elapsed, nrows):
+    '''
+    This writes a query to the slow query log.
+
+    '''
+
+    line = '%s  %.1f ms  %s rows  %s binds  %s' % (
+        time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        elapsed*1000.0,
+        nrows,
+        nbinds,
+        shape
+    )
+
+    plan = QUERY_PLANS.get(shape)
+    if plan:
+        line = '%s  [plan: %s]' % (line, '; '.join(plan))
+
+    try:
+        with open(SLOW_QUERY_LOG,'a') as outfd:
+            outfd.write('%s\n' % line.encode('utf-8'))
+    except (IOError, OSError) as e:
+        print('could not write to slow query log %s, error was %s' %
+              (SLOW_QUERY_LOG, e))
+        print('slow query: %s' % line)
+
+
+
+def record_query(connection, sql, parameters, elapsed, nrows):
+    '''
+    This records a query that finished running.
+
+    '''
+
+    shape = normalize_sql(sql)
+    nbinds = len(parameters) if parameters else 0
+
+    stats = QUERY_STATS.get(shape)
+
+    if stats is None:
+        if len(QUERY_STATS) >= MAX_QUERY_SHAPES:
+            return
+        stats = QUERY_STATS[shape] = {'calls':0,
+                                      'binds':0,
+                                      'rows':0,
+                                      'time':0.0,
+                                      'max_time':0.0}
+
+    stats['calls'] += 1
+    stats['binds'] += nbinds
+    stats['rows'] += nrows
+    stats['time'] += elapsed
+    stats['max_time'] = max(stats['max_time'], elapsed)
+
+    if (EXPLAIN_PLANS and shape not in QUERY_PLANS and
+        shape.split(None, 1)[0].lower() in EXPLAINABLE):
+
+        try:
+            plan = explain_query(connection, sql, parameters)
+        except Exception as e:
+            plan = ['could not explain query: %s' % e]
+
+        QUERY_PLANS[shape] = plan
+
+        if is_full_scan(plan):
+            print('query does a full table scan: %s [plan: %s]' %
+                  (shape, '; '.join(plan)))
+
+    if elapsed*1000.0 > SLOW_QUERY_MS:
+        log_slow_query(shape, nbinds, elapsed, nrows)
+
+
+
+def query_report(top=20):
+    '''
+    This returns the top query shapes by total wall time, as a list of
+    (shape, stats) tuples.
+
+    '''
+
+    return sorted(QUERY_STATS.items(),
+                  key=lambda x: x[1]['time'],
+                  reverse=True)[:top]
+
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    '''
+    This is a cursor that records each query run through it. A query is
+    recorded once all of its rows have been fetched, or when the cursor runs
+    another query or is closed.
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(ProfilingCursor, self).__init__(*args, **kwargs)
+        self.profiled_query = None
+
+
+    def finish_query(self):
+        '''
+        This records the query that was running, if there was one.
+
+        '''
+
+        if self.profiled_query is not None:
+            query, self.profiled_query = self.profiled_query, None
+            record_query(self.connection, *query)
+
+
+    def fetched_rows(self, start, nrows, done):
+        '''
+        This adds rows fetched since start to the query that's running.
+
+        '''
+
+        if self.profiled_query is not None:
+            self.profiled_query[2] += time.time() - start
+            self.profiled_query[3] += nrows
+            if done:
+                self.finish_query()
+
+
+    def execute(self, sql, parameters=()):
+        global QUERIES_RUN
+
+        self.finish_query()
+        QUERIES_RUN += 1
+
+        start = time.time()
+
+        try:
+            return super(ProfilingCursor, self).execute(sql, parameters)
+        finally:
+            self.profiled_query = [sql, parameters, time.time() - start, 0]
+            # queries without results are done as soon as they run
+            if self.description is None:
+                self.finish_query()
+
+
+    def executemany(self, sql, seq_of_parameters):
+        global QUERIES_RUN
+
+        self.finish_query()
+        QUERIES_RUN += 1
+
+        start = time.time()
+
+        try:
+            return super(ProfilingCursor, self).executemany(
+                sql,
+                seq_of_parameters
+            )
+        finally:
+            record_query(self.connection, sql, (), time.time() - start, 0)
+
+
+    def fetchone(self):
+        start = time.time()
+        row = super(ProfilingCursor, self).fetchone()
+        self.fetched_rows(start, 0 if row is None else 1, row is None)
+        return row
+
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        start = time.time()
+        rows = super(ProfilingCursor, self).fetchmany(size)
+        self.fetched_rows(start, len(rows), len(rows) < size)
+        return rows
+
+
+    def fetchall(self):
+        start = time.time()
+        rows = super(ProfilingCursor, self).fetchall()
+        self.fetched_rows(start, len(rows), True)
+        return rows
+
+
+    def next(self):
+        start = time.time()
+        try:
+            row = super(ProfilingCursor, self).next()
+        except StopIteration:
+            self.fetched_rows(start, 0, True)
+            raise
+        self.fetched_rows(start, 1, False)
+        return row
+
+
+    def close(self):
+        self.finish_query()
+        return super(ProfilingCursor, self).close()
+
+
+
+class ProfilingConnection(sqlite3.Connection):
+    '''
+    This is a connection whose cursors are ProfilingCursors. Pass it as the
+    factory kwarg of sqlite3.connect.
+
+    '''
+
+    def cursor(self, factory=ProfilingCursor):
+        return super(ProfilingConnection, self).cursor(factory)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+'''staleresults.py - Oct 2026
+
+This keeps the last good results of the DB calls behind the listing, archive,
+and search pages, so these pages can still be shown while the DB is busy
+(e.g. while the nightly ingest holds a write lock on it) or slow.
+
+Once a call has a last good result kept, it's only given LATENCY_BUDGET
+seconds, both to wait for locks and to run its query. If it runs out of time
+or the DB says it's busy, the last good result is handed back instead, marked
+as stale, so the page can say that it may be out of date. The call is then
+run again without a time limit REFRESH_DELAY seconds later to bring the kept
+result up to date. This runs in a worker thread on its own connection to the
+DB, so a refresh that's stuck behind the same lock or slow query doesn't hold
+up the IOLoop.
+
+The number of stale results handed out for each page and the number of
+refreshes that worked or failed are counted in STALE_SERVES and
+STALE_REFRESHES.
+
+'''
+
+import time
+import cPickle
+import functools
+import ConfigParser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+
+import arxivdb
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the longest time in seconds a call with a last good result can take
+if CONF.has_option('sqlite3','latency_budget'):
+    LATENCY_BUDGET = CONF.getfloat('sqlite3','latency_budget')
+else:
+    LATENCY_BUDGET = 1.0
+
+# how long to wait in seconds before refreshing a stale result
+if CONF.has_option('sqlite3','refresh_delay'):
+    REFRESH_DELAY = CONF.getfloat('sqlite3','refresh_delay')
+else:
+    REFRESH_DELAY = 5.0
+
+# the results are kept here, oldest first, pickled so the handlers can't
+# change them by changing the results they're given
+LAST_GOOD = OrderedDict()
+
+# the most results kept at once. search results are the biggest, at around
+# half a MB for 500 matches
+MAX_KEPT_RESULTS = 50
+
+# sqlite calls the progress handler that checks the time every this many VM
+# instructions
+PROGRESS_STEPS = 1000
+
+# the calls to run again, keyed by the key of their result. these stay here
+# until their refresh is done, so each one is only refreshed once at a time
+PENDING_REFRESHES = {}
+
+# the refreshes run one at a time in this thread
+REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# the counters
+STALE_SERVES = {'listing':0,
+                'archive':0,
+                'search':0}
+STALE_REFRESHES = {'ok':0,
+                   'failed':0}
+
+
+
+def call_within_budget(dbfunc, *args, **kwargs):
+    '''
+    This calls dbfunc(*args, **kwargs) with kwargs['database'] set up to
+    give up waiting for locks and interrupt queries after LATENCY_BUDGET
+    seconds, both of which raise sqlite3.OperationalError.
+
+    '''
+
+    database = kwargs['database']
+    deadline = time.time() + LATENCY_BUDGET
+
+    cursor = database.cursor()
+    cursor.execute('pragma busy_timeout')
+    busy_timeout = cursor.fetchone()[0]
+    cursor.execute('pragma busy_timeout = %d' % int(LATENCY_BUDGET*1000.0))
+
+    database.set_progress_handler(lambda: time.time() > deadline,
+                                  PROGRESS_STEPS)
+
+    try:
+        return dbfunc(*args, **kwargs)
+    finally:
+        database.set_progress_handler(None, PROGRESS_STEPS)
+        cursor.execute('pragma busy_timeout = %d' % busy_timeout)
+        cursor.close()
+
+
+
+def keep_result(key, result, version=None):
+    '''
+    This keeps result as the last good result for key, along with the time it
+    was fetched.
+
+    '''
+
+    LAST_GOOD.pop(key, None)
+
+    while len(LAST_GOOD) >= MAX_KEPT_RESULTS:
+        LAST_GOOD.popitem(last=False)
+
+    LAST_GOOD[key] = {'result':cPickle.dumps(result, 2),
+                      'version':version,
+                      'fetched':time.time()}
+
+
+
+def fetch(page, key, version, dbfunc, *args, **kwargs):
+    '''
+    This calls dbfunc(*args, **kwargs), which must have a database kwarg, and
+    keeps its result as the last good result for key. page is one of the
+    pages in STALE_SERVES.
+
+    version is something that changes whenever the result does (e.g. the
+    listing change count), or None if there isn't anything like that. If it's
+    the same as the version of the kept result, the result isn't kept again.
+
+    Returns a tuple of the result and None, or if the DB was busy or slow, the
+    last good result for key and the UNIX time it was fetched. If there isn't
+    a last good result, errors from dbfunc are raised as usual.
+
+    '''
+
+    kept = LAST_GOOD.get(key)
+
+    if kept is None:
+
+        result = dbfunc(*args, **kwargs)
+
+    else:
+
+        try:
+
+            result = call_within_budget(dbfunc, *args, **kwargs)
+
+        except arxivdb.sqlite3.OperationalError as e:
+
+            STALE_SERVES[page] += 1
+            print('DB busy or slow for %s, serving result from %s instead '
+                  '(%s stale results so far for %s pages), error was %s' %
+                  (repr(key),
+                   time.strftime('%Y-%m-%d %H:%M:%S',
+                                 time.gmtime(kept['fetched'])),
+                   STALE_SERVES[page], page, e))
+
+            schedule_refresh(key, dbfunc, args, kwargs)
+            return cPickle.loads(kept['result']), kept['fetched']
+
+    if version is None or kept is None or kept['version'] != version:
+        keep_result(key, result, version=version)
+
+    return result, None
+
+
+
+def schedule_refresh(key, dbfunc, args, kwargs):
+    '''
+    This runs the call for key again after REFRESH_DELAY seconds, unless it's
+    already waiting to be run.
+
+    '''
+
+    if key in PENDING_REFRESHES:
+        return
+
+    PENDING_REFRESHES[key] = (dbfunc, args, kwargs)
+
+    tornado.ioloop.IOLoop.current().call_later(REFRESH_DELAY,
+                                               start_refresh,
+                                               key)
+
+
+
+def start_refresh(key):
+    '''
+    This hands the call for key waiting in PENDING_REFRESHES to the refresh
+    thread. finish_refresh gets its result back on the IOLoop.
+
+    '''
+
+    dbfunc, args, kwargs = PENDING_REFRESHES[key]
+
+    ioloop = tornado.ioloop.IOLoop.current()
+    future = REFRESH_EXECUTOR.submit(run_refresh, dbfunc, args, kwargs)
+    ioloop.add_future(future, functools.partial(finish_refresh, key))
+
+
+
+def run_refresh(dbfunc, args, kwargs):
+    '''
+    This runs dbfunc(*args, **kwargs) in the refresh thread, with its own
+    connection to the DB in place of the server's, since sqlite connections
+    can't be shared between threads.
+
+    '''
+
+    database, cursor = arxivdb.opendb()
+    cursor.close()
+
+    try:
+        return dbfunc(*args, **dict(kwargs, database=database))
+    finally:
+        database.close()
+
+
+
+def finish_refresh(key, future):
+    '''
+    This keeps the result of the refresh for key. Its version isn't known, so
+    the next call to fetch keeps its result too.
+
+    '''
+
+    PENDING_REFRESHES.pop(key, None)
+
+    try:
+
+        result = future.result()
+        keep_result(key, result)
+        STALE_REFRESHES['ok'] += 1
+
+    except Exception as e:
+
+        STALE_REFRESHES['failed'] += 1
+        print('could not refresh the stale result for %s, error was %s' %
+              (repr(key), e))
@@ -18,6 +18,17 @@ var coffee = {
     // this stores the original number of search matches before filtering
     original_nmatches: 0,
 
+    // this stores the arxivids of the papers this user is voting on or
+    // reserving right now, so updates from the vote stream don't get in the
+    // way of these
+    pending_requests: {},
+
+    // the abstracts of the other papers aren't in the listing and voting
+    // pages. these are the arxivids of the other papers on the screen right
+    // now, and the timer for loading their abstracts
+    visible_papers: {},
+    visible_timer: null,
+
     // this handles actual voting
     vote_on_paper: function(arxivid) {
 
@@ -60,6 +71,8 @@ var coffee = {
             var xsrftoken = $('#voting-form input').val();
             var messagebar = $('#message-bar');
 
+            coffee.pending_requests[arxivid] = true;
+
             $.post('/astroph-coffee/vote',
                    {arxivid: arxivid,
                     votetype: votetype,
@@ -113,23 +126,162 @@ var coffee = {
 
 
                    },
-                   'json').fail(function (data) {
-
-                       var alertbox =
-                           '<div data-alert class="alert-box alert radius">' +
-                           'Uh oh, something went wrong with the server, ' +
-                           'please <a href="/astroph-coffee/about">' +
-                           'let us know</a> about this problem!' +
-                           '<a href="#" class="close">&times;</a></div>'
-                       messagebar.html(alertbox);
+                   'json').fail(function (xhr) {
+
+                       var alertbox;
+
+                       // the server says we're going too fast
+                       if (xhr.status == 429 && xhr.responseJSON) {
+                           alertbox =
+                               '<div data-alert class="alert-box warning radius">' +
+                               xhr.responseJSON.message +
+                               '<a href="#" class="close">&times;</a></div>'
+                           messagebar.html(alertbox).fadeIn(52).fadeOut(10000);
+                       }
+                       else {
+                           alertbox =
+                               '<div data-alert class="alert-box alert radius">' +
+                               'Uh oh, something went wrong with the server, ' +
+                               'please <a href="/astroph-coffee/about">' +
+                               'let us know</a> about this problem!' +
+                               '<a href="#" class="close">&times;</a></div>'
+                           messagebar.html(alertbox);
+                       }
                        $(document).foundation();
 
+                   }).always(function () {
+
+                       delete coffee.pending_requests[arxivid];
+
                    });
 
         }
 
     },
 
+    // this opens the vote stream and applies the vote totals and
+    // reservations that other people change to the papers on the page
+    listen_for_updates: function () {
+
+        if (!window.EventSource) {
+            return;
+        }
+
+        var stream = new EventSource('/astroph-coffee/vote-stream');
+
+        stream.onmessage = function (evt) {
+
+            var updates = JSON.parse(evt.data);
+
+            for (var ind = 0; ind < updates.length; ind++) {
+                coffee.apply_update(updates[ind]);
+            }
+
+        };
+
+    },
+
+    // this applies an update from the vote stream to a paper
+    apply_update: function (update) {
+
+        var arxividfilter = '[data-arxivid="' + update.arxivid + '"]';
+
+        if ('nvotes' in update) {
+
+            $('.vote-total').filter(arxividfilter).text(update.nvotes);
+
+            if (update.nvotes != 1) {
+                $('.vote-postfix').filter(arxividfilter).text('votes');
+            }
+            else {
+                $('.vote-postfix').filter(arxividfilter).text('vote');
+            }
+
+        }
+
+        // leave the buttons alone if this user is changing them right now
+        if (!('reserved' in update) || coffee.pending_requests[update.arxivid]) {
+            return;
+        }
+
+        // someone else reserved this paper
+        if (update.reserved == 1) {
+
+            $('.reserve-button[data-reservetype="reserve"]')
+                .filter(arxividfilter)
+                .removeClass('reserve-button')
+                .addClass('disabled')
+                .removeAttr('data-reservetype')
+                .html('Paper already reserved');
+
+        }
+
+        // someone released this paper (or this user did, on another page)
+        else if (update.reserved == 0) {
+
+            $('a.disabled, .reserve-button[data-reservetype="release"]')
+                .filter(arxividfilter)
+                .removeClass('disabled alert')
+                .addClass('reserve-button secondary')
+                .attr('data-reservetype','reserve')
+                .html('<strong>Reserve</strong> for later discussion');
+
+        }
+
+    },
+
+    // this turns the 'Paper already reserved' buttons into release buttons
+    // for the papers reserved by this user. the cached archive listings and
+    // the voting page's paper listing are the same for all users, so they
+    // don't know who reserved what
+    show_user_reservations: function(arxivids) {
+
+        for (var ind = 0; ind < arxivids.length; ind++) {
+
+            var arxividfilter = '[data-arxivid="' + arxivids[ind] + '"]';
+
+            $('a.disabled').filter(arxividfilter)
+                .removeClass('secondary disabled hide')
+                .addClass('reserve-button alert')
+                .attr('data-reservetype','release')
+                .html('Release your reservation');
+
+        }
+
+    },
+
+    // this turns the vote buttons into 'Remove your vote' buttons for the
+    // papers this user has voted for
+    show_user_votes: function(arxivids) {
+
+        for (var ind = 0; ind < arxivids.length; ind++) {
+
+            var arxividfilter = '[data-arxivid="' + arxivids[ind] + '"]';
+
+            $('.vote-button[data-votetype="up"]').filter(arxividfilter)
+                .addClass('alert')
+                .attr('data-votetype','down')
+                .html('Remove your vote');
+
+        }
+
+    },
+
+    // this gets this user's votes and reservations and marks them on the
+    // voting page
+    load_user_overlay: function() {
+
+        $.getJSON('/astroph-coffee/voting-overlay', function (data) {
+
+            if (data.status == 'success') {
+                coffee.show_user_votes(data.results.voted);
+                coffee.show_user_reservations(data.results.reserved);
+            }
+
+        });
+
+    },
+
     // this handles paper reservation
     reserve_paper: function(arxivid) {
 
@@ -165,6 +317,8 @@ var coffee = {
 
         else {
 
+            coffee.pending_requests[arxivid] = true;
+
             $.post('/astroph-coffee/reserve',
                    {arxivid: arxivid,
                     reservetype: reservetype,
@@ -211,17 +365,33 @@ var coffee = {
 
 
                    },
-                   'json').fail(function (data) {
-
-                       var alertbox =
-                           '<div data-alert class="alert-box alert radius">' +
-                           'Uh oh, something went wrong with the server, ' +
-                           'please <a href="/astroph-coffee/about">' +
-                           'let us know</a> about this problem!' +
-                           '<a href="#" class="close">&times;</a></div>'
-                       messagebar.html(alertbox);
+                   'json').fail(function (xhr) {
+
+                       var alertbox;
+
+                       // the server says we're going too fast
+                       if (xhr.status == 429 && xhr.responseJSON) {
+                           alertbox =
+                               '<div data-alert class="alert-box warning radius">' +
+                               xhr.responseJSON.message +
+                               '<a href="#" class="close">&times;</a></div>'
+                           messagebar.html(alertbox).fadeIn(52).fadeOut(10000);
+                       }
+                       else {
+                           alertbox =
+                               '<div data-alert class="alert-box alert radius">' +
+                               'Uh oh, something went wrong with the server, ' +
+                               'please <a href="/astroph-coffee/about">' +
+                               'let us know</a> about this problem!' +
+                               '<a href="#" class="close">&times;</a></div>'
+                           messagebar.html(alertbox);
+                       }
                        $(document).foundation();
 
+                   }).always(function () {
+
+                       delete coffee.pending_requests[arxivid];
+
                    });
 
         }
@@ -229,6 +399,138 @@ var coffee = {
     },
 
 
+    // this loads the abstracts of the other papers with the given arxivids,
+    // puts them into the page, and typesets any math in them
+    load_abstracts: function (arxivids) {
+
+        var toload = $('.lazy-abstract').filter(function () {
+            return arxivids.indexOf($(this).attr('data-arxivid')) != -1;
+        });
+
+        if (toload.length == 0) {
+            return;
+        }
+
+        toload.removeClass('lazy-abstract');
+
+        var loadids = toload.map(function () {
+            return $(this).attr('data-arxivid');
+        }).get();
+
+        // ask for these in batches so a long page doesn't make a huge URL
+        for (var ind = 0; ind < loadids.length; ind += 50) {
+
+            var batch = loadids.slice(ind, ind + 50);
+
+            $.getJSON('/astroph-coffee/abstracts',
+                      {ids: batch.join(',')},
+                      function (data) {
+
+                          var typeset = [];
+
+                          $.each(data.results, function (arxivid, abstract) {
+
+                              var abstractpara = $('.paper-abstract')
+                                  .filter('[data-arxivid="' + arxivid + '"]')
+                                  .find('p')
+                                  .html(abstract.html);
+
+                              // pre-rendered abstracts are already typeset
+                              if (abstract.prerendered) {
+                                  abstractpara.removeClass('mathjax')
+                                      .addClass('no-mathjax');
+                              }
+                              else {
+                                  typeset.push(abstractpara[0]);
+                              }
+
+                          });
+
+                          if (typeset.length > 0 &&
+                              window.MathJax && MathJax.Hub) {
+                              MathJax.Hub.Queue(['Typeset', MathJax.Hub,
+                                                 typeset]);
+                          }
+
+                      }).fail((function (batch) {
+
+                          // try these again the next time they're shown
+                          return function () {
+                              $('.paper-abstract').filter(function () {
+                                  return batch.indexOf(
+                                      $(this).attr('data-arxivid')
+                                  ) != -1;
+                              }).addClass('lazy-abstract');
+                          };
+
+                      })(batch));
+
+        }
+
+    },
+
+    // this loads the abstracts of the other papers on the screen if the other
+    // papers' abstracts are being shown
+    load_visible_abstracts: function () {
+
+        if (!$('#show-other-check').prop('checked')) {
+            return;
+        }
+
+        // without IntersectionObserver, we don't know what's on the screen,
+        // so load everything
+        if (!('IntersectionObserver' in window)) {
+            coffee.load_abstracts($('.lazy-abstract').map(function () {
+                return $(this).attr('data-arxivid');
+            }).get());
+        }
+        else {
+            coffee.load_abstracts(Object.keys(coffee.visible_papers));
+        }
+
+    },
+
+    // this keeps track of which other papers are on the screen (or about to
+    // be), and loads their abstracts as they scroll into view
+    setup_lazy_abstracts: function () {
+
+        var lazyrows = $('.lazy-abstract').closest('.other-paper-listing');
+
+        if (lazyrows.length == 0 || !('IntersectionObserver' in window)) {
+            coffee.load_visible_abstracts();
+            return;
+        }
+
+        var observer = new IntersectionObserver(function (entries) {
+
+            entries.forEach(function (entry) {
+
+                var arxivid = $(entry.target)
+                    .find('.paper-abstract')
+                    .attr('data-arxivid');
+
+                if (entry.isIntersecting) {
+                    coffee.visible_papers[arxivid] = true;
+                }
+                else {
+                    delete coffee.visible_papers[arxivid];
+                }
+
+            });
+
+            // wait for the scrolling to settle before loading anything
+            clearTimeout(coffee.visible_timer);
+            coffee.visible_timer = setTimeout(coffee.load_visible_abstracts,
+                                              100);
+
+        }, {rootMargin: '500px 0px'});
+
+        lazyrows.each(function () {
+            observer.observe(this);
+        });
+
+    },
+
     // this stores the current view settings to a cookie
     store_cookie_settings: function () {
 
@@ -346,6 +648,9 @@ var coffee = {
         $.cookie.json = true;
         coffee.restore_cookie_settings();
 
+        // load the other papers' abstracts as they're shown
+        coffee.setup_lazy_abstracts();
+
         // store the nmatches early
         var nmatch_elem = $('.nmatches');
         if (nmatch_elem.length > 0) {
@@ -359,6 +664,7 @@ var coffee = {
             var arxivid = $(this).data('arxivid');
             var abstractfilter = '[data-arxivid="' + arxivid + '"]';
             var abstractelem = $('.paper-abstract').filter(abstractfilter);
+            coffee.load_abstracts([arxivid]);
             abstractelem.slideToggle('fast');
 
         });
@@ -372,8 +678,9 @@ var coffee = {
 
         });
 
-        // handle clicking on the reserve button
-        $('.reserve-button').on('click', function(evt) {
+        // handle clicking on the reserve button. the vote stream turns other
+        // buttons into reserve buttons later, so this is delegated
+        $(document).on('click', '.reserve-button', function(evt) {
 
             var arxivid = $(this).data('arxivid');
             evt.preventDefault();
@@ -551,6 +858,7 @@ var coffee = {
 
             if ($(this).prop('checked') == true) {
                 $('.other-paper-listing .paper-abstract').slideDown('fast');
+                coffee.load_visible_abstracts();
             }
             else {
                 $('.other-paper-listing .paper-abstract').slideUp('fast');
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+'''test_arxivdb.py - Oct 2026
+
+This tests the voting and replacement functions in arxivdb.py.
+
+'''
+
+import unittest
+
+import testutils
+
+import arxivdb
+
+
+
+class RecordVoteTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+
+        self.database = testutils.sqlite3.connect(testutils.DBPATH)
+        self.database.execute(
+            "insert into arxiv (utcdate, day_serial, article_type, arxiv_id, "
+            "nvotes, voters) values "
+            "('2026-10-16', 1, 'astronomy', 'arXiv:2610.00001', 0, '')"
+        )
+        self.database.commit()
+
+
+    def tearDown(self):
+
+        self.database.close()
+
+
+    def test_vote(self):
+
+        nvotes = arxivdb.record_vote('arXiv:2610.00001', 'user1', 'up',
+                                     database=self.database)
+        self.assertEqual(nvotes, 1)
+
+        nvotes = arxivdb.record_vote('arXiv:2610.00001', 'user1', 'down',
+                                     database=self.database)
+        self.assertEqual(nvotes, 0)
+
+
+    def test_failed_vote(self):
+        '''
+        If part of a vote fails, none of it should be left behind in an open
+        transaction on the caller's connection.
+
+        '''
+
+        self.database.execute(
+            "create temp trigger fail_vote_count "
+            "before update on user_daily_votes "
+            "begin select raise(abort, 'vote count failed'); end"
+        )
+
+        with self.assertRaises(testutils.sqlite3.IntegrityError):
+            arxivdb.record_vote('arXiv:2610.00001', 'user1', 'up',
+                                database=self.database)
+
+        # the next commit on this connection shouldn't save the vote
+        self.database.commit()
+
+        row = self.database.execute(
+            "select nvotes, voters from arxiv "
+            "where arxiv_id = 'arXiv:2610.00001'"
+        ).fetchone()
+        self.assertEqual(tuple(row), (0, ''))
+
+        nvotecounts = self.database.execute(
+            "select count(*) from user_daily_votes"
+        ).fetchone()
+        self.assertEqual(nvotecounts[0], 0)
+
+
+
+class ReplacementTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+
+        self.database = testutils.sqlite3.connect(testutils.DBPATH)
+        self.database.execute(
+            "insert into arxiv (utcdate, day_serial, article_type, arxiv_id, "
+            "title, authors, comments, abstract, nvotes, voters) values "
+            "('2026-10-16', 1, 'astronomy', 'arXiv:2610.00001', "
+            "'A title', 'Jane Doe,Bob Smith', '10 pages', 'An abstract.', "
+            "0, '')"
+        )
+        self.database.commit()
+
+        # an editor tagged the second author by hand
+        arxivdb.force_localauthor_tag('arXiv:2610.00001', [1],
+                                      specaffils=['Physics'],
+                                      database=self.database)
+
+
+    def tearDown(self):
+
+        self.database.close()
+
+
+    def replace(self, authors, comments):
+
+        return arxivdb.update_replacements(
+            {1:{'arxiv':'arXiv:2610.00001',
+                'title':'A title',
+                'authors':authors,
+                'comments':comments,
+                'abstract':''}},
+            database=self.database,
+            tag_locals=False
+        )
+
+
+    def get_article(self):
+
+        return tuple(self.database.execute(
+            "select comments, authors, version, local_authors, "
+            "local_author_indices, local_author_specaffils from arxiv "
+            "where arxiv_id = 'arXiv:2610.00001'"
+        ).fetchone())
+
+
+    def test_same_authors(self):
+        '''
+        A replacement that doesn't change the authors should keep the local
+        author tags.
+
+        '''
+
+        updated = self.replace(['Jane Doe', 'Bob Smith'],
+                               '10 pages, accepted to ApJ')
+
+        self.assertEqual(updated, ['arXiv:2610.00001'])
+        self.assertEqual(self.get_article(),
+                         ('10 pages, accepted to ApJ', 'Jane Doe,Bob Smith',
+                          2, 1, '1', 'Physics'))
+
+
+    def test_changed_authors(self):
+        '''
+        A replacement with new authors should reset the local author tags.
+
+        '''
+
+        updated = self.replace(['Jane Doe', 'Carl New', 'Bob Smith'],
+                               '10 pages')
+
+        self.assertEqual(updated, ['arXiv:2610.00001'])
+        self.assertEqual(self.get_article(),
+                         ('10 pages', 'Jane Doe,Carl New,Bob Smith',
+                          2, 0, '', ''))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+'''test_arxivharvest.py - Oct 2026
+
+This tests the OAI-PMH harvest in arxivharvest.py against a local stand-in for
+arxiv's OAI-PMH server.
+
+'''
+
+import os.path
+import json
+import unittest
+import urlparse
+from datetime import date
+
+import testutils
+
+import arxivharvest
+
+
+
+def oai_record(arxivid, datestamp, categories='astro-ph.GA', deleted=False):
+    '''
+    This returns an OAI-PMH <record> in the arXiv metadata format.
+
+    '''
+
+    if deleted:
+        return ('<record><header status="deleted">'
+                '<identifier>oai:arXiv.org:%s</identifier>'
+                '<datestamp>%s</datestamp>'
+                '</header></record>' % (arxivid, datestamp))
+
+    return ('<record><header>'
+            '<identifier>oai:arXiv.org:%s</identifier>'
+            '<datestamp>%s</datestamp>'
+            '</header><metadata>'
+            '<arXiv xmlns="http://arxiv.org/OAI/arXiv/">'
+            '<id>%s</id><created>%s</created>'
+            '<authors><author><keyname>Doe</keyname>'
+            '<forenames>Jane</forenames></author></authors>'
+            '<title>Article %s</title>'
+            '<categories>%s</categories>'
+            '<comments>10 pages</comments>'
+            '<abstract>An abstract.</abstract>'
+            '</arXiv></metadata></record>' %
+            (arxivid, datestamp, arxivid, datestamp, arxivid, categories))
+
+
+
+def oai_page(records, token=None):
+    '''
+    This returns a ListRecords response with records, and the resumption token
+    for the next page if there is one.
+
+    '''
+
+    return (200,
+            {'Content-Type':'text/xml; charset=utf-8'},
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<ListRecords>%s<resumptionToken>%s</resumptionToken>'
+            '</ListRecords></OAI-PMH>' % (''.join(records), token or ''))
+
+
+
+def oai_error(code):
+    '''
+    This returns an OAI-PMH error response.
+
+    '''
+
+    return (200,
+            {'Content-Type':'text/xml; charset=utf-8'},
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<error code="%s">error</error></OAI-PMH>' % code)
+
+
+
+class HarvestTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+        testutils.empty_directory('cache')
+
+        self.server = testutils.StubServer()
+        self.url = '%s/oai' % self.server.url
+
+        self.page1 = oai_page([oai_record('2610.00001', '2026-10-01'),
+                               oai_record('2610.00002', '2026-10-01'),
+                               oai_record('2610.00003', '2026-10-01')],
+                              token='t1')
+        self.page2 = oai_page([oai_record('2610.00004', '2026-10-02'),
+                               oai_record('2610.00005', '2026-10-02')],
+                              token='t2')
+        self.page3 = oai_page([oai_record('2610.00006', '2026-10-03')])
+
+
+    def tearDown(self):
+
+        self.server.close()
+
+
+    def harvest(self, batchsize=2):
+
+        return arxivharvest.harvest(from_date=date(2026,10,1),
+                                    until_date=date(2026,10,3),
+                                    url=self.url,
+                                    batchsize=batchsize,
+                                    cachedir='cache',
+                                    tag_locals=False)
+
+
+    def checkpoint(self):
+
+        checkpoint_file = os.path.join('cache', arxivharvest.CHECKPOINT_FILE)
+
+        if not os.path.exists(checkpoint_file):
+            return None
+
+        with open(checkpoint_file,'rb') as infd:
+            checkpoints = json.load(infd)
+
+        self.assertTrue(len(checkpoints) <= 1)
+        return checkpoints.values()[0] if checkpoints else None
+
+
+    def request_params(self, n):
+
+        path, headers = self.server.requests[n]
+        return dict(urlparse.parse_qsl(urlparse.urlparse(path).query))
+
+
+    def articles(self):
+
+        database = testutils.sqlite3.connect(testutils.DBPATH)
+        rows = database.execute(
+            'select arxiv_id from arxiv order by arxiv_id'
+        ).fetchall()
+        database.close()
+
+        return [x[0] for x in rows]
+
+
+    def test_resume(self):
+        '''
+        A harvest that fails partway should pick up from the checkpointed
+        (token, index) the next time it runs.
+
+        '''
+
+        # the request for the third page fails the first time
+        self.server.responses.extend([self.page1, self.page2])
+
+        with self.assertRaises(Exception):
+            self.harvest(batchsize=10)
+
+        # the batch was never filled, but the end of the first page was saved
+        checkpoint = self.checkpoint()
+        self.assertEqual((checkpoint['token'], checkpoint['index']),
+                         ('t1', 0))
+        self.assertEqual(checkpoint['datestamp'], '2026-10-01')
+        self.assertEqual(checkpoint['inserted'], 3)
+
+        self.server.requests[:] = []
+        self.server.responses.extend([self.page2, self.page3])
+
+        outcomes = self.harvest(batchsize=10)
+
+        self.assertEqual(self.request_params(0),
+                         {'verb':'ListRecords', 'resumptionToken':'t1'})
+        self.assertEqual(outcomes, {'nrecords':6, 'inserted':6, 'skipped':0})
+        self.assertEqual(self.articles(),
+                         ['arXiv:2610.%05i' % x for x in range(1,7)])
+        self.assertIsNone(self.checkpoint())
+
+
+    def test_resume_index(self):
+        '''
+        The records on the checkpointed page before its index shouldn't be
+        done again.
+
+        '''
+
+        self.server.responses.extend([self.page1, self.page2])
+
+        with self.assertRaises(Exception):
+            self.harvest(batchsize=2)
+
+        checkpoint = self.checkpoint()
+        self.assertEqual((checkpoint['token'], checkpoint['index']),
+                         ('t1', 2))
+        self.assertEqual(checkpoint['inserted'], 5)
+
+        self.server.requests[:] = []
+        self.server.responses.extend([self.page2, self.page3])
+
+        outcomes = self.harvest(batchsize=2)
+
+        # 2610.00004 and 2610.00005 would be counted as skipped if they had
+        # been inserted again
+        self.assertEqual(self.request_params(0),
+                         {'verb':'ListRecords', 'resumptionToken':'t1'})
+        self.assertEqual(outcomes, {'nrecords':6, 'inserted':6, 'skipped':0})
+        self.assertEqual(self.articles(),
+                         ['arXiv:2610.%05i' % x for x in range(1,7)])
+        self.assertIsNone(self.checkpoint())
+
+
+    def test_page_without_articles(self):
+        '''
+        A page without any astro-ph articles should still move the checkpoint
+        on.
+
+        '''
+
+        self.server.responses.extend([
+            oai_page([oai_record('2610.00001', '2026-10-01',
+                                 categories='hep-th'),
+                      oai_record('2610.00002', '2026-10-02', deleted=True)],
+                     token='t1'),
+            oai_page([oai_record('2610.00003', '2026-10-02')], token='t2'),
+        ])
+
+        with self.assertRaises(Exception):
+            self.harvest()
+
+        checkpoint = self.checkpoint()
+        self.assertEqual((checkpoint['token'], checkpoint['index']),
+                         ('t1', 0))
+        self.assertEqual(checkpoint['datestamp'], '2026-10-02')
+        self.assertEqual(checkpoint['nrecords'], 2)
+        self.assertEqual(self.articles(), [])
+
+
+    def test_bad_resumption_token(self):
+        '''
+        If the checkpointed token has expired, the harvest should start over
+        from its from date and skip the articles it already has.
+
+        '''
+
+        # arxiv doesn't list records in datestamp order: an old article
+        # updated recently has a late datestamp
+        records = [('2610.00001', '2026-10-03'),
+                   ('2610.00002', '2026-10-01'),
+                   ('2610.00003', '2026-10-01'),
+                   ('2610.00004', '2026-10-02'),
+                   ('2610.00005', '2026-10-01'),
+                   ('2610.00006', '2026-10-01')]
+
+        def listing(handler):
+            # only list the records in the requested date range
+            query = urlparse.urlparse(handler.path).query
+            params = dict(urlparse.parse_qsl(query))
+            status, headers, body = oai_page(
+                [oai_record(*x) for x in records if x[1] >= params['from']]
+            )
+            handler.send_response(status)
+            for key in headers:
+                handler.send_header(key, headers[key])
+            handler.send_header('Content-Length', '%s' % len(body))
+            handler.end_headers()
+            handler.wfile.write(body)
+
+        self.server.responses.extend([
+            oai_page([oai_record(*x) for x in records[:3]], token='t1'),
+            oai_page([oai_record(*x) for x in records[3:5]], token='t2'),
+        ])
+
+        with self.assertRaises(Exception):
+            self.harvest(batchsize=10)
+
+        checkpoint = self.checkpoint()
+        self.assertEqual((checkpoint['token'], checkpoint['index']),
+                         ('t1', 0))
+        self.assertEqual(checkpoint['datestamp'], '2026-10-03')
+
+        # the token has expired
+        self.server.requests[:] = []
+        self.server.responses.extend([oai_error('badResumptionToken'),
+                                      listing])
+
+        outcomes = self.harvest(batchsize=2)
+
+        self.assertEqual(self.request_params(0),
+                         {'verb':'ListRecords', 'resumptionToken':'t1'})
+        self.assertEqual(self.request_params(1),
+                         {'verb':'ListRecords',
+                          'metadataPrefix':'arXiv',
+                          'set':arxivharvest.OAI_SET,
+                          'from':'2026-10-01',
+                          'until':'2026-10-03'})
+
+        self.assertEqual(outcomes, {'nrecords':9, 'inserted':6, 'skipped':3})
+        self.assertEqual(self.articles(),
+                         ['arXiv:2610.%05i' % x for x in range(1,7)])
+        self.assertIsNone(self.checkpoint())
+
+
+    def test_no_records_match(self):
+        '''
+        An empty date range isn't an error.
+
+        '''
+
+        self.server.responses.append(oai_error('noRecordsMatch'))
+
+        outcomes = self.harvest()
+
+        self.assertEqual(outcomes, {'nrecords':0, 'inserted':0, 'skipped':0})
+        self.assertEqual(self.articles(), [])
+        self.assertIsNone(self.checkpoint())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
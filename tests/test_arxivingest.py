@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+'''test_arxivingest.py - Oct 2026
+
+This tests the nightly ingest pipeline in arxivingest.py against a saved arxiv
+listing served by a local stand-in for arxiv.
+
+'''
+
+import unittest
+
+import testutils
+
+import arxivdb
+import arxivutils
+import arxivingest
+
+
+
+class ConcurrentWriterTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+        testutils.empty_directory('cache')
+
+        with open(testutils.fixture_path('astro-ph-new.html'),'rb') as infd:
+            self.listing = infd.read()
+
+        self.server = testutils.StubServer()
+        self.server.responses.append(
+            (200, {'Content-Type':'text/html; charset=utf-8'}, self.listing)
+        )
+
+        self.find_published_article = arxivdb.find_published_article
+
+
+    def tearDown(self):
+
+        arxivdb.find_published_article = self.find_published_article
+        self.server.close()
+
+
+    def test_write_during_tag_stage(self):
+        '''
+        The ingest should still publish the day's articles if another
+        connection commits while the tag stage is looking up articles.
+
+        '''
+
+        lookups = []
+
+        def find_published_article(*args, **kwargs):
+
+            lookups.append(args[-1])
+
+            # commit a new session from a second connection, like the server
+            # does when someone views a page during the ingest
+            if len(lookups) == 3:
+                writer = testutils.sqlite3.connect(testutils.DBPATH)
+                writer.execute("insert into sessions (token, ipaddress) "
+                               "values ('concurrent', '127.0.0.1')")
+                writer.commit()
+                writer.close()
+
+            return self.find_published_article(*args, **kwargs)
+
+        arxivdb.find_published_article = find_published_article
+
+        papers, crosslists, replacements = arxivutils.parse_arxiv_listing(
+            self.listing.decode('utf-8')
+        )
+
+        report = arxivingest.ingest_arxiv_listing(
+            url='%s/list/astro-ph/new' % self.server.url,
+            conditional=False,
+            archive=False,
+            tag_locals=False
+        )
+
+        self.assertTrue(len(lookups) > 3)
+        self.assertEqual(report['status'], 'ok')
+        self.assertEqual(report['counts']['inserted'],
+                         len(papers) + len(crosslists))
+
+        database = testutils.sqlite3.connect(testutils.DBPATH)
+        narticles = database.execute('select count(*) from arxiv').fetchone()
+        nsessions = database.execute(
+            "select count(*) from sessions where token = 'concurrent'"
+        ).fetchone()
+        database.close()
+
+        self.assertEqual(narticles[0], len(papers) + len(crosslists))
+        self.assertEqual(nsessions[0], 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+'''test_arxivutils.py - Oct 2026
+
+This tests fetching the arxiv listings with conditional requests, retries, and
+timeouts against a local stand-in for arxiv.
+
+'''
+
+import os.path
+import json
+import time
+import unittest
+
+import testutils
+
+import arxivutils
+import arxivingest
+
+
+
+class FetchTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+        testutils.empty_directory('cache')
+
+        with open(testutils.fixture_path('astro-ph-new.html'),'rb') as infd:
+            self.listing = infd.read()
+
+        self.server = testutils.StubServer()
+        self.url = '%s/list/astro-ph/new' % self.server.url
+
+        # make a new session with short waits between retries
+        self.backoff = arxivutils.REQUEST_BACKOFF
+        self.retries = arxivutils.REQUEST_RETRIES
+        arxivutils.REQUEST_BACKOFF = 0.1
+        arxivutils.HTTP_SESSION = None
+
+
+    def tearDown(self):
+
+        arxivutils.REQUEST_BACKOFF = self.backoff
+        arxivutils.REQUEST_RETRIES = self.retries
+        arxivutils.HTTP_SESSION = None
+        self.server.close()
+
+
+    def listing_response(self, etag):
+
+        return (200,
+                {'Content-Type':'text/html; charset=utf-8',
+                 'ETag':etag,
+                 'Last-Modified':'Mon, 19 Oct 2026 00:30:00 GMT'},
+                self.listing)
+
+
+    def load_state_file(self):
+
+        with open(os.path.join('cache', arxivutils.FETCH_STATE_FILE),
+                  'rb') as infd:
+            return json.load(infd)[self.url]
+
+
+    def count_changes(self):
+
+        database = testutils.sqlite3.connect(testutils.DBPATH)
+        narticles, nchanges = database.execute(
+            'select (select count(*) from arxiv), '
+            '(select total(changes) from listing_changes)'
+        ).fetchone()
+        database.close()
+
+        return narticles, nchanges
+
+
+    def ingest(self):
+
+        return arxivingest.ingest_arxiv_listing(url=self.url,
+                                                archive=False,
+                                                tag_locals=False)
+
+
+    def test_conditional_ingest(self):
+        '''
+        The listing should only be ingested again if it changed, and the
+        fetch state file should be kept up to date.
+
+        '''
+
+        self.server.responses.append(self.listing_response('"v1"'))
+        report = self.ingest()
+
+        self.assertEqual(report['status'], 'ok')
+        self.assertTrue(report['counts']['inserted'] > 0)
+
+        state = self.load_state_file()
+        self.assertEqual(state['etag'], '"v1"')
+        ingested = self.count_changes()
+
+        # a 304 Not Modified
+        self.server.responses.append((304, {'ETag':'"v1"'}, ''))
+        report = self.ingest()
+
+        path, headers = self.server.requests[-1]
+        self.assertEqual(headers['if-none-match'], '"v1"')
+        self.assertEqual(headers['if-modified-since'],
+                         'Mon, 19 Oct 2026 00:30:00 GMT')
+        self.assertEqual(report['status'], 'notmodified')
+        self.assertEqual(self.count_changes(), ingested)
+
+        newstate = self.load_state_file()
+        self.assertEqual(newstate['etag'], '"v1"')
+        self.assertEqual(newstate['sha1'], state['sha1'])
+        self.assertTrue(newstate['fetched'] > state['fetched'])
+
+        # the same listing with a new ETag
+        self.server.responses.append(self.listing_response('"v2"'))
+        report = self.ingest()
+
+        self.assertEqual(report['status'], 'unchanged')
+        self.assertEqual(self.count_changes(), ingested)
+
+        newstate = self.load_state_file()
+        self.assertEqual(newstate['etag'], '"v2"')
+        self.assertEqual(newstate['sha1'], state['sha1'])
+
+
+    def test_retry(self):
+        '''
+        A 429 and a 503 should be retried, waiting as long as Retry-After
+        says to.
+
+        '''
+
+        self.server.responses.extend([(429, {'Retry-After':'1'}, ''),
+                                      (503, {}, ''),
+                                      self.listing_response('"v1"')])
+
+        start = time.time()
+        fetched = arxivutils.fetch_page(self.url)
+
+        self.assertEqual(fetched['status'], 'ok')
+        self.assertEqual(fetched['html'], self.listing.decode('utf-8'))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertTrue(time.time() - start >= 1.0)
+
+
+    def test_retries_run_out(self):
+        '''
+        The fetch should fail once the retries run out, and leave the fetch
+        state alone.
+
+        '''
+
+        arxivutils.REQUEST_RETRIES = 2
+        self.server.responses.extend([(503, {}, '')]*3 +
+                                     [self.listing_response('"v1"')])
+
+        report = self.ingest()
+
+        self.assertEqual(report['status'], 'failed')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertFalse(
+            os.path.exists(os.path.join('cache', arxivutils.FETCH_STATE_FILE))
+        )
+        self.assertEqual(self.count_changes(), (0, 0.0))
+
+
+    def test_timeout(self):
+        '''
+        A response that stalls should time out and be retried.
+
+        '''
+
+        def stall(handler):
+            time.sleep(1.0)
+
+        arxivutils.REQUEST_RETRIES = 1
+        self.server.responses.extend([stall, self.listing_response('"v1"')])
+
+        start = time.time()
+        fetched = arxivutils.fetch_page(self.url, timeout=(1.0, 0.2))
+
+        self.assertEqual(fetched['status'], 'ok')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(time.time() - start < 1.0)
+
+        # and fail if there aren't any retries left
+        self.server.responses.extend([stall, stall])
+
+        start = time.time()
+        fetched = arxivutils.fetch_page(self.url, timeout=(1.0, 0.2))
+
+        self.assertEqual(fetched['status'], 'failed')
+        self.assertTrue(time.time() - start < 1.0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
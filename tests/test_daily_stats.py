@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+'''test_daily_stats.py - Oct 2026
+
+This tests the triggers that keep the daily_stats table and its version up to
+date as articles are voted on and tagged.
+
+'''
+
+import unittest
+from datetime import datetime
+
+from pytz import utc
+
+import testutils
+
+import arxivdb
+import arxivutils
+
+
+
+class DailyStatsTests(unittest.TestCase):
+
+    def setUp(self):
+
+        testutils.make_database()
+
+        with open(testutils.fixture_path('astro-ph-new.html'),'rb') as infd:
+            papers, crosslists, replacements = (
+                arxivutils.parse_arxiv_listing(infd.read().decode('utf-8'))
+            )
+
+        arxivdb.insert_articles(
+            arxivutils.make_arxivdict(datetime.now(tz=utc),
+                                      papers, crosslists, {}),
+            tag_locals=False
+        )
+
+        self.database = testutils.sqlite3.connect(testutils.DBPATH)
+        self.arxivids = [x[0] for x in self.database.execute(
+            'select arxiv_id from arxiv order by day_serial limit 2'
+        ).fetchall()]
+
+
+    def tearDown(self):
+
+        self.database.close()
+
+
+    def get_stats(self):
+
+        return self.database.execute(
+            'select npapers, nlocal, nvoted from daily_stats order by utcdate'
+        ).fetchall()
+
+
+    def test_votes(self):
+        '''
+        Only votes that change whether an article has any votes should change
+        daily_stats and its version.
+
+        '''
+
+        version = arxivdb.get_daily_stats_version()
+        npapers = self.get_stats()[0][0]
+
+        arxivdb.record_vote(self.arxivids[0], 'user1', 'up')
+        self.assertEqual(self.get_stats(), [(npapers, 0, 1)])
+        self.assertEqual(arxivdb.get_daily_stats_version(), version + 1)
+
+        for username in ('user2', 'user3', 'user4', 'user5'):
+            arxivdb.record_vote(self.arxivids[0], username, 'up')
+        arxivdb.record_vote(self.arxivids[0], 'user5', 'down')
+
+        self.assertEqual(self.get_stats(), [(npapers, 0, 1)])
+        self.assertEqual(arxivdb.get_daily_stats_version(), version + 1)
+
+        for username in ('user1', 'user2', 'user3', 'user4'):
+            arxivdb.record_vote(self.arxivids[0], username, 'down')
+
+        self.assertEqual(self.get_stats(), [(npapers, 0, 0)])
+        self.assertEqual(arxivdb.get_daily_stats_version(), version + 2)
+
+
+    def test_local_authors(self):
+        '''
+        Tagging an article as local should change daily_stats; setting the
+        tag again to an equivalent value shouldn't.
+
+        '''
+
+        version = arxivdb.get_daily_stats_version()
+        npapers = self.get_stats()[0][0]
+
+        self.database.execute('update arxiv set local_authors = 1 '
+                              'where arxiv_id = ?', (self.arxivids[1],))
+        self.database.commit()
+        self.assertEqual(self.get_stats(), [(npapers, 1, 0)])
+        self.assertEqual(arxivdb.get_daily_stats_version(), version + 1)
+
+        self.database.execute('update arxiv set local_authors = 2 '
+                              'where arxiv_id = ?', (self.arxivids[1],))
+        self.database.commit()
+        self.assertEqual(self.get_stats(), [(npapers, 1, 0)])
+        self.assertEqual(arxivdb.get_daily_stats_version(), version + 1)
+
+        # the counts should match what rebuild_daily_stats makes
+        arxivdb.rebuild_daily_stats()
+        self.assertEqual(self.get_stats(), [(npapers, 1, 0)])
+
+
+    def test_move_day(self):
+        '''
+        Moving an article to another day should move it in daily_stats.
+
+        '''
+
+        npapers = self.get_stats()[0][0]
+
+        self.database.execute("update arxiv set utcdate = '2018-01-01', "
+                              "nvotes = 2 where arxiv_id = ?",
+                              (self.arxivids[0],))
+        self.database.commit()
+
+        self.assertEqual(self.get_stats(), [(1, 0, 1), (npapers - 1, 0, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+'''test_staleresults.py - Oct 2026
+
+This tests serving stale results while the DB is busy, and refreshing them in
+the background.
+
+'''
+
+import time
+import threading
+
+import tornado.gen
+import tornado.testing
+
+import testutils
+
+import arxivdb
+import staleresults
+
+
+
+class StaleResultsTests(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+
+        super(StaleResultsTests, self).setUp()
+
+        testutils.make_database()
+        self.database = testutils.sqlite3.connect(testutils.DBPATH)
+
+        staleresults.LAST_GOOD.clear()
+        staleresults.PENDING_REFRESHES.clear()
+        self.refresh_delay = staleresults.REFRESH_DELAY
+        staleresults.REFRESH_DELAY = 0.0
+
+
+    def tearDown(self):
+
+        staleresults.REFRESH_DELAY = self.refresh_delay
+        self.database.close()
+
+        super(StaleResultsTests, self).tearDown()
+
+
+    @tornado.testing.gen_test
+    def test_refresh_in_background(self):
+        '''
+        A stale result should be served while the DB is busy, and refreshed
+        in another thread on another connection without blocking the IOLoop.
+
+        '''
+
+        calls = []
+
+        def dbfunc(value, database=None):
+
+            calls.append((threading.current_thread().name, database))
+
+            if value == 'busy':
+                raise arxivdb.sqlite3.OperationalError('database is locked')
+            elif value == 'slow':
+                time.sleep(0.5)
+
+            return database.execute('select ?', (value,)).fetchone()[0]
+
+        result, stale_since = staleresults.fetch(
+            'listing', ('test', 1), None, dbfunc, 'first',
+            database=self.database
+        )
+        self.assertEqual((result, stale_since), ('first', None))
+
+        # the server's connection is busy, and the refresh on its own
+        # connection is slow
+        def busy_then_slow(value, database=None):
+            if database is self.database:
+                return dbfunc('busy', database=database)
+            return dbfunc('slow', database=database)
+
+        nrefreshed = staleresults.STALE_REFRESHES['ok']
+
+        result, stale_since = staleresults.fetch(
+            'listing', ('test', 1), None, busy_then_slow, 'second',
+            database=self.database
+        )
+        self.assertEqual(result, 'first')
+        self.assertTrue(stale_since is not None)
+        self.assertTrue(('test', 1) in staleresults.PENDING_REFRESHES)
+
+        # the IOLoop should keep running while the refresh does
+        ticks = []
+        start = time.time()
+        while ('test', 1) in staleresults.PENDING_REFRESHES:
+            ticks.append(time.time() - start)
+            yield tornado.gen.sleep(0.01)
+
+        self.assertTrue(len(ticks) > 10)
+        self.assertTrue(max(y - x for x, y in zip(ticks, ticks[1:])) < 0.25)
+
+        refresh_thread, refresh_database = calls[-1]
+        self.assertNotEqual(refresh_thread,
+                            threading.current_thread().name)
+        self.assertTrue(refresh_database is not self.database)
+
+        self.assertEqual(staleresults.STALE_REFRESHES['ok'], nrefreshed + 1)
+
+        # while the DB is still busy, the refreshed result should be served
+        result, stale_since = staleresults.fetch(
+            'listing', ('test', 1), None, busy_then_slow, 'third',
+            database=self.database
+        )
+        self.assertEqual(result, 'slow')
+        self.assertTrue(stale_since >= start)
+
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
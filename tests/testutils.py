@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+'''testutils.py - Oct 2026
+
+This sets up a scratch run directory for the tests, and has a small local HTTP
+server that stands in for arxiv.
+
+The server modules read conf/astroph.conf relative to the current directory
+when they're imported, so import this before any of them. It makes a temporary
+directory with a copy of src/conf and empty data, cache, and logs directories,
+changes into it, and puts src on the path. make_database makes a fresh database
+there from src/data/astroph-sqlite.sql.
+
+Run the tests from the base astroph-coffee directory with:
+
+$ python -m unittest discover -s tests
+
+'''
+
+import os
+import os.path
+import sys
+import atexit
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+BASEDIR = os.path.dirname(TESTDIR)
+SRCDIR = os.path.join(BASEDIR, 'src')
+
+RUNDIR = tempfile.mkdtemp(prefix='astroph-coffee-tests-')
+atexit.register(shutil.rmtree, RUNDIR, True)
+
+shutil.copytree(os.path.join(SRCDIR, 'conf'), os.path.join(RUNDIR, 'conf'))
+
+# the ingest's math renders aren't tested here, so don't run node for them
+with open(os.path.join(RUNDIR, 'conf', 'astroph.conf'),'rb') as infd:
+    conf = infd.read()
+with open(os.path.join(RUNDIR, 'conf', 'astroph.conf'),'wb') as outfd:
+    outfd.write(conf.replace('\nnode = node\n',
+                             '\nnode = /nonexistent/node\n'))
+for subdir in ('data', 'cache', 'logs'):
+    os.makedirs(os.path.join(RUNDIR, subdir))
+
+os.chdir(RUNDIR)
+sys.path.insert(0, SRCDIR)
+
+try:
+    from pysqlite2 import dbapi2 as sqlite3
+except:
+    import sqlite3
+
+DBPATH = os.path.join(RUNDIR, 'data', 'astroph.sqlite')
+
+
+
+def make_database():
+    '''
+    This makes a fresh database at DBPATH, removing any that's already there.
+
+    '''
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DBPATH + suffix):
+            os.remove(DBPATH + suffix)
+
+    with open(os.path.join(SRCDIR, 'data', 'astroph-sqlite.sql'),'rb') as infd:
+        schema = infd.read()
+
+    database = sqlite3.connect(DBPATH)
+    database.executescript(schema)
+    database.close()
+
+
+
+def empty_directory(path):
+    '''
+    This removes everything in path.
+
+    '''
+
+    for item in os.listdir(path):
+        itempath = os.path.join(path, item)
+        if os.path.isdir(itempath):
+            shutil.rmtree(itempath)
+        else:
+            os.remove(itempath)
+
+
+
+def fixture_path(name):
+    '''
+    This returns the path to the saved arxiv page name in
+    benchmarks/fixtures.
+
+    '''
+
+    return os.path.join(BASEDIR, 'benchmarks', 'fixtures', name)
+
+
+
+class StubServer(object):
+    '''
+    This is a local HTTP server that stands in for arxiv.
+
+    Each GET request is answered by the next item of the responses list, a
+    tuple of (status, headers dict, body), or a callable that takes the
+    request handler and writes the response itself (e.g. to stall). The
+    request paths and headers are kept in requests.
+
+    '''
+
+    def __init__(self):
+
+        self.responses = []
+        self.requests = []
+
+        stub = self
+
+        class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+
+                stub.requests.append((self.path, dict(self.headers)))
+
+                if stub.responses:
+                    response = stub.responses.pop(0)
+                else:
+                    response = (404, {}, 'no more responses')
+
+                if callable(response):
+                    response(self)
+                    return
+
+                status, headers, body = response
+
+                self.send_response(status)
+                for key in headers:
+                    self.send_header(key, headers[key])
+                self.send_header('Content-Length', '%s' % len(body))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class StubHTTPServer(SocketServer.ThreadingMixIn,
+                             BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = StubHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def close(self):
+        '''
+        This stops the server.
+
+        '''
+
+        self.server.shutdown()
+        self.server.server_close()